@@ -2,17 +2,175 @@
 
 """Defines the external facing API for usage in code"""
 
-from contextlib import contextmanager
+from contextlib import ExitStack, contextmanager
+from typing import Optional
 
+import panopticon.aio
+import panopticon.binary
+import panopticon.collector
+import panopticon.counters
+import panopticon.perfetto
+import panopticon.ring
+import panopticon.sampler
+import panopticon.segment
 import panopticon.trace
 import panopticon.version
+from panopticon.predicate import Predicate
 from panopticon.tracer import AsyncioTracer
 
 __version__ = panopticon.version.version
 
 
 @contextmanager
-def record_trace(trace_file: str):
-    with open(trace_file, "w") as out:
-        with AsyncioTracer(trace=panopticon.trace.StreamingTrace(out)):
-            yield
+def record_trace(
+    trace_file: str,
+    buffered: bool = True,
+    format: str = "json",
+    mode: str = "stream",
+    capacity: int = 100000,
+    window: Optional[float] = None,
+    max_bytes: Optional[int] = 64 * 1024 * 1024,
+    max_seconds: Optional[float] = None,
+    keep: Optional[int] = None,
+    sample_hz: Optional[float] = None,
+    all_threads: bool = False,
+    instrument_loop: bool = False,
+    skip: Optional[Predicate] = None,
+    counter_interval: Optional[float] = None,
+    trace_gc: bool = False,
+):
+    """Traces the enclosed block into trace_file.
+
+    By default events are batched and written from a background thread;
+    the yielded trace reports any events it had to drop in `dropped`.
+    Use format="binary" for the compact panopticon format, which can be
+    converted back with `python -m panopticon --convert`, or "perfetto"
+    for protobuf traces that ui.perfetto.dev can open.
+
+    mode="ring" keeps only the last `capacity` events per thread (within
+    `window` seconds), and writes them out as json on SIGUSR2 or when an
+    exception escapes the block.
+
+    mode="segments" splits the trace into json files of at most
+    `max_bytes` or `max_seconds` each, numbered before the extension of
+    trace_file, optionally keeping only the last `keep` of them.
+
+    With `sample_hz`, thread stacks are sampled that many times a second
+    instead of tracing every call, which is much cheaper but only shows
+    calls that last longer than a sample.
+
+    With `all_threads`, threads that are already running are traced as
+    well (see Tracer), such as the workers of an existing thread pool.
+
+    With `instrument_loop`, the callbacks asyncio event loops run are
+    timed as well, along with how long they wait (see aio.LoopTracer).
+
+    Code matching `skip` (see panopticon.predicate) isn't traced.
+
+    With `counter_interval`, memory, GC, thread and task counters are
+    sampled into the trace that often (see counters.CounterSampler).
+
+    With `trace_gc`, every garbage collection is recorded as an event on
+    the thread that triggered it (see collector.GCTracer).
+    """
+
+    if format not in ("json", "binary", "perfetto"):
+        raise ValueError(f"Unknown trace format {format}")
+    if mode not in ("stream", "ring", "segments"):
+        raise ValueError(f"Unknown trace mode {mode}")
+
+    if mode == "ring":
+        trace = panopticon.ring.RingTrace(trace_file, capacity, window)
+        trace.install()
+        try:
+            with _tracer(
+                trace,
+                sample_hz,
+                all_threads,
+                instrument_loop,
+                skip,
+                counter_interval,
+                trace_gc,
+            ):
+                yield trace
+        except BaseException:
+            trace.dump()
+            raise
+        finally:
+            trace.uninstall()
+        return
+
+    if mode == "segments":
+        trace = panopticon.segment.SegmentedTrace(
+            trace_file, max_bytes, max_seconds, keep
+        )
+        try:
+            with _tracer(
+                trace,
+                sample_hz,
+                all_threads,
+                instrument_loop,
+                skip,
+                counter_interval,
+                trace_gc,
+            ):
+                yield trace
+        finally:
+            trace.close()
+        return
+
+    with open(trace_file, "w" if format == "json" else "wb") as out:
+        if format == "binary":
+            trace = panopticon.binary.BinaryTrace(out)
+        elif format == "perfetto":
+            trace = panopticon.perfetto.PerfettoTrace(out)
+        elif buffered:
+            trace = panopticon.trace.BufferedStreamingTrace(out)
+        else:
+            trace = panopticon.trace.StreamingTrace(out)
+
+        try:
+            with _tracer(
+                trace,
+                sample_hz,
+                all_threads,
+                instrument_loop,
+                skip,
+                counter_interval,
+                trace_gc,
+            ):
+                yield trace
+        finally:
+            trace.close()
+
+
+def _tracer(
+    trace,
+    sample_hz: Optional[float],
+    all_threads: bool,
+    instrument_loop: bool,
+    skip: Optional[Predicate],
+    counter_interval: Optional[float],
+    trace_gc: bool,
+):
+    if sample_hz:
+        tracer = panopticon.sampler.Sampler(
+            trace=trace, hz=sample_hz, skip=skip
+        )
+    else:
+        tracer = AsyncioTracer(trace=trace, skip=skip, all_threads=all_threads)
+
+    if not instrument_loop and not counter_interval and not trace_gc:
+        return tracer
+
+    stack = ExitStack()
+    if trace_gc:
+        stack.enter_context(panopticon.collector.GCTracer(trace))
+    if counter_interval:
+        stack.enter_context(
+            panopticon.counters.CounterSampler(trace, counter_interval)
+        )
+    if instrument_loop:
+        stack.enter_context(panopticon.aio.LoopTracer(trace))
+    stack.enter_context(tracer)
+    return stack
@@ -5,11 +5,18 @@ A tracing module to visualize code execution for debugging and understanding.
 """
 
 import argparse
+import contextlib
 import json
 import os
 import sys
 
+from . import clock
+from .aio import LoopTracer
+from .binary import convert
+from .collector import GCTracer
+from .counters import CounterSampler
 from .post import flatten
+from .sampler import Sampler
 from .tracer import AsyncioTracer
 
 
@@ -20,6 +27,41 @@ def main():
     )
 
     parser.add_argument("-o", "--output")
+    parser.add_argument(
+        "--thread-time",
+        action="store_true",
+        help="Record thread cpu time with every event",
+    )
+    parser.add_argument(
+        "--min-duration",
+        type=float,
+        help="Only record calls that take at least this many seconds",
+    )
+    parser.add_argument(
+        "--complete",
+        action="store_true",
+        help="Record each call as a single event with its duration",
+    )
+    parser.add_argument(
+        "--instrument-loop",
+        action="store_true",
+        help="Time asyncio loop callbacks and how long they wait to run",
+    )
+    parser.add_argument(
+        "--counter-interval",
+        type=float,
+        help="Sample memory, GC, thread and task counters this often",
+    )
+    parser.add_argument(
+        "--trace-gc",
+        action="store_true",
+        help="Record garbage collections and how long they take",
+    )
+    parser.add_argument(
+        "--sample-hz",
+        type=float,
+        help="Sample all stacks this many times a second instead of tracing",
+    )
 
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument(
@@ -30,6 +72,14 @@ def main():
     group.add_argument(
         "-f", "--flatten", help="Flatten a trace for easier readability"
     )
+    group.add_argument(
+        "--convert", help="Convert a binary trace to Catapult json"
+    )
+    group.add_argument(
+        "--measure-overhead",
+        action="store_true",
+        help="Report the cost of timestamping events in each configuration",
+    )
 
     parser.add_argument(
         "arguments",
@@ -47,9 +97,25 @@ def main():
             print(json.dump(flattened_trace))
         return
 
+    if args.measure_overhead:
+        for name, ns in clock.measure_overhead().items():
+            print(f"{ns:8.1f} ns/event  {name}")
+        return
+
+    clock.configure(thread_time=args.thread_time)
+
+    if args.convert:
+        if args.output:
+            with open(args.output, "w") as outfile:
+                convert(args.convert, outfile)
+        else:
+            convert(args.convert, sys.stdout)
+        return
+
     # Adapted from trace.py
+    at = _tracer(args)
     if args.command:
-        with AsyncioTracer() as at:
+        with _instruments(args, at.get_trace()), at:
             eval(args.command)
     elif args.path:
         sys.argv = [args.path, *args.arguments]
@@ -65,7 +131,7 @@ def main():
             "__package__": None,
             "__cached__": None,
         }
-        with AsyncioTracer() as at:
+        with _instruments(args, at.get_trace()), at:
             exec(code, run_globals)
 
     trace = at.get_trace()
@@ -76,5 +142,25 @@ def main():
         print(str(trace), file=sys.stderr)
 
 
+def _tracer(args):
+    if args.sample_hz:
+        return Sampler(hz=args.sample_hz)
+    return AsyncioTracer(
+        min_duration=args.min_duration, complete=args.complete
+    )
+
+
+def _instruments(args, trace):
+    """Whatever else the command line asked to record next to calls"""
+    stack = contextlib.ExitStack()
+    if args.trace_gc:
+        stack.enter_context(GCTracer(trace))
+    if args.counter_interval:
+        stack.enter_context(CounterSampler(trace, args.counter_interval))
+    if args.instrument_loop:
+        stack.enter_context(LoopTracer(trace))
+    return stack
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,250 @@
+#!/bin/env python3
+
+"""
+Controls tracing of a running process through a Unix socket.
+
+Servers call install() once at startup, and can be traced on demand
+from then on without restarting them. Nothing is traced, and nothing
+costs anything, until a client asks the agent to start.
+
+Clients send one json object per line and get one back for each, with
+an "error" key if the request failed:
+
+    {"command": "start", "path": "/tmp/x.trace", "skip_modules": ["db"]}
+    {"command": "status"}
+    {"command": "stop"}
+    {"command": "fetch"}
+
+"start" takes the options of record_trace (mode, format, capacity,
+max_bytes, sample_hz, ...), and `skip_modules` or `skip_prefixes`
+instead of a skip predicate. Threads that are already running are
+traced too, though before Python 3.12 only once they call
+tracer.attach(); sampling (`sample_hz`) covers them on any version.
+
+"dump" writes out the events a ring mode trace retains, and "fetch"
+returns the contents of the last json trace that was stopped. See
+request() for a client.
+"""
+
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+from contextlib import ExitStack
+from typing import Any, Dict, Optional
+
+from panopticon.predicate import FilePrefix, Module
+from panopticon.trace import _untraced_threads
+
+logger = logging.getLogger(__name__)
+
+_agent = None
+
+
+def install(path: Optional[str] = None) -> "Agent":
+    """Starts the agent of this process, listening on `path`.
+
+    The socket defaults to /tmp/panopticon-{pid}.sock, and is only
+    accessible to the user running the process.
+    """
+    global _agent
+    if _agent is None:
+        _agent = Agent(path or f"/tmp/panopticon-{os.getpid()}.sock")
+        _agent.start()
+    return _agent
+
+
+def uninstall():
+    """Stops any tracing started through the agent, and the agent"""
+    global _agent
+    if _agent is not None:
+        _agent.close()
+        _agent = None
+
+
+def request(address: str, command: str, **options) -> Dict[str, Any]:
+    """Sends a single command to the agent listening on address"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(address)
+        with client.makefile("rw") as stream:
+            stream.write(json.dumps({"command": command, **options}) + "\n")
+            stream.flush()
+            return json.loads(stream.readline())
+
+
+class Agent:
+    """Serves the commands of one client at a time from a thread of its
+    own, which is never traced"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._server = None
+        self._thread = None
+
+        self._tracing: Optional[ExitStack] = None
+        self._trace = None
+        self._options: Dict[str, Any] = {}
+        self._last: Optional[Dict[str, Any]] = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # Left over by a process that died
+
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._bind_privately()
+        self._server.listen()
+
+        self._thread = threading.Thread(
+            target=self._run, name="panopticon-agent", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def _bind_privately(self):
+        """Binds to path, which only this user can connect to.
+
+        The socket is created in a directory no one else can enter and
+        only moved to path once its permissions are restricted, as the
+        umask that would do so is shared by every thread.
+        """
+        private = tempfile.mkdtemp(dir=os.path.dirname(self.path) or ".")
+        address = os.path.join(private, "agent.sock")
+        try:
+            self._server.bind(address)
+            os.chmod(address, 0o600)
+            os.rename(address, self.path)
+        finally:
+            if os.path.exists(address):
+                os.unlink(address)
+            os.rmdir(private)
+
+    def close(self):
+        if self._tracing is not None:
+            self._stop()
+
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)  # Wakes up accept()
+        except OSError:
+            pass
+        self._server.close()
+        self._thread.join()
+
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _run(self):
+        sys.setprofile(None)
+        me = threading.get_ident()
+        _untraced_threads.add(me)
+        try:
+            while True:
+                try:
+                    connection, _ = self._server.accept()
+                except OSError:
+                    return  # Closed
+
+                with connection, connection.makefile("rw") as stream:
+                    self._serve(stream)
+        finally:
+            _untraced_threads.discard(me)
+
+    def _serve(self, stream):
+        for line in stream:
+            try:
+                message = json.loads(line)
+                command = message.pop("command")
+                handler = getattr(self, f"_{command}_command", None)
+                if handler is None:
+                    raise ValueError(f"Unknown command {command}")
+                response = handler(**message)
+            except Exception as e:
+                logger.exception("Agent command failed")
+                response = {"error": f"{type(e).__name__}: {e}"}
+
+            try:
+                stream.write(json.dumps(response) + "\n")
+                stream.flush()
+            except OSError:
+                return  # The client went away
+
+    def _start_command(
+        self,
+        path: str,
+        skip_modules=(),
+        skip_prefixes=(),
+        **options,
+    ):
+        # Imported here, the package imports everything else
+        from panopticon import record_trace
+
+        if self._tracing is not None:
+            raise RuntimeError(f"Already tracing to {self._options}")
+        if "skip" in options:
+            raise ValueError(
+                "Use skip_modules or skip_prefixes instead of skip"
+            )
+
+        skip = None
+        if skip_modules:
+            skip = Module(*skip_modules)
+        if skip_prefixes:
+            prefixes = FilePrefix(*skip_prefixes)
+            skip = prefixes if skip is None else skip | prefixes
+
+        stack = ExitStack()
+        self._trace = stack.enter_context(
+            # Existing threads are traced unless the client says otherwise
+            record_trace(path, skip=skip, **{"all_threads": True, **options})
+        )
+        self._tracing = stack
+        self._options = {"path": path, **options}
+        return self._status_command()
+
+    def _stop_command(self):
+        if self._tracing is None:
+            raise RuntimeError("Not tracing")
+        return self._stop()
+
+    def _stop(self):
+        try:
+            self._tracing.close()
+        finally:
+            self._tracing = None
+
+        self._last = dict(self._options)
+        segments = getattr(self._trace, "segments", None)
+        if segments is not None:
+            self._last["segments"] = list(segments)
+        self._trace = None
+        return self._last
+
+    def _status_command(self):
+        return {
+            "tracing": self._tracing is not None,
+            **(self._options if self._tracing is not None else {}),
+        }
+
+    def _dump_command(self, path: Optional[str] = None):
+        dump = getattr(self._trace, "dump", None)
+        if dump is None:
+            raise RuntimeError("Only ring mode traces can be dumped")
+        return {"path": dump(path)}
+
+    def _fetch_command(self):
+        if self._last is None:
+            raise RuntimeError("No trace was stopped yet")
+        if self._last.get("format", "json") != "json":
+            raise RuntimeError("Only json traces can be fetched")
+
+        paths = self._last.get("segments", [self._last["path"]])
+        contents = []
+        for path in paths:
+            if os.path.exists(path):  # Unless it's an expired segment
+                with open(path) as f:
+                    contents.append(f.read())
+        return {"traces": contents}
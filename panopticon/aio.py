@@ -0,0 +1,465 @@
+#!/bin/env python3
+
+"""
+Traces asyncio at the level of Tasks and loop callbacks rather than
+coroutine frames.
+
+A task factory on the event loop wraps the coroutine of every new Task,
+so each step the Task takes costs a couple of events however deep the
+coroutines it runs are nested, and nothing has to be inferred from
+bytecode. LoopTracer times the callbacks the loop runs instead, and how
+long they wait to be run.
+"""
+
+import asyncio
+import collections.abc
+import functools
+import itertools
+import os
+import sys
+import threading
+import weakref
+from typing import Optional
+
+from panopticon.clock import default_clock
+from panopticon.trace import (
+    AsyncTraceEvent,
+    CompleteTraceEvent,
+    CounterTraceEvent,
+    DurationTraceEvent,
+    FlowTraceEvent,
+    InstantTraceEvent,
+    Phase,
+    Trace,
+)
+
+_TASK = "asyncio.task"
+_STEP = "asyncio.step"
+_SPAWN = "asyncio.spawn"
+_AWAIT = "asyncio.await"
+_CALLBACK = "asyncio.callback"
+_LOOP = "asyncio.loop"
+
+_ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+
+class TaskTracer:
+    """Records every asyncio Task created on `loop` while tracing.
+
+    Tasks are async ("b"/"e") events named after their coroutine and
+    identified by a counter, with the place they were created from. Each
+    step they take is a duration event on the thread running the loop,
+    and flows link a step to the tasks it creates, and the last step of
+    a task to the steps awaiting it.
+
+    `loop` defaults to the running loop when tracing starts.
+    """
+
+    def __init__(self, trace=None, loop=None):
+        self._trace = trace or Trace()
+        self._loop = loop
+        self._previous = None
+        self._tracing = False
+        self._ids = itertools.count(1)
+        self._running: Optional[_TracedCoroutine] = None
+
+    def start(self):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+
+        self._previous = self._loop.get_task_factory()
+        self._loop.set_task_factory(self._create_task)
+        self._tracing = True
+        return self
+
+    def stop(self):
+        # Tasks created until now keep their coroutines wrapped, but stop
+        # reporting
+        self._tracing = False
+        self._loop.set_task_factory(self._previous)
+        self._trace.flush()
+
+    def get_trace(self):
+        return self._trace
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _create_task(self, loop, coro, **kwargs):
+        traced = _TracedCoroutine(self, coro, next(self._ids))
+        self._trace.add_event(
+            AsyncTraceEvent(
+                name=traced.name,
+                cat=_TASK,
+                ph=Phase.Async.START,
+                id=traced.id,
+                args={"created at": _creation_site()},
+            )
+        )
+
+        if self._running is not None:
+            traced.spawned = True
+            self._trace.add_event(
+                FlowTraceEvent(
+                    name="spawn", cat=_SPAWN, ph=Phase.Flow.START, id=traced.id
+                )
+            )
+
+        if self._previous is None:
+            task = asyncio.Task(traced, loop=loop, **kwargs)
+        else:
+            task = self._previous(loop, traced, **kwargs)
+
+        task.add_done_callback(
+            functools.partial(self._done, traced.id, traced.name)
+        )
+        return task
+
+    def _step(self, traced: "_TracedCoroutine", method, *args):
+        if not self._tracing:
+            return method(*args)
+
+        add_event = self._trace.add_event
+        previous, self._running = self._running, traced
+        add_event(
+            DurationTraceEvent(
+                name=traced.name, cat=_STEP, ph=Phase.Duration.START
+            )
+        )
+
+        if traced.spawned:
+            traced.spawned = False
+            add_event(
+                FlowTraceEvent(
+                    name="spawn", cat=_SPAWN, ph=Phase.Flow.END, id=traced.id
+                )
+            )
+        if traced.awaiting is not None:
+            add_event(
+                FlowTraceEvent(
+                    name="await",
+                    cat=_AWAIT,
+                    ph=Phase.Flow.END,
+                    id=traced.awaiting,
+                )
+            )
+            traced.awaiting = None
+
+        try:
+            result = method(*args)
+        except BaseException:
+            # The task is done, and whatever awaits it resumes next
+            add_event(
+                FlowTraceEvent(
+                    name="await", cat=_AWAIT, ph=Phase.Flow.START, id=traced.id
+                )
+            )
+            raise
+        else:
+            traced.awaiting = _task_id(result)
+            return result
+        finally:
+            add_event(
+                DurationTraceEvent(
+                    name=traced.name, cat=_STEP, ph=Phase.Duration.END
+                )
+            )
+            self._running = previous
+
+    def _done(self, task_id: int, name: str, task: asyncio.Task):
+        if not self._tracing:
+            return
+
+        args = {}
+        get_name = getattr(task, "get_name", None)  # Tasks have names in 3.8
+        if get_name is not None:
+            args["task"] = get_name()
+        args["state"] = "cancelled" if task.cancelled() else "done"
+        self._trace.add_event(
+            AsyncTraceEvent(
+                name=name, cat=_TASK, ph=Phase.Async.END, id=task_id, args=args
+            )
+        )
+
+
+class LoopTracer:
+    """Records what the asyncio event loops of the process spend time on.
+
+    Every callback a loop runs, Task steps included, is a complete event
+    named after the callback, and the ones taking at least
+    `slow_callback` seconds are also marked with an instant event. Each
+    iteration of a loop adds to its "select ms" counter how long it
+    waited in select(), and to its "ready" counter the number of
+    callbacks that were ready to run then: the ones that already were,
+    plus the I/O that select() returned. Timers that came due meanwhile
+    aren't counted.
+
+    Loops are also sent a callback every `lag_interval` seconds, and how
+    late it runs is counted as the loop's "lag ms". That's the only thing
+    recorded for loops that don't run asyncio's Handles (e.g. uvloop),
+    which are only traced if tracing starts inside them, and are marked
+    as blocked when their lag exceeds `slow_callback` instead.
+
+    Handles are instrumented globally, so this covers the loops of all
+    threads, including ones that start after tracing.
+    """
+
+    def __init__(
+        self,
+        trace=None,
+        slow_callback: float = 0.1,
+        lag_interval: float = 0.01,
+    ):
+        self._trace = trace or Trace()
+        self._slow_ns = int(slow_callback * 1e9)
+        self._slow_callback = slow_callback
+        self._lag_interval = lag_interval
+
+        self._tracing = False
+        self._original_run = None
+        self._loops = weakref.WeakSet()
+        self._last_loop = None
+
+    def start(self):
+        self._tracing = True
+
+        tracer = self
+        original_run = self._original_run = asyncio.events.Handle._run
+
+        def _run(handle):
+            return tracer._run(handle, original_run)
+
+        asyncio.events.Handle._run = _run
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass  # Loops are picked up when they run their first callback
+        else:
+            self._attach(loop)
+        return self
+
+    def stop(self):
+        self._tracing = False  # Also ends the lag callbacks
+        asyncio.events.Handle._run = self._original_run
+
+        for loop in list(self._loops):
+            selector = getattr(loop, "_selector", None)
+            if selector is not None:
+                selector.__dict__.pop("select", None)
+        self._loops.clear()
+        self._last_loop = None
+        self._trace.flush()
+
+    def get_trace(self):
+        return self._trace
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self, handle, original_run):
+        loop = handle._loop
+        if loop is not self._last_loop:
+            self._attach(loop)
+
+        callback = handle._callback
+        if not self._tracing or getattr(callback, "__self__", None) is self:
+            return original_run(handle)
+
+        # Named once it ran, so tracing can't keep the callback from running
+        event = CompleteTraceEvent(name="", cat=_CALLBACK)
+        try:
+            return original_run(handle)
+        finally:
+            event.dur = default_clock.now() - event.ts
+            event.name = _callback_name(callback)
+            self._trace.add_event(event)
+            if event.dur >= self._slow_ns:
+                self._trace.add_event(
+                    InstantTraceEvent(
+                        name="slow callback",
+                        cat=_CALLBACK,
+                        args={
+                            "callback": event.name,
+                            "duration ms": event.dur / 1e6,
+                        },
+                    )
+                )
+
+    def _attach(self, loop):
+        self._last_loop = loop
+        if loop in self._loops:
+            return
+        self._loops.add(loop)
+
+        name = f"{_LOOP} ({threading.current_thread().name})"
+        selector = getattr(loop, "_selector", None)
+        ready = getattr(loop, "_ready", None)
+        if selector is not None and ready is not None:
+            select = selector.select
+            add_event = self._trace.add_event
+
+            def timed_select(timeout=None):
+                waiting = len(ready)
+                start = default_clock.now()
+                events = ()
+                try:
+                    events = select(timeout)
+                    return events
+                finally:
+                    waited = (default_clock.now() - start) / 1e6
+                    add_event(
+                        CounterTraceEvent(
+                            name=f"{name} ready",
+                            cat=_LOOP,
+                            args={"ready": waiting + len(events)},
+                        )
+                    )
+                    add_event(
+                        CounterTraceEvent(
+                            name=f"{name} select ms",
+                            cat=_LOOP,
+                            args={"select ms": waited},
+                        )
+                    )
+
+            selector.select = timed_select
+
+        loop.call_later(
+            self._lag_interval,
+            self._measure_lag,
+            loop,
+            name,
+            loop.time() + self._lag_interval,
+        )
+
+    def _measure_lag(self, loop, name: str, expected: float):
+        if not self._tracing:
+            return
+
+        lag = max(loop.time() - expected, 0)
+        self._trace.add_event(
+            CounterTraceEvent(
+                name=f"{name} lag ms", cat=_LOOP, args={"lag ms": lag * 1e3}
+            )
+        )
+        if lag >= self._slow_callback and not isinstance(
+            loop, asyncio.BaseEventLoop
+        ):
+            self._trace.add_event(
+                InstantTraceEvent(
+                    name="loop blocked", cat=_LOOP, args={"lag ms": lag * 1e3}
+                )
+            )
+
+        loop.call_later(
+            self._lag_interval,
+            self._measure_lag,
+            loop,
+            name,
+            loop.time() + self._lag_interval,
+        )
+
+
+def _delegated(*names: str) -> property:
+    """The first of names the wrapped coroutine has, generator-based
+    coroutines only having the gi_ versions of the cr_ attributes"""
+
+    def get(self):
+        for name in names:
+            try:
+                return getattr(self._coro, name)
+            except AttributeError:
+                continue
+        return None
+
+    return property(get)
+
+
+class _TracedCoroutine(collections.abc.Coroutine):
+    """The coroutine of a Task, reporting every step to the tracer.
+
+    It looks like the coroutine it wraps to anything inspecting the
+    Task, such as asyncio's reprs and debug mode.
+    """
+
+    __slots__ = ("_tracer", "_coro", "id", "name", "spawned", "awaiting")
+
+    __name__ = _delegated("__name__")
+    cr_frame = _delegated("cr_frame", "gi_frame")
+    cr_running = _delegated("cr_running", "gi_running")
+    cr_await = _delegated("cr_await", "gi_yieldfrom")
+    cr_code = _delegated("cr_code", "gi_code")
+
+    def __init__(self, tracer: TaskTracer, coro, task_id: int):
+        self._tracer = tracer
+        self._coro = coro
+        self.id = task_id
+        self.name = getattr(coro, "__qualname__", type(coro).__qualname__)
+        self.spawned = False
+        self.awaiting: Optional[int] = None  # id of the task waited on
+
+    def send(self, value):
+        return self._tracer._step(self, self._coro.send, value)
+
+    def throw(self, *args):
+        return self._tracer._step(self, self._coro.throw, *args)
+
+    def close(self):
+        self._coro.close()
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    def __getattr__(self, name):
+        # A property named __qualname__ would replace the class' own
+        if name == "__qualname__":
+            return self._coro.__qualname__
+        raise AttributeError(name)
+
+
+def _callback_name(callback) -> str:
+    """Names callbacks by what they run, without anything unique to them"""
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        # Steps and wakeups, named after the coroutine they run
+        coro = _get_coro(owner)
+        if isinstance(coro, _TracedCoroutine):
+            return coro.name
+        return getattr(coro, "__qualname__", type(coro).__qualname__)
+
+    return getattr(callback, "__qualname__", type(callback).__qualname__)
+
+
+def _task_id(future) -> Optional[int]:
+    """The id of future if it's a traced Task"""
+    coro = _get_coro(future)
+    return coro.id if isinstance(coro, _TracedCoroutine) else None
+
+
+def _get_coro(task):
+    """The coroutine of task, which only has get_coro() from 3.8"""
+    get_coro = getattr(task, "get_coro", None)
+    if get_coro is not None:
+        return get_coro()
+    return getattr(task, "_coro", None)
+
+
+def _creation_site() -> str:
+    """Where the code outside of asyncio that created a task is"""
+    frame = sys._getframe(2)
+    while frame is not None and (
+        frame.f_code.co_filename.startswith(_ASYNCIO_DIR)
+        or frame.f_code.co_filename == __file__
+    ):
+        frame = frame.f_back
+
+    if frame is None:
+        return "<unknown>"
+    return f"{frame.f_code.co_filename}:{frame.f_lineno}"
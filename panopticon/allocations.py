@@ -0,0 +1,167 @@
+#!/bin/env python3
+
+"""
+Attributes memory allocations to the calls that made them.
+
+tracemalloc's count of traced memory is read when a call starts and when
+it returns, and the difference, less what the tracer allocated for the
+events in between, is added to the end event of the call, along with
+running totals per function for report().
+"""
+
+import random
+import threading
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+from panopticon.predicate import Predicate, memoize
+
+# Calls and bytes allocated by a function
+_Total = List[int]
+
+
+class AllocationTracker:
+    """Measures the memory allocated by the calls of a FunctionTracer.
+
+    The amount is the growth of the memory traced by tracemalloc from
+    when a call starts to when it returns (or yields), so it includes
+    what the functions it calls allocated and didn't free, and what
+    other threads allocated in the meantime. What the tracer allocates
+    on this thread while handling events is left out, with a running
+    total per thread. It's recorded under ALLOCATED_KEY in the args of
+    the end event.
+
+    tracemalloc is started with tracing if it isn't running already, and
+    slows down every allocation while it runs. Reading it costs a little
+    on every measured call on top of that, so only calls matching `only`
+    are measured, and of those only a random `rate` of them.
+    """
+
+    ALLOCATED_KEY = "[allocated bytes]"
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        only: Optional[Predicate] = None,
+        frames: int = 1,
+    ):
+        self._rate = rate
+        self._only = only and memoize(only)
+        self._frames = frames
+        self._started = False
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._totals: List[Dict[object, _Total]] = []
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self._frames)
+            self._started = True
+
+    def stop(self):
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def pause(self):
+        """Reads the memory traced as the tracer starts handling an event,
+        if a call of this thread is being measured"""
+        local = self._local
+        try:
+            measuring = local.measuring
+        except AttributeError:
+            self._stack()
+            measuring = local.measuring
+
+        local.reading = (
+            tracemalloc.get_traced_memory()[0] if measuring else None
+        )
+
+    def measure(self, frame, event, arg, args):
+        """Returns the args of an event, with the allocations of the call
+        added to them if it's returning"""
+        if event != "return" and event != "yield":
+            return args
+
+        local = self._local
+        stack = local.stack
+        if not stack:
+            return args  # Started before tracing did
+        start = stack.pop()
+        if start is None:
+            return args
+
+        local.measuring -= 1
+        memory, overhead = start
+        allocated = local.reading - memory - (local.overhead - overhead)
+        total = local.totals.get(frame.f_code)
+        if total is None:
+            local.totals[frame.f_code] = [1, allocated]
+        else:
+            total[0] += 1
+            total[1] += allocated
+
+        return {**(args or {}), self.ALLOCATED_KEY: allocated}
+
+    def resume(self, frame, event, arg):
+        """Sets aside what the tracer allocated handling an event, and
+        starts measuring the call if it's starting"""
+        local = self._local
+        measure = event == "call" and (
+            (self._rate >= 1 or random.random() < self._rate)
+            and (self._only is None or self._only(frame, event, arg))
+        )
+        if local.reading is not None or measure:
+            memory = tracemalloc.get_traced_memory()[0]
+            if local.reading is not None:
+                local.overhead += memory - local.reading
+
+        if measure:
+            local.stack.append((memory, local.overhead))
+            local.measuring += 1
+        elif event == "call":
+            local.stack.append(None)
+
+    def totals(self) -> Dict[str, Tuple[int, int]]:
+        """(calls, bytes) measured per function, across all threads"""
+        # Imported here, tracer imports this module
+        from panopticon.tracer import FunctionTracer
+
+        with self._lock:
+            per_thread = [dict(x) for x in self._totals]
+
+        totals: Dict[str, Tuple[int, int]] = {}
+        for thread_totals in per_thread:
+            for code, (calls, allocated) in thread_totals.items():
+                name = FunctionTracer._get_code_name(code)
+                previous_calls, previous_allocated = totals.get(name, (0, 0))
+                totals[name] = (
+                    previous_calls + calls,
+                    previous_allocated + allocated,
+                )
+        return totals
+
+    def report(self, limit: Optional[int] = 20) -> str:
+        """The functions that allocated the most, as a table"""
+        totals = sorted(
+            self.totals().items(), key=lambda x: x[1][1], reverse=True
+        )
+        lines = [f"{'bytes':>14} {'calls':>10} {'bytes/call':>12}  function"]
+        for name, (calls, allocated) in totals[:limit]:
+            lines.append(
+                f"{allocated:>14} {calls:>10} {allocated // calls:>12}  {name}"
+            )
+        return "\n".join(lines)
+
+    def _stack(self) -> List[Optional[Tuple[int, int]]]:
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            self._local.measuring = 0
+            self._local.overhead = 0
+            self._local.totals = {}
+            with self._lock:
+                self._totals.append(self._local.totals)
+            return self._local.stack
@@ -0,0 +1,290 @@
+#!/bin/env python3
+
+"""
+A compact binary trace format, and tools to read it back.
+
+A file starts with a magic header and is followed by records, each
+introduced by a tag byte:
+
+- A string record defines an entry in the string table: its id and
+  utf-8 contents. Names, categories and extra event fields are all
+  stored as references into this table.
+- An event record always has the same layout: the phase and a flags
+  byte, then varints for the name and category ids, the zigzag encoded
+  deltas of ts and tts (in ns) from the previous event, the duration of
+  complete events, pid, tid, and the optional args, the zigzag encoded
+  id of flow and async events and their other extra fields.
+
+Strings are always written before the first event that uses them, so
+the file can be written and read as a stream.
+"""
+
+import io
+import json
+import mmap
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+from panopticon.trace import (
+    Trace,
+    TraceEvent,
+    _shared_fields,
+    _ThreadBatches,
+)
+from panopticon.version import version
+
+MAGIC = b"PNPT\x01"
+
+_TAG_STRING = 1
+_TAG_EVENT = 2
+
+_HAS_ARGS = 1
+_HAS_EXTRA = 2
+_HAS_TTS = 4
+_HAS_DUR = 8
+_HAS_ID = 16
+
+_BUFFER_SIZE = 1 << 16
+_BATCH_SIZE = 1024
+
+
+class BinaryTrace(Trace):
+    """Writes events to a binary stream in the panopticon format.
+
+    Threads batch events separately, and the batches are encoded in
+    timestamp order, which also keeps the ts deltas small.
+    """
+
+    def __init__(self, stream: io.RawIOBase):
+        super().__init__()
+        self._out = stream
+        self._buffer = bytearray(MAGIC)
+        self._strings = {}
+        self._last_ts = 0
+        self._last_tts = 0
+        self._batches = _ThreadBatches()
+        self._lock = threading.Lock()
+
+    def add_event(self, event: TraceEvent):
+        batch = self._batches.get()
+        batch.events.append(event)
+        if len(batch.events) >= _BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            for event in self._batches.take():
+                self._encode(event)
+            self._write_buffer()
+
+    def _encode(self, event: TraceEvent):
+        buffer = self._buffer
+        name = self._string_id(event.name)
+        cat = self._string_id(event.cat)
+
+        # Ids are unique to a flow, so they'd only bloat the string table
+        ident = getattr(event, "id", None)
+        extra = None
+        extra_fields = _shared_fields(type(event))
+        if extra_fields:
+            extra = self._string_id(
+                json.dumps({x: getattr(event, x) for x in extra_fields})
+            )
+
+        flags = 0
+        if event.args is not None:
+            flags |= _HAS_ARGS
+        if extra is not None:
+            flags |= _HAS_EXTRA
+        if ident is not None:
+            flags |= _HAS_ID
+        if event.tts is not None:
+            flags |= _HAS_TTS
+        dur = getattr(event, "dur", None)
+        if dur is not None:
+            flags |= _HAS_DUR
+
+        buffer.append(_TAG_EVENT)
+        buffer.append(ord(event.ph))
+        buffer.append(flags)
+        _write_varint(buffer, name)
+        _write_varint(buffer, cat)
+        _write_varint(buffer, _zigzag(event.ts - self._last_ts))
+        self._last_ts = event.ts
+
+        if flags & _HAS_TTS:
+            _write_varint(buffer, _zigzag(event.tts - self._last_tts))
+            self._last_tts = event.tts
+
+        if flags & _HAS_DUR:
+            _write_varint(buffer, dur)
+
+        _write_varint(buffer, event.pid)
+        _write_varint(buffer, event.tid)
+
+        if flags & _HAS_ARGS:
+            args = json.dumps(event.args).encode("utf-8")
+            _write_varint(buffer, len(args))
+            buffer += args
+
+        if flags & _HAS_ID:
+            _write_varint(buffer, _zigzag(ident))
+        if flags & _HAS_EXTRA:
+            _write_varint(buffer, extra)
+
+        if len(buffer) >= _BUFFER_SIZE:
+            self._write_buffer()
+
+    def _write_buffer(self):
+        self._out.write(self._buffer)
+        self._out.flush()
+        self._buffer = bytearray()
+
+    def __str__(self) -> str:
+        return f"BinaryTrace ({self._out})"
+
+    def _string_id(self, value: Optional[str]) -> int:
+        """Ids are offset by one, leaving 0 to represent None"""
+        if value is None:
+            return 0
+
+        try:
+            return self._strings[value]
+        except KeyError:
+            index = self._strings[value] = len(self._strings) + 1
+            encoded = str(value).encode("utf-8")
+            self._buffer.append(_TAG_STRING)
+            _write_varint(self._buffer, index)
+            _write_varint(self._buffer, len(encoded))
+            self._buffer += encoded
+            return index
+
+
+class BinaryTraceReader:
+    """Iterates over the events in a binary trace without loading it
+
+    The file is memory mapped and decoded lazily, so only the events
+    that are actually consumed are ever read.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a panopticon binary trace")
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        data = self._map
+        end = len(data)
+        pos = len(MAGIC)
+        strings = [None]
+        ts = 0
+        tts = 0
+
+        while pos < end:
+            tag = data[pos]
+            pos += 1
+
+            if tag == _TAG_STRING:
+                index, pos = _read_varint(data, pos)
+                length, pos = _read_varint(data, pos)
+                assert index == len(strings), "Corrupt string table"
+                strings.append(data[pos : pos + length].decode("utf-8"))
+                pos += length
+                continue
+
+            if tag != _TAG_EVENT:
+                raise ValueError(f"Unknown record {tag} at offset {pos - 1}")
+
+            ph = chr(data[pos])
+            flags = data[pos + 1]
+            pos += 2
+            name, pos = _read_varint(data, pos)
+            cat, pos = _read_varint(data, pos)
+            delta, pos = _read_varint(data, pos)
+            ts += _unzigzag(delta)
+
+            event = {
+                "name": strings[name],
+                "cat": strings[cat],
+                "ph": ph,
+                "args": None,
+                "ts": ts / 1000,
+            }
+
+            if flags & _HAS_TTS:
+                delta, pos = _read_varint(data, pos)
+                tts += _unzigzag(delta)
+                event["tts"] = tts / 1000
+
+            if flags & _HAS_DUR:
+                dur, pos = _read_varint(data, pos)
+                event["dur"] = dur / 1000
+
+            event["pid"], pos = _read_varint(data, pos)
+            event["tid"], pos = _read_varint(data, pos)
+
+            if flags & _HAS_ARGS:
+                length, pos = _read_varint(data, pos)
+                event["args"] = json.loads(data[pos : pos + length])
+                pos += length
+
+            if flags & _HAS_ID:
+                ident, pos = _read_varint(data, pos)
+                event["id"] = _unzigzag(ident)
+            if flags & _HAS_EXTRA:
+                extra, pos = _read_varint(data, pos)
+                event.update(json.loads(strings[extra]))
+
+            yield event
+
+
+def convert(path: str, out: io.TextIOBase):
+    """Streams a binary trace out as Catapult compatible json"""
+    out.write('{"traceEvents": [\n')
+    with BinaryTraceReader(path) as reader:
+        for i, event in enumerate(reader):
+            if i:
+                out.write(",\n")
+            json.dump(event, out)
+    out.write("\n],\n")
+    out.write('"displayTimeUnit": "ns",\n')
+    out.write(f'"otherData": {{"version": "Panopticon {version}"}}}}\n')
+
+
+def _zigzag(n: int) -> int:
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def _unzigzag(n: int) -> int:
+    return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+
+def _write_varint(buffer: bytearray, n: int):
+    while n > 0x7F:
+        buffer.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buffer.append(n)
+
+
+def _read_varint(data, pos: int):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
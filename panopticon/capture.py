@@ -0,0 +1,155 @@
+#!/bin/env python3
+
+"""
+Formats captured arguments and return values for trace events.
+
+Calling repr() on whatever a function was given can take longer than
+the function itself, and produce megabytes for a single event. Values
+are formatted with reprlib instead, so containers are cut off after a
+few items and a couple of levels, every value is limited to a number
+of characters, and all the arguments of an event to a number of bytes.
+
+reprlib still calls repr() in full on anything that isn't one of its
+containers, so only builtin types are represented; instances of other
+classes show their type and address unless they're explicitly allowed.
+"""
+
+import inspect
+import logging
+import reprlib
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+_SCALARS = frozenset([float, bool, complex, type(None)])
+
+
+class ArgumentCapture:
+    """Formats the arguments of a call.
+
+    Every value is limited to `max_chars` characters, containers show at
+    most `max_items` items and `max_depth` levels of nesting, and once the
+    names and values of an event add up to `max_bytes` (encoded as UTF-8)
+    the remaining arguments are only counted, under TRUNCATED_KEY.
+
+    The __repr__ of other classes can be arbitrarily slow, so their
+    instances are only shown as their type and address, unless the class
+    is one of `repr_types`. Their repr is then run in full before being
+    cut down to `max_chars`.
+
+    With `types_only`, only the type of every argument is recorded, which
+    never runs any of their code.
+    """
+
+    TRUNCATED_KEY = "[truncated args]"
+
+    def __init__(
+        self,
+        max_chars: int = 80,
+        max_items: int = 6,
+        max_depth: int = 2,
+        max_bytes: Optional[int] = 1024,
+        types_only: bool = False,
+        repr_types: Iterable[type] = (),
+    ):
+        self.max_chars = max_chars
+        self.max_bytes = max_bytes
+        self.types_only = types_only
+
+        self._repr = _BoundedRepr(frozenset(repr_types))
+        self._repr.maxlevel = max_depth
+        self._repr.maxstring = max_chars
+        self._repr.maxother = max_chars
+        self._repr.maxlong = max_chars
+        for attribute in (
+            "maxtuple",
+            "maxlist",
+            "maxarray",
+            "maxdict",
+            "maxset",
+            "maxfrozenset",
+            "maxdeque",
+        ):
+            setattr(self._repr, attribute, max_items)
+
+    def arguments(self, frame) -> Dict[str, str]:
+        """The arguments of the function running in frame.
+
+        Only reads the parameters, not the rest of f_locals, which also
+        holds cell variables and anything assigned before the event.
+        """
+        code = frame.f_code
+        count = code.co_argcount + code.co_kwonlyargcount
+        if code.co_flags & inspect.CO_VARARGS:
+            count += 1
+        if code.co_flags & inspect.CO_VARKEYWORDS:
+            count += 1
+
+        f_locals = frame.f_locals
+        result = {}
+        budget = self.max_bytes
+        for i, key in enumerate(code.co_varnames[:count]):
+            try:
+                val = f_locals[key]
+            except KeyError:
+                continue  # Deleted already
+
+            formatted = self.format(key, val)
+            if budget is not None:
+                budget -= len(key.encode()) + len(formatted.encode())
+                if budget < 0:
+                    result[self.TRUNCATED_KEY] = str(count - i)
+                    break
+            result[key] = formatted
+        return result
+
+    def format(self, key: str, val: Any) -> str:
+        """A representation of val no longer than max_chars"""
+        cls = type(val)
+        if self.types_only:
+            return cls.__qualname__
+
+        # Fast paths for values that are cheap to represent in full
+        if cls in _SCALARS or (cls is int and -(2**63) <= val < 2**63):
+            return repr(val)[: self.max_chars]
+        if cls is str and len(val) <= self.max_chars:
+            return repr(val)[: self.max_chars]  # Quotes and escapes
+
+        try:
+            formatted = self._repr.repr(val)
+        except Exception:
+            logger.exception(f"Couldn't represent value for {key}")
+            return f"<{cls.__qualname__}>"
+
+        # reprlib only cuts off the reprs it knows to be too long
+        if len(formatted) > self.max_chars:
+            formatted = formatted[: self.max_chars - 3] + "..."
+        return formatted
+
+
+class _BoundedRepr(reprlib.Repr):
+    """Only runs the repr of builtins and the allowed types"""
+
+    def __init__(self, repr_types: FrozenSet[type]):
+        super().__init__()
+        self._repr_types = repr_types
+
+    def repr_instance(self, x, level):
+        cls = type(x)
+        if cls.__module__ == "builtins" or cls in self._repr_types:
+            return super().repr_instance(x, level)
+        return f"<{cls.__qualname__} at {id(x):#x}>"
+
+
+def safe_repr(key, val) -> str:
+    """repr(val) in full, falling back to str(val) if that fails"""
+    try:
+        return repr(val)
+    except Exception:
+        logger.exception(f"Couldn't represent value for {key}")
+
+    try:
+        return str(val)
+    except Exception:
+        logger.exception(f"Couldn't stringify value for {key}")
+        return "<couldn't convert>"
@@ -0,0 +1,106 @@
+#!/bin/env python3
+
+"""
+Timestamps and identifiers for trace events.
+
+Stamping happens for every single event, so the clock reads wall time
+once and then only adds perf_counter_ns deltas to it, caches the pid and
+tid per thread (refreshed after a fork), and keeps everything as integer
+nanoseconds. Thread cpu time is opt-in because it doubles the cost.
+"""
+
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Optional, Tuple
+
+_clocks = weakref.WeakSet()
+
+
+class Clock:
+    def __init__(self, thread_time: bool = False):
+        self.thread_time = thread_time
+        self._offset = time.time_ns() - time.perf_counter_ns()
+        self._local = threading.local()
+        _clocks.add(self)
+
+    def now(self) -> int:
+        """Wall clock time in ns, aligned with other traces"""
+        return self._offset + time.perf_counter_ns()
+
+    def identity(self) -> Tuple[int, int]:
+        """(pid, tid) of the calling thread"""
+        try:
+            return self._local.identity
+        except AttributeError:
+            identity = self._local.identity = (os.getpid(), _get_thread_id())
+            return identity
+
+    def stamp(self) -> Tuple[int, Optional[int], int, int]:
+        """(ts, tts, pid, tid) for an event happening right now"""
+        try:
+            pid, tid = self._local.identity
+        except AttributeError:
+            pid, tid = self.identity()
+
+        return (
+            self._offset + time.perf_counter_ns(),
+            time.thread_time_ns() if self.thread_time else None,
+            pid,
+            tid,
+        )
+
+    def _after_fork(self):
+        self._local = threading.local()
+
+
+default_clock = Clock()
+
+
+def configure(thread_time: bool = False):
+    """Changes how all subsequent events are stamped"""
+    default_clock.thread_time = thread_time
+
+
+def measure_overhead(iterations: int = 100000) -> Dict[str, float]:
+    """Average ns spent stamping a single event in each configuration"""
+    configurations: Dict[str, Callable] = {
+        "time_ns + thread_time_ns + getpid + native_id": _stamp_directly,
+        "clock": Clock(thread_time=False).stamp,
+        "clock + thread_time": Clock(thread_time=True).stamp,
+    }
+
+    results = {}
+    for name, stamp in configurations.items():
+        start = time.perf_counter_ns()
+        for _ in range(iterations):
+            stamp()
+        results[name] = (time.perf_counter_ns() - start) / iterations
+
+    return results
+
+
+def _stamp_directly():
+    return (
+        time.time_ns() / 1000,
+        time.thread_time_ns() / 1000,
+        os.getpid(),
+        _get_thread_id(),
+    )
+
+
+def _get_thread_id() -> int:
+    try:
+        return threading.get_native_id()
+    except AttributeError:
+        return threading.get_ident()
+
+
+def _after_fork_in_child():
+    for clock in list(_clocks):
+        clock._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
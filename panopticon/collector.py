@@ -0,0 +1,139 @@
+#!/bin/env python3
+
+"""
+Traces the pauses of the garbage collector.
+
+Collections stop every thread, and otherwise show up as unexplained
+gaps in whatever function happened to be running when one started.
+"""
+
+import gc
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from panopticon.clock import default_clock
+from panopticon.trace import (
+    CompleteTraceEvent,
+    InstantScope,
+    InstantTraceEvent,
+    Trace,
+    _untraced_threads,
+)
+
+_CAT = "gc"
+
+
+class GCTracer:
+    """Records every garbage collection as a complete event on the thread
+    that triggered it, with the generation collected and how many objects
+    were collected and found uncollectable.
+
+    When tracing stops, a "gc summary" instant event adds up the time
+    spent collecting per generation, also available from summary().
+
+    The collector can start while the trace is in the middle of adding
+    another event, so collections are only queued from gc.callbacks, and
+    added to the trace every `flush_interval` seconds from a thread of
+    their own.
+    """
+
+    def __init__(self, trace=None, flush_interval: float = 0.1):
+        self._trace = trace or Trace()
+        self._flush_interval = flush_interval
+
+        self._collecting: Optional[CompleteTraceEvent] = None
+        self._pending: Deque[CompleteTraceEvent] = deque()
+        self._collections = [0, 0, 0]
+        self._durations = [0, 0, 0]
+        self._longest = 0
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="panopticon-gc", daemon=True
+        )
+        self._thread.start()
+        gc.callbacks.append(self._callback)
+        return self
+
+    def stop(self):
+        gc.callbacks.remove(self._callback)
+        self._collecting = None
+        self._stopped.set()
+        self._thread.join()
+
+        self._add_pending()
+        self._trace.add_event(
+            InstantTraceEvent(
+                name="gc summary",
+                cat=_CAT,
+                s=InstantScope.PROCESS,
+                args=self.summary(),
+            )
+        )
+        self._trace.flush()
+
+    def get_trace(self):
+        return self._trace
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def summary(self) -> Dict[str, Any]:
+        """The number and total duration of collections per generation"""
+        summary: Dict[str, Any] = {
+            "collections": sum(self._collections),
+            "total ms": sum(self._durations) / 1e6,
+            "longest ms": self._longest / 1e6,
+        }
+        for generation, (count, duration) in enumerate(
+            zip(self._collections, self._durations)
+        ):
+            summary[f"gen{generation} collections"] = count
+            summary[f"gen{generation} ms"] = duration / 1e6
+        return summary
+
+    def _callback(self, phase: str, info: Dict[str, int]):
+        if phase == "start":
+            self._collecting = CompleteTraceEvent(
+                name=f"gc gen{info['generation']}", cat=_CAT
+            )
+            return
+
+        event, self._collecting = self._collecting, None
+        if event is None:
+            return  # Tracing started during this collection
+
+        generation = info["generation"]
+        event.dur = default_clock.now() - event.ts
+        event.args = {
+            "generation": generation,
+            "collected": info["collected"],
+            "uncollectable": info["uncollectable"],
+        }
+
+        self._collections[generation] += 1
+        self._durations[generation] += event.dur
+        self._longest = max(self._longest, event.dur)
+        self._pending.append(event)
+
+    def _run(self):
+        me = threading.get_ident()
+        _untraced_threads.add(me)
+        try:
+            while not self._stopped.wait(self._flush_interval):
+                self._add_pending()
+        finally:
+            _untraced_threads.discard(me)
+
+    def _add_pending(self):
+        pending = self._pending
+        while pending:
+            self._trace.add_event(pending.popleft())
@@ -0,0 +1,138 @@
+#!/bin/env python3
+
+"""
+Samples process-wide counters into the trace: memory, garbage collector
+and thread and task counts.
+
+They become counter tracks above the timeline of the process, so memory
+growth and GC pressure line up with the code that was running at the
+time.
+"""
+
+import asyncio
+import gc
+import os
+import threading
+import tracemalloc
+from typing import Dict, Iterable
+
+from panopticon.trace import CounterTraceEvent, Trace, _untraced_threads
+
+_CAT = "counters"
+
+_MB = 1024 * 1024
+
+# asyncio only keeps track of Tasks per loop in its internals, which
+# changed in 3.12
+_TASK_SETS = [
+    getattr(asyncio.tasks, name)
+    for name in ("_all_tasks", "_scheduled_tasks", "_eager_tasks")
+    if hasattr(asyncio.tasks, name)
+]
+
+
+class CounterSampler:
+    """Records the process' counters every `interval` seconds.
+
+    Each sample adds a counter event for every track:
+     - "memory rss MB": the resident memory (Linux only)
+     - "memory tracemalloc MB": the current and peak traced memory, if
+       tracemalloc is tracing
+     - "gc": the allocation counts of every generation
+     - "threads": the number of live threads
+     - "asyncio tasks": the number of Tasks that aren't done yet
+    """
+
+    def __init__(self, trace=None, interval: float = 0.1):
+        self._trace = trace or Trace()
+        self._interval = interval
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+        self._statm = os.path.exists("/proc/self/statm")
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="panopticon-counters", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.sample()  # Where the counters ended up
+        self._trace.flush()
+
+    def get_trace(self):
+        return self._trace
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        me = threading.get_ident()
+        _untraced_threads.add(me)
+        try:
+            self.sample()
+            while not self._stopped.wait(self._interval):
+                self.sample()
+        finally:
+            _untraced_threads.discard(me)
+
+    def sample(self):
+        """Records the counters at this point in time"""
+        add_event = self._trace.add_event
+        for name, values in self._memory().items():
+            add_event(self._counter(name, values))
+
+        gen0, gen1, gen2 = gc.get_count()
+        add_event(
+            self._counter("gc", {"gen0": gen0, "gen1": gen1, "gen2": gen2})
+        )
+        add_event(
+            self._counter("threads", {"threads": threading.active_count()})
+        )
+        add_event(self._counter("asyncio tasks", {"tasks": _pending_tasks()}))
+
+    def _memory(self) -> Dict[str, Dict[str, float]]:
+        """The memory counters, which are tracked separately as RSS and
+        tracemalloc don't measure the same memory"""
+        memory = {}
+        if self._statm:
+            with open("/proc/self/statm") as statm:
+                resident = int(statm.read().split()[1])
+            memory["memory rss MB"] = {"rss": resident * self._page_size / _MB}
+
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            memory["memory tracemalloc MB"] = {
+                "current": current / _MB,
+                "peak": peak / _MB,
+            }
+        return memory
+
+    @staticmethod
+    def _counter(name: str, values: Dict[str, float]) -> CounterTraceEvent:
+        return CounterTraceEvent(name=name, cat=_CAT, args=values)
+
+
+def _pending_tasks() -> int:
+    return sum(
+        not task.done() for tasks in _TASK_SETS for task in _snapshot(tasks)
+    )
+
+
+def _snapshot(tasks: Iterable[asyncio.Task]) -> list:
+    # Loops on other threads may add tasks while they're copied, like
+    # asyncio.all_tasks() this just tries again
+    for _ in range(1000):
+        try:
+            return list(tasks)
+        except RuntimeError:
+            continue
+    return []
@@ -0,0 +1,333 @@
+#!/bin/env python3
+
+"""
+Writes traces in Perfetto's protobuf format for ui.perfetto.dev.
+
+Only the handful of TracePacket / TrackEvent fields panopticon needs are
+encoded, by hand, to avoid depending on protobuf. Event names,
+categories and argument names are interned so that each event is only
+a few bytes; every thread gets its own track, as does every async id.
+"""
+
+import io
+import struct
+import threading
+from typing import Any, Dict, Tuple
+
+from panopticon.binary import _write_varint
+from panopticon.trace import Phase, Trace, TraceEvent, _ThreadBatches
+
+# Field numbers from perfetto/protos/perfetto/trace/
+_TRACE_PACKET = 1
+
+_PACKET_TIMESTAMP = 8
+_PACKET_SEQUENCE_ID = 10
+_PACKET_TRACK_EVENT = 11
+_PACKET_INTERNED_DATA = 12
+_PACKET_SEQUENCE_FLAGS = 13
+_PACKET_TRACK_DESCRIPTOR = 60
+
+_SEQ_INCREMENTAL_STATE_CLEARED = 1
+_SEQ_NEEDS_INCREMENTAL_STATE = 2
+
+_EVENT_CATEGORY_IIDS = 3
+_EVENT_DEBUG_ANNOTATIONS = 4
+_EVENT_TYPE = 9
+_EVENT_NAME_IID = 10
+_EVENT_TRACK_UUID = 11
+_EVENT_DOUBLE_COUNTER_VALUE = 44
+_EVENT_FLOW_IDS = 47
+_EVENT_TERMINATING_FLOW_IDS = 48
+
+_TYPE_SLICE_BEGIN = 1
+_TYPE_SLICE_END = 2
+_TYPE_INSTANT = 3
+_TYPE_COUNTER = 4
+
+_ANNOTATION_NAME_IID = 1
+_ANNOTATION_INT_VALUE = 4
+_ANNOTATION_DOUBLE_VALUE = 5
+_ANNOTATION_STRING_VALUE = 6
+
+_INTERNED_EVENT_CATEGORIES = 1
+_INTERNED_EVENT_NAMES = 2
+_INTERNED_ANNOTATION_NAMES = 3
+_INTERNED_IID = 1
+_INTERNED_NAME = 2
+
+_TRACK_UUID = 1
+_TRACK_NAME = 2
+_TRACK_PROCESS = 3
+_TRACK_THREAD = 4
+_TRACK_PARENT_UUID = 5
+_TRACK_COUNTER = 8
+
+_PROCESS_PID = 1
+_THREAD_PID = 1
+_THREAD_TID = 2
+_THREAD_NAME = 5
+
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+
+_SEQUENCE_ID = 1
+_BUFFER_SIZE = 1 << 16
+_BATCH_SIZE = 1024
+
+_FLOW_PHASES = {Phase.Flow.START, Phase.Flow.INSTANT, Phase.Flow.END}
+_ASYNC_PHASES = {Phase.Async.START, Phase.Async.INSTANT, Phase.Async.END}
+
+_DURATION_TYPES = {
+    Phase.Duration.START: _TYPE_SLICE_BEGIN,
+    Phase.Duration.END: _TYPE_SLICE_END,
+    Phase.Async.START: _TYPE_SLICE_BEGIN,
+    Phase.Async.END: _TYPE_SLICE_END,
+    Phase.Async.INSTANT: _TYPE_INSTANT,
+    Phase.Instant.INSTANT: _TYPE_INSTANT,
+}
+
+
+class PerfettoTrace(Trace):
+    """Writes events as Perfetto TracePackets to a binary stream.
+
+    Threads batch events separately, and the batches are encoded in
+    timestamp order by whichever thread fills one up or flushes.
+    """
+
+    def __init__(self, stream: io.RawIOBase):
+        super().__init__()
+        self._out = stream
+        self._buffer = bytearray()
+        self._tracks: Dict[Tuple, int] = {}
+        self._interned: Tuple[Dict[str, int], ...] = ({}, {}, {})
+        self._first_packet = True
+        self._batches = _ThreadBatches()
+        self._lock = threading.Lock()
+
+    def add_event(self, event: TraceEvent):
+        batch = self._batches.get()
+        batch.events.append(event)
+        if len(batch.events) >= _BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            for event in self._batches.take():
+                self._encode(event)
+            self._write_buffer()
+
+    def _encode(self, event: TraceEvent):
+        interned = bytearray()
+        track_event = bytearray()
+        ph = event.ph
+
+        if ph in _FLOW_PHASES:
+            track = self._thread_track(event.pid, event.tid)
+            field = (
+                _EVENT_TERMINATING_FLOW_IDS
+                if ph == Phase.Flow.END
+                else _EVENT_FLOW_IDS
+            )
+            _fixed64_field(track_event, field, event.id & (2**64 - 1))
+            _varint_field(track_event, _EVENT_TYPE, _TYPE_INSTANT)
+        elif ph in _ASYNC_PHASES:
+            track = self._async_track(event.pid, event.id, event.name)
+            _varint_field(track_event, _EVENT_TYPE, _DURATION_TYPES[ph])
+        elif ph == Phase.Counter.COUNTER:
+            for key, value in (event.args or {}).items():
+                track = self._counter_track(event.pid, event.name, key)
+                counter_event = bytearray()
+                _varint_field(counter_event, _EVENT_TYPE, _TYPE_COUNTER)
+                _varint_field(counter_event, _EVENT_TRACK_UUID, track)
+                _double_field(
+                    counter_event, _EVENT_DOUBLE_COUNTER_VALUE, float(value)
+                )
+                self._packet(event, counter_event, bytearray())
+            return
+        elif ph in _DURATION_TYPES:
+            track = self._thread_track(event.pid, event.tid)
+            _varint_field(track_event, _EVENT_TYPE, _DURATION_TYPES[ph])
+        elif ph == Phase.Complete.COMPLETE:
+            track = self._thread_track(event.pid, event.tid)
+            _varint_field(track_event, _EVENT_TYPE, _TYPE_SLICE_BEGIN)
+        else:
+            return  # Not representable, e.g. object snapshots
+
+        _varint_field(track_event, _EVENT_TRACK_UUID, track)
+
+        if _DURATION_TYPES.get(ph) != _TYPE_SLICE_END:
+            if event.cat is not None:
+                _varint_field(
+                    track_event,
+                    _EVENT_CATEGORY_IIDS,
+                    self._intern(
+                        interned, _INTERNED_EVENT_CATEGORIES, event.cat
+                    ),
+                )
+            if event.name is not None:
+                _varint_field(
+                    track_event,
+                    _EVENT_NAME_IID,
+                    self._intern(interned, _INTERNED_EVENT_NAMES, event.name),
+                )
+
+        for key, value in (event.args or {}).items():
+            annotation = bytearray()
+            _varint_field(
+                annotation,
+                _ANNOTATION_NAME_IID,
+                self._intern(interned, _INTERNED_ANNOTATION_NAMES, key),
+            )
+            _annotation_value(annotation, value)
+            _bytes_field(track_event, _EVENT_DEBUG_ANNOTATIONS, annotation)
+
+        self._packet(event, track_event, interned)
+
+        # Complete events are split into slices, which the trace processor
+        # sorts by timestamp when loading
+        if ph == Phase.Complete.COMPLETE:
+            end_event = bytearray()
+            _varint_field(end_event, _EVENT_TYPE, _TYPE_SLICE_END)
+            _varint_field(end_event, _EVENT_TRACK_UUID, track)
+            self._packet(event, end_event, bytearray(), event.ts + event.dur)
+
+    def _write_buffer(self):
+        self._out.write(self._buffer)
+        self._out.flush()
+        self._buffer = bytearray()
+
+    def __str__(self) -> str:
+        return f"PerfettoTrace ({self._out})"
+
+    def _packet(self, event, track_event, interned, ts=None):
+        packet = bytearray()
+        _varint_field(
+            packet, _PACKET_TIMESTAMP, event.ts if ts is None else ts
+        )
+        _varint_field(packet, _PACKET_SEQUENCE_ID, _SEQUENCE_ID)
+        _bytes_field(packet, _PACKET_TRACK_EVENT, track_event)
+        if interned:
+            _bytes_field(packet, _PACKET_INTERNED_DATA, interned)
+
+        if self._first_packet:
+            self._first_packet = False
+            flags = _SEQ_INCREMENTAL_STATE_CLEARED
+        else:
+            flags = _SEQ_NEEDS_INCREMENTAL_STATE
+        _varint_field(packet, _PACKET_SEQUENCE_FLAGS, flags)
+
+        self._write_packet(packet)
+
+    def _write_packet(self, packet):
+        _bytes_field(self._buffer, _TRACE_PACKET, packet)
+        if len(self._buffer) >= _BUFFER_SIZE:
+            self._write_buffer()
+
+    def _intern(self, interned: bytearray, kind: int, value: str) -> int:
+        table = self._interned[kind - 1]
+        try:
+            return table[value]
+        except KeyError:
+            iid = table[value] = len(table) + 1
+
+            entry = bytearray()
+            _varint_field(entry, _INTERNED_IID, iid)
+            _bytes_field(entry, _INTERNED_NAME, str(value).encode("utf-8"))
+            _bytes_field(interned, kind, entry)
+            return iid
+
+    def _track(self, key: Tuple, describe) -> int:
+        try:
+            return self._tracks[key]
+        except KeyError:
+            uuid = self._tracks[key] = len(self._tracks) + 1
+
+            descriptor = bytearray()
+            _varint_field(descriptor, _TRACK_UUID, uuid)
+            describe(descriptor)
+
+            packet = bytearray()
+            _bytes_field(packet, _PACKET_TRACK_DESCRIPTOR, descriptor)
+            self._write_packet(packet)
+            return uuid
+
+    def _process_track(self, pid: int) -> int:
+        def describe(descriptor):
+            process = bytearray()
+            _varint_field(process, _PROCESS_PID, pid)
+            _bytes_field(descriptor, _TRACK_PROCESS, process)
+
+        return self._track(("process", pid), describe)
+
+    def _thread_track(self, pid: int, tid: int) -> int:
+        def describe(descriptor):
+            thread = bytearray()
+            _varint_field(thread, _THREAD_PID, pid)
+            _varint_field(thread, _THREAD_TID, tid)
+            name = _thread_name(tid)
+            if name:
+                _bytes_field(thread, _THREAD_NAME, name.encode("utf-8"))
+            _bytes_field(descriptor, _TRACK_THREAD, thread)
+
+        return self._track(("thread", pid, tid), describe)
+
+    def _async_track(self, pid: int, id: int, name: str) -> int:
+        parent = self._process_track(pid)
+
+        def describe(descriptor):
+            _varint_field(descriptor, _TRACK_PARENT_UUID, parent)
+            _bytes_field(descriptor, _TRACK_NAME, str(name).encode("utf-8"))
+
+        return self._track(("async", pid, id), describe)
+
+    def _counter_track(self, pid: int, name: str, key: str) -> int:
+        parent = self._process_track(pid)
+
+        def describe(descriptor):
+            _varint_field(descriptor, _TRACK_PARENT_UUID, parent)
+            _bytes_field(
+                descriptor, _TRACK_NAME, f"{name}.{key}".encode("utf-8")
+            )
+            _bytes_field(descriptor, _TRACK_COUNTER, b"")
+
+        return self._track(("counter", pid, name, key), describe)
+
+
+def _thread_name(tid: int):
+    for thread in threading.enumerate():
+        if getattr(thread, "native_id", thread.ident) == tid:
+            return thread.name
+    return None
+
+
+def _annotation_value(annotation: bytearray, value: Any):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        _bytes_field(
+            annotation, _ANNOTATION_STRING_VALUE, str(value).encode("utf-8")
+        )
+    elif isinstance(value, int) and -(2**63) <= value < 2**63:
+        _varint_field(annotation, _ANNOTATION_INT_VALUE, value & (2**64 - 1))
+    else:
+        _double_field(annotation, _ANNOTATION_DOUBLE_VALUE, float(value))
+
+
+def _varint_field(buffer: bytearray, field: int, value: int):
+    _write_varint(buffer, field << 3 | _VARINT)
+    _write_varint(buffer, value)
+
+
+def _fixed64_field(buffer: bytearray, field: int, value: int):
+    _write_varint(buffer, field << 3 | _FIXED64)
+    buffer += struct.pack("<Q", value)
+
+
+def _double_field(buffer: bytearray, field: int, value: float):
+    _write_varint(buffer, field << 3 | _FIXED64)
+    buffer += struct.pack("<d", value)
+
+
+def _bytes_field(buffer: bytearray, field: int, value: bytes):
+    _write_varint(buffer, field << 3 | _LENGTH_DELIMITED)
+    _write_varint(buffer, len(value))
+    buffer += value
@@ -62,6 +62,9 @@ def _flatten_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     that keeps moving forward to allow for a minimum width.
     """
 
+    if any(x["ph"] == Phase.Complete.COMPLETE for x in events):
+        events = _split_complete_events(events)
+
     stacks = defaultdict(list)
     offsets = defaultdict(lambda: 0)
 
@@ -85,6 +88,33 @@ def _flatten_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return events
 
 
+def _split_complete_events(
+    events: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """Replaces complete events with begin/end pairs, in time order"""
+    split = []
+    for event in events:
+        if event["ph"] != Phase.Complete.COMPLETE:
+            if event["ph"] == Phase.Duration.START:
+                key = (event["ts"], 1, -float("inf"))
+            else:
+                key = (event["ts"], 0, float("inf"))
+            split.append((key, event))
+            continue
+
+        start = dict(event, ph=Phase.Duration.START)
+        end = dict(event, ph=Phase.Duration.END, args=None)
+        end["ts"] = event["ts"] + start.pop("dur")
+        end.pop("dur")
+
+        # Outer calls start first and end last when times are equal
+        split.append(((start["ts"], 1, -end["ts"]), start))
+        split.append(((end["ts"], 0, -start["ts"]), end))
+
+    split.sort(key=lambda x: x[0])
+    return [event for _, event in split]
+
+
 def _validate_highlander(*args):
     values = sum(1 for x in args if x is not None)
     if values != 1:
@@ -8,17 +8,73 @@ or capture arguments from.
 import os
 import sys
 import types
-from typing import Any, Callable, Optional
+import weakref
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional
 
 Predicate = Callable[[types.FrameType, str, Optional[Any]], bool]
 
 
+# Caching
+
+
+def cacheable(p: Predicate) -> Predicate:
+    """Marks a predicate that only looks at frame.f_code and the event.
+
+    Its result is then remembered for every code object (see memoize),
+    and tracers can stop listening to code that it skips entirely.
+    """
+    p.cacheable = True
+    return p
+
+
+def is_cacheable(p: Predicate) -> bool:
+    return getattr(p, "cacheable", False)
+
+
+def memoize(p: Predicate) -> Predicate:
+    """Evaluates cacheable predicates once per code object and event.
+
+    Results are only kept for as long as their code object is alive, so
+    the code of lambdas, exec'd strings and reloaded modules can still
+    be freed while the predicate is in use.
+    """
+    p = compile_predicate(p)
+    if not is_cacheable(p):
+        return p
+
+    # By id, as weak keys would cost a weakref on every lookup
+    caches: Dict[str, Dict[int, bool]] = defaultdict(dict)
+    refs: Dict[int, weakref.ref] = {}
+
+    def forget(key: int):
+        refs.pop(key, None)
+        for cache in list(caches.values()):
+            cache.pop(key, None)
+
+    def memoized(frame, event, arg):
+        cache = caches[event]
+        code = frame.f_code
+        key = id(code)
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+
+        result = cache[key] = p(frame, event, arg)
+        if key not in refs:
+            refs[key] = weakref.ref(code, lambda _, key=key: forget(key))
+        return result
+
+    return cacheable(memoized)
+
+
 # Sugar
 
 
 def module_equals(m: str):
     """Guesses the module name and does an exact match. See also file"""
-    return file(lambda f: extract_module(f) == m)
+    return Module(m)
 
 
 def stdlib():
@@ -27,39 +83,206 @@ def stdlib():
     python_path = (
         f"{prefix}/lib/python{sys.version_info.major}.{sys.version_info.minor}"
     )
-    return file(lambda f: f.startswith(python_path))
+    return FilePrefix(python_path)
 
 
 def native():
     """Match C functions"""
-    return lambda frame, event, arg: event == "c_call" or event == "c_return"
+    return Native()
 
 
 # Extractors
 
 
 def file(f: Callable[[str], bool]):
-    def filter_file(
-        frame: types.FrameType, event: str, arg: Optional[Any]
-    ) -> bool:
-        return f(frame.f_code.co_filename)
-
-    return filter_file
+    return File(f)
 
 
 # Combinators
 
 
 def not_(f: Predicate) -> bool:
-    return lambda *args, **kwargs: not f(*args, **kwargs)
+    return Not(f)
 
 
 def or_(f1: Predicate, f2: Predicate) -> bool:
-    return lambda *args, **kwargs: f1(*args, **kwargs) or f2(*args, **kwargs)
+    return Or(f1, f2)
 
 
 def and_(f1: Predicate, f2: Predicate) -> bool:
-    return lambda *args, **kwargs: f1(*args, **kwargs) and f2(*args, **kwargs)
+    return And(f1, f2)
+
+
+# Compiled predicates
+
+
+class Node:
+    """A predicate that can be compiled together with others.
+
+    Nodes can be called like any other predicate, and combined with |, &
+    and ~. compile_predicate turns a whole tree of them into a single
+    generated function.
+    """
+
+    cacheable = True
+
+    def __call__(self, frame, event, arg):
+        try:
+            compiled = self._compiled
+        except AttributeError:
+            compiled = self._compiled = compile_predicate(self)
+        return compiled(frame, event, arg)
+
+    def __or__(self, other: Predicate) -> "Or":
+        return Or(self, other)
+
+    def __and__(self, other: Predicate) -> "And":
+        return And(self, other)
+
+    def __invert__(self) -> "Not":
+        return Not(self)
+
+
+class FilePrefix(Node):
+    """Code defined in files starting with any of the prefixes"""
+
+    def __init__(self, *prefixes: str):
+        self.prefixes = prefixes
+
+
+class Module(Node):
+    """Code whose module is guessed (see extract_module) to be in names"""
+
+    def __init__(self, *names: str):
+        self.names = names
+
+
+class File(Node):
+    """Code defined in files matching an arbitrary filename predicate"""
+
+    def __init__(self, f: Callable[[str], bool]):
+        self.f = f
+
+
+class Native(Node):
+    """C function events"""
+
+
+class Custom(Node):
+    """Any other predicate, which is cacheable if it's marked as such"""
+
+    def __init__(self, p: Predicate):
+        self.p = p
+        self.cacheable = is_cacheable(p)
+
+
+class Not(Node):
+    def __init__(self, node: Predicate):
+        self.node = _node(node)
+        self.cacheable = self.node.cacheable
+
+
+class And(Node):
+    def __init__(self, *nodes: Predicate):
+        self.nodes = [_node(x) for x in nodes]
+        self.cacheable = all(x.cacheable for x in self.nodes)
+
+
+class Or(Node):
+    def __init__(self, *nodes: Predicate):
+        self.nodes = [_node(x) for x in nodes]
+        self.cacheable = all(x.cacheable for x in self.nodes)
+
+
+def compile_predicate(p: Predicate) -> Predicate:
+    """Generates a single function evaluating a tree of Nodes.
+
+    File prefixes and module names that are alternatives are merged into
+    one startswith(tuple) and one frozenset lookup, and the cheap event
+    checks always run first. Custom predicates are evaluated last.
+    Anything that isn't a Node is returned unchanged.
+    """
+    if not isinstance(p, Node):
+        return p
+
+    compiler = _Compiler()
+    expression = compiler.expression(p)
+    source = (
+        "def predicate(frame, event, arg):\n"
+        "    filename = frame.f_code.co_filename\n"
+        f"    return {expression}\n"
+    )
+    exec(source, compiler.namespace)
+
+    predicate = compiler.namespace["predicate"]
+    predicate.cacheable = p.cacheable
+    predicate.source = source
+    return predicate
+
+
+class _Compiler:
+    def __init__(self):
+        self.namespace = {"extract_module": extract_module}
+
+    def expression(self, node: Node) -> str:
+        if isinstance(node, (And, Or)):
+            return self._combination(node)
+        if isinstance(node, Not):
+            return f"(not {self.expression(node.node)})"
+        if isinstance(node, Native):
+            return '(event == "c_call" or event == "c_return")'
+        if isinstance(node, FilePrefix):
+            return f"filename.startswith({self._constant(node.prefixes)})"
+        if isinstance(node, Module):
+            names = self._constant(frozenset(node.names))
+            return f"(extract_module(filename) in {names})"
+        if isinstance(node, File):
+            return f"{self._constant(node.f)}(filename)"
+        if isinstance(node, Custom):
+            return f"{self._constant(node.p)}(frame, event, arg)"
+
+        raise TypeError(f"Can't compile {node}")
+
+    def _combination(self, node) -> str:
+        kind = type(node)
+        nodes = []
+        pending = list(node.nodes)
+        while pending:
+            x = pending.pop(0)
+            if type(x) is kind:
+                pending[:0] = x.nodes
+            else:
+                nodes.append(x)
+
+        if kind is Or:
+            # Alternative files and modules can be checked all at once
+            prefixes = [
+                y for x in nodes if type(x) is FilePrefix for y in x.prefixes
+            ]
+            modules = [y for x in nodes if type(x) is Module for y in x.names]
+            nodes = [x for x in nodes if type(x) not in (FilePrefix, Module)]
+            if modules:
+                nodes.insert(0, Module(*modules))
+            if prefixes:
+                nodes.insert(0, FilePrefix(*prefixes))
+
+        order = {Native: 0, FilePrefix: 1, Module: 2, File: 3, Custom: 5}
+        nodes.sort(key=lambda x: order.get(type(x), 4))
+
+        if not nodes:
+            return "False" if kind is Or else "True"
+
+        operator = " or " if kind is Or else " and "
+        return "(" + operator.join(self.expression(x) for x in nodes) + ")"
+
+    def _constant(self, value) -> str:
+        name = f"_{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+
+def _node(p: Predicate) -> Node:
+    return p if isinstance(p, Node) else Custom(p)
 
 
 # Utilities
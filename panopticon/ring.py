@@ -0,0 +1,336 @@
+#!/bin/env python3
+
+"""
+A flight recorder: keeps the last few events of every thread in bounded
+memory, and only writes them out when something interesting happens.
+"""
+
+import atexit
+import logging
+import os
+import signal
+import sys
+import threading
+from array import array
+from typing import Any, Dict, Hashable, Iterator, List, Optional
+
+from panopticon.trace import (
+    Phase,
+    Trace,
+    TraceEvent,
+    _extra_fields,
+    _stamp,
+    _untraced_threads,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RingTrace(Trace):
+    """Keeps the most recent `capacity` events of each thread.
+
+    Storage for every thread grows with its events up to `capacity`, and
+    is then overwritten in place, so memory stays bounded no matter how
+    long the process runs. `window` (in seconds) further limits dumps to
+    the most recent events.
+
+    At most `max_threads` threads are recorded at once. The rings of
+    threads that exited make room for new ones; once none are left, the
+    events of further threads are only counted in `dropped`.
+
+    Events are written out to `path` as Catapult json by dump(), which
+    install() wires up to SIGUSR2, unhandled exceptions and exit. `path`
+    is formatted with the pid and the number of the dump (`{pid}`, `{n}`).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        capacity: int = 100000,
+        window: Optional[float] = None,
+        max_threads: int = 64,
+    ):
+        super().__init__()
+        self.dumps = 0
+        self._path = path
+        self._capacity = capacity
+        self._window = window
+        self._max_threads = max_threads
+        self._symbols = None
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._rings: Dict[int, _Ring] = {}
+        self._refused: List[_Refused] = []
+        self._previous = None
+
+    @property
+    def dropped(self) -> int:
+        """Events of threads that there was no room for"""
+        with self._lock:
+            return sum(x.count for x in self._refused)
+
+    def add_event(self, event: TraceEvent):
+        try:
+            ring = self._local.ring
+        except AttributeError:
+            ring = self._ring(event.tid)
+
+        extra = _extra_fields(type(event))
+        ring.append(
+            event.ts,
+            event.tts,
+            getattr(event, "dur", None),
+            event.pid,
+            event.tid,
+            event.ph,
+            event.name,
+            event.cat,
+            event.args,
+            (
+                tuple((key, getattr(event, key)) for key in extra)
+                if extra
+                else None
+            ),
+        )
+
+    def add_code_event(self, key, ph, args, symbols):
+        self._symbols = symbols
+
+        ts, tts, pid, tid = _stamp()
+        try:
+            ring = self._local.ring
+        except AttributeError:
+            ring = self._ring(tid)
+
+        ring.append(ts, tts, None, pid, tid, ph, key, _SYMBOL, args, None)
+
+    def events(self) -> Iterator[Dict[str, Any]]:
+        """The retained events, with orphaned ends dropped"""
+        with self._lock:
+            rings = list(self._rings.items())
+
+        snapshots = [ring.snapshot() for _, ring in rings]
+        cutoff = None
+        if self._window is not None and snapshots:
+            latest = max(
+                (events[-1][0] for events in snapshots if events),
+                default=0,
+            )
+            cutoff = latest - self._window * 1e9
+
+        for events in snapshots:
+            depth = 0
+            for ts, tts, dur, pid, tid, ph, name, cat, args, extra in events:
+                if cutoff is not None and ts < cutoff:
+                    continue
+
+                if ph == Phase.Duration.START:
+                    depth += 1
+                elif ph == Phase.Duration.END:
+                    if depth == 0:
+                        continue  # Its start was overwritten
+                    depth -= 1
+
+                if cat is _SYMBOL:
+                    name, cat = self._symbols(name)
+
+                result = {
+                    "name": name,
+                    "cat": cat,
+                    "ph": ph,
+                    "args": args,
+                    "ts": ts / 1000,
+                }
+                if tts >= 0:
+                    result["tts"] = tts / 1000
+                if dur >= 0:
+                    result["dur"] = dur / 1000
+                result["pid"] = pid
+                result["tid"] = tid
+                if extra:
+                    result.update(extra)
+
+                yield result
+
+    def dump(self, path: Optional[str] = None) -> str:
+        """Writes out the retained events, returning the file name"""
+        path = path or self._path.format(pid=os.getpid(), n=self.dumps)
+        self.dumps += 1
+
+        # Don't record the dump itself
+        profile = sys.getprofile()
+        sys.setprofile(None)
+        ident = threading.get_ident()
+        untraced = ident in _untraced_threads
+        _untraced_threads.add(ident)
+        try:
+            with open(path, "w") as out:
+                out.write(str(self))
+        finally:
+            if not untraced:
+                _untraced_threads.discard(ident)
+            sys.setprofile(profile)
+
+        logger.info(f"Dumped flight recorder trace to {path}")
+        return path
+
+    def install(
+        self, signum: Optional[int] = getattr(signal, "SIGUSR2", None)
+    ):
+        """Dumps on `signum`, unhandled exceptions and exit"""
+        previous_signal = None
+        if signum is not None and threading.current_thread() is (
+            threading.main_thread()
+        ):
+            previous_signal = signal.signal(signum, self._on_signal)
+
+        self._previous = (
+            signum,
+            previous_signal,
+            sys.excepthook,
+            getattr(threading, "excepthook", None),
+        )
+        sys.excepthook = self._on_exception
+        if hasattr(threading, "excepthook"):
+            threading.excepthook = self._on_thread_exception
+        atexit.register(self.dump)
+
+        return self
+
+    def uninstall(self):
+        if not self._previous:
+            return
+
+        signum, previous_signal, excepthook, thread_excepthook = self._previous
+        self._previous = None
+
+        if previous_signal is not None:
+            signal.signal(signum, previous_signal)
+        sys.excepthook = excepthook
+        if thread_excepthook is not None:
+            threading.excepthook = thread_excepthook
+        atexit.unregister(self.dump)
+
+    def _on_signal(self, signum, frame):
+        self.dump()
+
+        previous = self._previous and self._previous[1]
+        if callable(previous):
+            previous(signum, frame)
+
+    def _on_exception(self, *args):
+        self.dump()
+        self._previous[2](*args)
+
+    def _on_thread_exception(self, args):
+        self.dump()
+        self._previous[3](args)
+
+    def _ring(self, tid: int):
+        with self._lock:
+            if len(self._rings) >= self._max_threads and not self._evict():
+                ring = _Refused()
+                self._refused.append(ring)
+            else:
+                ring = self._rings[tid] = _Ring(self._capacity)
+
+        self._local.ring = ring
+        return ring
+
+    def _evict(self) -> bool:
+        """Reclaims the ring of a thread that has since exited, if any"""
+        alive = {
+            getattr(x, "native_id", x.ident) for x in threading.enumerate()
+        }
+        for tid in list(self._rings):
+            if tid not in alive:
+                del self._rings[tid]
+                return True
+        return False
+
+
+_SYMBOL = object()  # Marks a category that's resolved through the name
+
+
+class _Ring:
+    """Storage for one thread's most recent events, which grows up to
+    `capacity` events and is then overwritten oldest first"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.count = 0
+
+        self.ts = array("q")
+        self.tts = array("q")
+        self.dur = array("q")
+        self.pid = array("l")
+        self.tid = array("q")
+        self.ph: List[Optional[str]] = []
+        self.name: List[Hashable] = []
+        self.cat: List[Any] = []
+        self.args: List[Optional[Dict[str, Any]]] = []
+        self.extra: List[Optional[tuple]] = []
+
+    def append(self, ts, tts, dur, pid, tid, ph, name, cat, args, extra):
+        if self.count < self.capacity:
+            self.ts.append(ts)
+            self.tts.append(-1 if tts is None else tts)
+            self.dur.append(-1 if dur is None else dur)
+            self.pid.append(pid)
+            self.tid.append(tid)
+            self.ph.append(ph)
+            self.name.append(name)
+            self.cat.append(cat)
+            self.args.append(args)
+            self.extra.append(extra)
+            self.count += 1
+            return
+
+        i = self.count % self.capacity
+        self.ts[i] = ts
+        self.tts[i] = -1 if tts is None else tts
+        self.dur[i] = -1 if dur is None else dur
+        self.pid[i] = pid
+        self.tid[i] = tid
+        self.ph[i] = ph
+        self.name[i] = name
+        self.cat[i] = cat
+        self.args[i] = args
+        self.extra[i] = extra
+        self.count += 1
+
+    def snapshot(self):
+        """Retained events, oldest first"""
+        count = self.count
+        start = max(0, count - self.capacity)
+        columns = (
+            self.ts,
+            self.tts,
+            self.dur,
+            self.pid,
+            self.tid,
+            self.ph,
+            self.name,
+            self.cat,
+            self.args,
+            self.extra,
+        )
+
+        events = []
+        for n in range(start, count):
+            i = n % self.capacity
+            events.append(tuple(column[i] for column in columns))
+        return events
+
+
+class _Refused:
+    """Stands in for the ring of a thread there was no room for"""
+
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+    def append(self, *event):
+        self.count += 1
@@ -0,0 +1,155 @@
+#!/bin/env python3
+
+"""
+Statistical tracing: periodically snapshots the stacks of all threads
+instead of hooking every call, trading precision for low overhead.
+"""
+
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from panopticon.clock import default_clock
+from panopticon.predicate import Predicate, memoize, module_equals, or_
+from panopticon.trace import (
+    DurationTraceEvent,
+    Phase,
+    Trace,
+    _untraced_threads,
+)
+from panopticon.tracer import FunctionTracer
+
+# A sampled frame: frame ids are only unique while the frame is alive,
+# so they're paired with the code to tell calls apart
+_Entry = Tuple[int, object]
+
+
+class Sampler:
+    """Samples every thread's stack `hz` times a second.
+
+    Frames that stay on a stack for consecutive samples are merged into
+    a single duration event, so the output looks like a FunctionTracer
+    trace that only contains calls lasting longer than about 1/hz.
+    """
+
+    def __init__(
+        self,
+        trace=None,
+        hz: float = 1000,
+        skip: Optional[Predicate] = None,
+    ):
+        self._trace = trace or Trace()
+        self._interval = 1 / hz
+        self._skip = module_equals("panopticon")
+        if skip:
+            self._skip = or_(self._skip, skip)
+        self._skip = memoize(self._skip)
+
+        self._stacks: Dict[int, List[_Entry]] = {}
+        self._symbols: Dict[object, Tuple[str, str]] = {}
+        self._native_ids: Dict[int, int] = {}
+        self._stopped = threading.Event()
+        self._stopping = None
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._stopping = None
+        self._thread = threading.Thread(
+            target=self._run, name="panopticon-sampler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping = threading.get_ident()  # Don't sample stopping
+        self._stopped.set()
+        self._thread.join()
+
+        # Close whatever was still running
+        now = default_clock.now()
+        for ident, stack in self._stacks.items():
+            self._end(ident, stack, 0, now)
+        self._stacks.clear()
+        self._trace.flush()
+
+    def get_trace(self):
+        return self._trace
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        me = threading.get_ident()
+        _untraced_threads.add(me)
+        try:
+            while not self._stopped.wait(self._interval):
+                self.sample()
+        finally:
+            _untraced_threads.discard(me)
+
+    def sample(self):
+        """Records the stacks of all threads at this point in time"""
+        frames = sys._current_frames()
+        now = default_clock.now()
+
+        for ident, frame in frames.items():
+            if ident in _untraced_threads or ident == self._stopping:
+                continue
+
+            stack = []
+            while frame is not None:
+                if not self._skip(frame, "call", None):
+                    stack.append((id(frame), frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+
+            previous = self._stacks.get(ident, [])
+            common = 0
+            for old, new in zip(previous, stack):
+                if old != new:
+                    break
+                common += 1
+
+            self._end(ident, previous, common, now)
+            for _, code in stack[common:]:
+                self._event(ident, code, Phase.Duration.START, now)
+            self._stacks[ident] = stack
+
+        # Threads that have exited
+        for ident in list(self._stacks):
+            if ident not in frames:
+                self._end(ident, self._stacks.pop(ident), 0, now)
+                self._native_ids.pop(ident, None)
+
+    def _end(self, ident: int, stack: List[_Entry], keep: int, ts: int):
+        for _, code in reversed(stack[keep:]):
+            self._event(ident, code, Phase.Duration.END, ts)
+
+    def _event(self, ident: int, code, ph: Phase.Duration, ts: int):
+        try:
+            name, cat = self._symbols[code]
+        except KeyError:
+            name, cat = self._symbols[code] = (
+                FunctionTracer._get_code_name(code),
+                f"{code.co_filename}:{code.co_firstlineno}",
+            )
+
+        event = DurationTraceEvent(name=name, cat=cat, ph=ph)
+        event.ts = ts
+        event.tts = None
+        event.tid = self._native_id(ident)
+        self._trace.add_event(event)
+
+    def _native_id(self, ident: int) -> int:
+        try:
+            return self._native_ids[ident]
+        except KeyError:
+            for thread in threading.enumerate():
+                self._native_ids[thread.ident] = getattr(
+                    thread, "native_id", thread.ident
+                )
+            return self._native_ids.setdefault(ident, ident)
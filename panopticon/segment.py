@@ -0,0 +1,157 @@
+#!/bin/env python3
+
+"""Splits long traces into a series of independently loadable files"""
+
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from panopticon.clock import default_clock
+from panopticon.trace import (
+    Phase,
+    Trace,
+    TraceEvent,
+    _ThreadBatches,
+    event_dict,
+)
+from panopticon.version import version
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentedTrace(Trace):
+    """Rolls over to a new json file every `max_bytes` or `max_seconds`.
+
+    Segments are named by inserting a sequence number before the
+    extension of `path` (trace.json -> trace.00000.json). Every segment
+    is a complete trace: calls still running when a segment is closed
+    are ended in it, and begun again at the start of the next one. With
+    `keep`, only the most recent `keep` segments are left on disk.
+
+    Threads buffer events separately, which are merged by timestamp and
+    written whenever a thread has `batch_size` of them, or on flush().
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: Optional[int] = 64 * 1024 * 1024,
+        max_seconds: Optional[float] = None,
+        keep: Optional[int] = None,
+        batch_size: int = 4096,
+    ):
+        super().__init__()
+        self.segments: List[str] = []
+
+        self._root, self._ext = os.path.splitext(path)
+        self._max_bytes = max_bytes
+        self._max_ns = None if max_seconds is None else max_seconds * 1e9
+        self._keep = keep
+        self._batch_size = batch_size
+
+        self._batches = _ThreadBatches()
+        self._lock = threading.Lock()
+        self._open: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        self._out = None
+        self._open_segment()
+
+    def add_event(self, event: TraceEvent):
+        batch = self._batches.get()
+        batch.events.append(event)
+        if len(batch.events) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._out:
+                self._write_batches()
+                self._out.flush()
+
+    def close(self):
+        with self._lock:
+            if self._out:
+                self._write_batches()
+                self._close_segment()
+
+    def _write_batches(self):
+        for event in self._batches.take():
+            self._write(event_dict(event))
+            if self._started is None:
+                self._started = event.ts
+
+            ph = event.ph
+            if ph == Phase.Duration.START:
+                self._open[event.tid].append(event_dict(event))
+            elif ph == Phase.Duration.END:
+                stack = self._open[event.tid]
+                if stack:
+                    stack.pop()
+
+            if self._full(event.ts):
+                self._close_segment()
+                self._open_segment()
+
+    def __str__(self) -> str:
+        return f"SegmentedTrace ({self._root}.*{self._ext})"
+
+    def _full(self, ts: int) -> bool:
+        return (
+            self._max_bytes is not None and self._written >= self._max_bytes
+        ) or (self._max_ns is not None and ts - self._started >= self._max_ns)
+
+    def _write(self, event: Dict[str, Any]):
+        text = json.dumps(event)
+        if self._events:
+            text = ",\n" + text
+        self._out.write(text)
+        self._written += len(text)
+        self._events += 1
+
+    def _open_segment(self):
+        path = f"{self._root}.{len(self.segments):05d}{self._ext}"
+        self.segments.append(path)
+
+        self._out = open(path, "w")
+        self._out.write('{"traceEvents": [\n')
+        self._written = 0
+        self._events = 0
+        self._started = None  # ts of the first new event
+
+        # Resume calls that were still running
+        for stack in self._open.values():
+            for event in stack:
+                self._write(event)
+
+        if self._keep is not None and len(self.segments) > self._keep:
+            expired = self.segments[-self._keep - 1]
+            try:
+                os.remove(expired)
+            except OSError:
+                logger.exception(f"Couldn't remove segment {expired}")
+
+    def _close_segment(self):
+        ts = default_clock.now() / 1000
+        for stack in self._open.values():
+            for event in reversed(stack):
+                self._write(
+                    {
+                        "name": event["name"],
+                        "cat": event["cat"],
+                        "ph": Phase.Duration.END,
+                        "args": None,
+                        "ts": ts,
+                        "pid": event["pid"],
+                        "tid": event["tid"],
+                    }
+                )
+
+        self._out.write("\n],\n")
+        self._out.write('"displayTimeUnit": "ns",\n')
+        self._out.write(
+            f'"otherData": {{"version": "Panopticon {version}"}}}}\n'
+        )
+        self._out.close()
+        self._out = None
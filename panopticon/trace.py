@@ -4,29 +4,126 @@
 
 from __future__ import annotations
 
+import heapq
 import io
 import json
-import os
+import logging
+import queue
+import sys
 import threading
-import time
-from dataclasses import asdict, dataclass, field
+from array import array
+from dataclasses import dataclass, field, fields
 from enum import Enum
-from typing import Any, Dict, Optional
-
+from operator import attrgetter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from panopticon.clock import default_clock
 from panopticon.version import version
 
+logger = logging.getLogger(__name__)
+
+_stamp = default_clock.stamp
+
+# Threads panopticon runs itself, which tracers always ignore
+_untraced_threads: Set[int] = set()
+
 
 class Trace:
+    """Keeps events in memory, packed into typed columns.
+
+    Timestamps and identifiers live in `array` columns while names,
+    categories and other repeated values are interned into a table, so
+    each event costs tens of bytes instead of a dataclass and a dict.
+    Dictionaries are only rebuilt when the trace is serialized.
+
+    Every thread records into columns of its own, so threads never wait
+    on each other to add events; they're merged by timestamp when the
+    trace is serialized.
+    """
+
     def __init__(self):
-        self._events = []
+        self._symbols = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._buffers: List[_Columns] = []
+
+        # Only events kept in these columns can be named once serialized,
+        # subclasses that store events their own way get them resolved
+        if type(self).add_event is Trace.add_event:
+            self.add_code_event = self._defer_code_event
 
     def add_event(self, event: TraceEvent):
-        self._events.append(event)
+        try:
+            columns = self._local.columns
+        except AttributeError:
+            columns = self._columns()
+
+        columns.append(event)
+
+    def add_code_event(
+        self,
+        key: Hashable,
+        ph: Phase.Duration,
+        args: Optional[Dict[str, Any]],
+        symbols: Callable[[Hashable], Tuple[str, str]],
+    ):
+        """Records a duration event for the code identified by key.
+
+        `symbols` maps keys (usually code objects) to a name and category,
+        memoizing them. Traces that keep events in memory only call it
+        once they're serialized; others call it immediately.
+        """
+        name, cat = symbols(key)
+        self.add_event(
+            DurationTraceEvent(name=name, cat=cat, ph=ph, args=args)
+        )
+
+    def _defer_code_event(self, key, ph, args, symbols):
+        self._symbols = symbols
+        try:
+            columns = self._local.columns
+        except AttributeError:
+            columns = self._columns()
+
+        columns.append_code(key, ph, args, _stamp())
+
+    def _columns(self) -> _Columns:
+        columns = self._local.columns = _Columns()
+        with self._lock:
+            self._buffers.append(columns)
+        return columns
+
+    def events(self) -> Iterator[Dict[str, Any]]:
+        """Rebuilds the recorded events as dicts, in timestamp order"""
+        with self._lock:
+            buffers = list(self._buffers)
+
+        return heapq.merge(
+            *(x.events(self._symbols) for x in buffers),
+            key=_event_timestamp,
+        )
+
+    def flush(self):
+        """Pushes out any events held back by the trace"""
+
+    def close(self):
+        """Flushes and releases any resources held by the trace"""
+        self.flush()
 
     def __str__(self) -> str:
         return json.dumps(
             {
-                "traceEvents": [asdict(x) for x in self._events],
+                "traceEvents": list(self.events()),
                 "displayTimeUnit": "ns",
                 "otherData": {"version": f"Panopticon {version}"},
             },
@@ -38,13 +135,14 @@ class StreamingTrace(Trace):
     """Streams data to a file without keeping it in memory"""
 
     def __init__(self, stream: io.IOBase):
+        super().__init__()
         self._out = stream
         self._out.write("[\n")  # Opening brace
         self._out.flush()
 
     def add_event(self, event: TraceEvent):
-        json.dump(asdict(event), self._out)
-        self._out.write(",\n")
+        # A single write, so events of different threads don't interleave
+        self._out.write(json.dumps(event_dict(event)) + ",\n")
         self._out.flush()
 
     def __str__(self) -> str:
@@ -56,6 +154,193 @@ class StreamingTrace(Trace):
             return f"StreamingTrace ({self._out})"
 
 
+class Overflow(Enum):
+    """What a BufferedStreamingTrace does when its queue is full"""
+
+    BLOCK = "block"  # Wait for the writer thread to catch up
+    DROP = "drop"  # Discard the batch and count the events in `dropped`
+    SPILL = "spill"  # Write the batch out from the calling thread instead
+
+
+class BufferedStreamingTrace(StreamingTrace):
+    """Batches events in memory and writes them from a background thread
+
+    Every thread fills batches of its own without locking. They're
+    serialized and written once they hold `batch_size` events, or every
+    `flush_interval` seconds if fewer events arrive, merged by timestamp
+    with what the other threads added. At most `max_batches` batches
+    wait in the queue before `overflow` kicks in.
+    """
+
+    _CLOSE = object()
+
+    def __init__(
+        self,
+        stream: io.IOBase,
+        batch_size: int = 4096,
+        flush_interval: float = 1.0,
+        max_batches: int = 64,
+        overflow: Overflow = Overflow.BLOCK,
+    ):
+        super().__init__(stream)
+        self.dropped = 0
+
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._overflow = overflow
+
+        self._batches = _ThreadBatches()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._queue = queue.Queue(max_batches)
+        self._writer = threading.Thread(
+            target=self._run, name="panopticon-writer", daemon=True
+        )
+        self._writer.start()
+
+    def add_event(self, event: TraceEvent):
+        batch = self._batches.get()
+        batch.events.append(event)
+        if len(batch.events) >= self._batch_size:
+            self._enqueue(batch.take())
+
+    def flush(self):
+        """Blocks until all events added so far have been written"""
+        if self._writer.is_alive():
+            batch = self._take_batch()
+            if batch:
+                self._queue.put(batch)
+            self._queue.join()
+            with self._write_lock:
+                ...  # Wait out any flush triggered by the interval
+
+    def close(self):
+        if self._writer.is_alive():
+            self.flush()
+            self._queue.put(self._CLOSE)
+            self._writer.join()
+
+        if self.dropped:
+            logger.warning(f"Dropped {self.dropped} events from the trace")
+
+    def __str__(self) -> str:
+        self.flush()
+        return super().__str__()
+
+    def _enqueue(self, batch):
+        if self._overflow is Overflow.BLOCK:
+            self._queue.put(batch)
+            return
+
+        try:
+            self._queue.put_nowait(batch)
+        except queue.Full:
+            if self._overflow is Overflow.DROP:
+                with self._lock:
+                    self.dropped += len(batch)
+            else:
+                self._write(batch)
+
+    def _take_batch(self):
+        return self._batches.take()
+
+    def _run(self):
+        # Never trace the writer itself
+        sys.setprofile(None)
+        _untraced_threads.add(threading.get_ident())
+        try:
+            self._drain()
+        finally:
+            _untraced_threads.discard(threading.get_ident())
+
+    def _drain(self):
+        while True:
+            try:
+                batch = self._queue.get(timeout=self._flush_interval)
+            except queue.Empty:
+                with self._write_lock:
+                    self._write_unlocked(self._take_batch())
+                continue
+
+            try:
+                if batch is self._CLOSE:
+                    return
+                self._write(batch)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        with self._write_lock:
+            self._write_unlocked(batch)
+
+    def _write_unlocked(self, batch):
+        if not batch:
+            return
+
+        self._out.write(
+            "".join(json.dumps(event_dict(x)) + ",\n" for x in batch)
+        )
+        self._out.flush()
+
+
+class _Batch:
+    """Events added by one thread, which only it appends to"""
+
+    __slots__ = ("events", "lock")
+
+    def __init__(self):
+        self.events: List[TraceEvent] = []
+        self.lock = threading.Lock()  # Between takers, appends don't wait
+
+    def take(self) -> List[TraceEvent]:
+        with self.lock:
+            count = len(self.events)
+            taken = self.events[:count]
+            del self.events[:count]  # Keeps whatever was appended since
+        return taken
+
+
+class _ThreadBatches:
+    """A _Batch for every thread that adds events, see take()"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._batches: List[Tuple[threading.Thread, _Batch]] = []
+
+    def get(self) -> _Batch:
+        """The batch of the calling thread"""
+        try:
+            return self._local.batch
+        except AttributeError:
+            batch = self._local.batch = _Batch()
+            with self._lock:
+                self._batches.append((threading.current_thread(), batch))
+            return batch
+
+    def take(self) -> List[TraceEvent]:
+        """Empties the batches of all threads, in timestamp order"""
+        with self._lock:
+            batches = list(self._batches)
+
+        events = []
+        for thread, batch in batches:
+            events += batch.take()
+            if not thread.is_alive() and not batch.events:
+                with self._lock:
+                    self._batches.remove((thread, batch))
+
+        events.sort(key=_timestamp)
+        return events
+
+
+_timestamp = attrgetter("ts")
+
+
+def _event_timestamp(event: Dict[str, Any]) -> float:
+    return event["ts"]
+
+
 class _SerializableEnum(str, Enum):
     ...
 
@@ -69,10 +354,11 @@ class Phase:
         INSTANT = "i"
 
     class Counter(_SerializableEnum):
-        COUNTER = "c"
+        COUNTER = "C"
 
     class Complete(_SerializableEnum):
-        INSTANT = "X"
+        COMPLETE = "X"
+        INSTANT = "X"  # Deprecated alias
 
     class Async(_SerializableEnum):
         START = "b"
@@ -96,17 +382,13 @@ class TraceEvent:
     cat: str
     ph: str
     args: Optional[Dict[str, Any]] = None
-    ts: int = field(init=False)
-    tts: int = field(init=False)
+    ts: int = field(init=False)  # ns
+    tts: Optional[int] = field(init=False)  # ns, see clock.configure
     pid: int = field(init=False)
     tid: int = field(init=False)
 
     def __post_init__(self):
-        # Allow aligning with other traces
-        self.ts = time.time_ns() / 1000
-        self.tts = time.thread_time_ns() / 1000
-        self.pid = os.getpid()
-        self.tid = _get_thread_id()
+        self.ts, self.tts, self.pid, self.tid = _stamp()
 
 
 @dataclass
@@ -114,6 +396,14 @@ class DurationTraceEvent(TraceEvent):
     ph: Phase.Duration
 
 
+@dataclass
+class CompleteTraceEvent(TraceEvent):
+    """A whole call in one event, see FunctionTracer's `complete`"""
+
+    ph: Phase.Complete = Phase.Complete.COMPLETE
+    dur: int = 0  # ns
+
+
 class InstantScope(_SerializableEnum):
     GLOBAL = "g"
     PROCESS = "p"
@@ -139,8 +429,205 @@ class FlowTraceEvent(TraceEvent):
     bp: FlowBindingPoint = FlowBindingPoint.ENCLOSING
 
 
-def _get_thread_id() -> int:
+@dataclass
+class CounterTraceEvent(TraceEvent):
+    """Values of the counters in args, one series per key"""
+
+    ph: Phase.Counter = Phase.Counter.COUNTER
+
+
+@dataclass
+class AsyncTraceEvent(TraceEvent):
+    id: int = 0  # Events with the same cat and id form one async slice
+    ph: Phase.Async = Phase.Async.START
+
+
+def event_dict(event: TraceEvent) -> Dict[str, Any]:
+    """Catapult's representation of an event, with times in us"""
+    result = {
+        "name": event.name,
+        "cat": event.cat,
+        "ph": event.ph,
+        "args": event.args,
+        "ts": event.ts / 1000,
+    }
+    if event.tts is not None:
+        result["tts"] = event.tts / 1000
+    dur = getattr(event, "dur", None)
+    if dur is not None:
+        result["dur"] = dur / 1000
+    result["pid"] = event.pid
+    result["tid"] = event.tid
+
+    for key in _extra_fields(type(event)):
+        result[key] = getattr(event, key)
+
+    return result
+
+
+_BASE_FIELDS = (
+    "name",
+    "cat",
+    "ph",
+    "args",
+    "ts",
+    "tts",
+    "dur",
+    "pid",
+    "tid",
+)
+_extra_fields_cache: Dict[type, Tuple[str, ...]] = {}
+
+
+def _extra_fields(cls: type) -> Tuple[str, ...]:
+    """Fields an event type adds on top of TraceEvent, e.g. flow ids"""
     try:
-        return threading.get_native_id()
-    except AttributeError:
-        return threading.get_ident()
+        return _extra_fields_cache[cls]
+    except KeyError:
+        extra = tuple(
+            f.name for f in fields(cls) if f.name not in _BASE_FIELDS
+        )
+        _extra_fields_cache[cls] = extra
+        return extra
+
+
+_shared_fields_cache: Dict[type, Tuple[str, ...]] = {}
+
+
+def _shared_fields(cls: type) -> Tuple[str, ...]:
+    """Extra fields but the id, which is unique to a flow or async slice
+    and mustn't go into string tables"""
+    try:
+        return _shared_fields_cache[cls]
+    except KeyError:
+        shared = tuple(x for x in _extra_fields(cls) if x != "id")
+        _shared_fields_cache[cls] = shared
+        return shared
+
+
+class _Interner:
+    """Assigns dense integer ids to hashable values"""
+
+    def __init__(self):
+        self._ids: Dict[Hashable, int] = {}
+        self.values: List[Hashable] = []
+
+    def __call__(self, value: Hashable) -> int:
+        try:
+            return self._ids[value]
+        except KeyError:
+            index = self._ids[value] = len(self.values)
+            self.values.append(value)
+            return index
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+_SYMBOL = -1  # Marks a category that's resolved through the name key
+_NO_ID = -1  # Other ids are interned, see _Columns.append
+
+
+class _Columns:
+    """Column-oriented storage for the events of a thread, see Trace"""
+
+    def __init__(self):
+        self.intern = _Interner()
+        self.ts = array("q")
+        self.tts = array("q")  # -1 when thread time isn't recorded
+        self.dur = array("q")  # -1 for anything but complete events
+        self.pid = array("l")
+        self.tid = array("q")
+        self.ph = array("i")
+        self.name = array("i")
+        self.cat = array("i")
+        self.id = array("q")  # Flow and async ids, _NO_ID for others
+        self.extra = array("i")  # Interned tuple of other extra fields
+        self.args: Dict[int, Dict[str, Any]] = {}  # Sparse
+
+    def __len__(self) -> int:
+        # cat is appended last, so other threads never see partial events
+        return len(self.cat)
+
+    def append(self, event: TraceEvent):
+        intern = self.intern
+        if event.args is not None:
+            self.args[len(self.ts)] = event.args
+
+        extra = _shared_fields(type(event))
+        ident = getattr(event, "id", None)
+        if ident is None:
+            ident = _NO_ID
+        elif type(ident) is not int or not 0 <= ident < 2**63:
+            # Ids that don't fit the column are interned with the rest
+            extra = _extra_fields(type(event))
+            ident = _NO_ID
+        self.id.append(ident)
+        self.extra.append(
+            intern(tuple((key, getattr(event, key)) for key in extra))
+            if extra
+            else -1
+        )
+
+        self.ts.append(event.ts)
+        self.tts.append(-1 if event.tts is None else event.tts)
+        self.dur.append(getattr(event, "dur", -1))
+        self.pid.append(event.pid)
+        self.tid.append(event.tid)
+        self.ph.append(intern(event.ph))
+        self.name.append(intern(event.name))
+        self.cat.append(intern(event.cat))
+
+    def append_code(self, key: Hashable, ph: Phase.Duration, args, stamp):
+        """Appends an event whose name and category are resolved from key"""
+        if args is not None:
+            self.args[len(self.ts)] = args
+
+        ts, tts, pid, tid = stamp
+        self.id.append(_NO_ID)
+        self.extra.append(-1)
+        self.ts.append(ts)
+        self.tts.append(-1 if tts is None else tts)
+        self.dur.append(-1)
+        self.pid.append(pid)
+        self.tid.append(tid)
+        self.ph.append(self.intern(ph))
+        self.name.append(self.intern(key))
+        self.cat.append(_SYMBOL)
+
+    def event(
+        self, i: int, values: List[Hashable], symbols=None
+    ) -> Dict[str, Any]:
+        cat = self.cat[i]
+        if cat == _SYMBOL:
+            name, cat = symbols(values[self.name[i]])
+        else:
+            name, cat = values[self.name[i]], values[cat]
+
+        result = {
+            "name": name,
+            "cat": cat,
+            "ph": values[self.ph[i]],
+            "args": self.args.get(i),
+            "ts": self.ts[i] / 1000,
+        }
+        if self.tts[i] >= 0:
+            result["tts"] = self.tts[i] / 1000
+        if self.dur[i] >= 0:
+            result["dur"] = self.dur[i] / 1000
+        result["pid"] = self.pid[i]
+        result["tid"] = self.tid[i]
+
+        ident = self.id[i]
+        if ident != _NO_ID:
+            result["id"] = ident
+        extra = self.extra[i]
+        if extra >= 0:
+            result.update(values[extra])
+        return result
+
+    def events(self, symbols=None) -> Iterator[Dict[str, Any]]:
+        """The events in timestamp order, which complete events break"""
+        values = self.intern.values
+        for i in sorted(range(len(self)), key=self.ts.__getitem__):
+            yield self.event(i, values, symbols)
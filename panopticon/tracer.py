@@ -4,41 +4,111 @@
 
 import abc
 import dis
-import logging
 import os
 import sys
 import threading
-from typing import Any, Dict, Optional
+import types
+from threading import get_ident
+from typing import Any, Dict, Hashable, List, Optional
 
 import opcode
 
-from .predicate import Predicate, module_equals, or_
+from .allocations import AllocationTracker
+from .capture import ArgumentCapture, safe_repr
+from .predicate import (
+    Predicate,
+    is_cacheable,
+    memoize,
+    module_equals,
+    or_,
+)
 from .trace import (
+    CompleteTraceEvent,
     DurationTraceEvent,
     FlowBindingPoint,
     FlowTraceEvent,
     Phase,
     Trace,
+    _untraced_threads,
 )
 
-logger = logging.getLogger(__name__)
-
 
 class Tracer(abc.ABC):
-    def __init__(self, trace=None, skip: Optional[Predicate] = None):
+    """Reports calls and returns to _call like a setprofile function.
+
+    On Python 3.12+ events come from sys.monitoring (PEP 669) instead, so
+    code rejected by `skip` is disabled after its first event and costs
+    nothing from then on. sys.setprofile is used when monitoring isn't
+    available, or when another profiler already holds its tool id.
+
+    Monitoring covers every thread. With setprofile, only the current
+    thread and those started afterwards are traced, unless `all_threads`
+    is set: threads that are already running are then included too,
+    through threading.setprofile_all_threads on 3.12+, or on older
+    versions from when they call attach(). Either way, threads leave the
+    trace on stop.
+
+    Cacheable predicates (see predicate.cacheable) are only evaluated
+    once per code object; others are evaluated for every event, and
+    never disable anything.
+    """
+
+    def __init__(
+        self,
+        trace=None,
+        skip: Optional[Predicate] = None,
+        all_threads: bool = False,
+    ):
         self._trace = trace or Trace()
         self._skip = module_equals("panopticon")
         if skip:
             self._skip = or_(self._skip, skip)
+        self._skip = memoize(self._skip)
+        self._monitoring = False
+        self._all_threads = all_threads
+        self._attached = False
+        self._profile = self._profile_all_threads if all_threads else self
+
+        # What monitoring callbacks return for skipped code
+        self._skipped = (
+            _DISABLE if _MONITORING and is_cacheable(self._skip) else None
+        )
 
     def start(self):
-        threading.setprofile(self)  # Avoid noise
-        sys.setprofile(self)
+        if _MONITORING and sys.monitoring.get_tool(_TOOL_ID) is None:
+            self._start_monitoring()
+        elif self._all_threads:
+            self._attached = True
+            if hasattr(threading, "setprofile_all_threads"):
+                threading.setprofile_all_threads(self._profile)
+            else:
+                _attachable.append(self)
+                threading.setprofile(self._profile)
+                sys.setprofile(self._profile)
+        else:
+            threading.setprofile(self)  # Avoid noise
+            sys.setprofile(self)
         return self
 
     def stop(self):
-        sys.setprofile(None)
-        threading.setprofile(None)
+        if self._monitoring:
+            self._stop_monitoring()
+        elif self._all_threads:
+            # Threads that can't be reached detach on their next event
+            self._attached = False
+            if hasattr(threading, "setprofile_all_threads"):
+                threading.setprofile_all_threads(None)
+            else:
+                _attachable.remove(self)
+                sys.setprofile(None)
+                threading.setprofile(None)
+        else:
+            sys.setprofile(None)
+            threading.setprofile(None)
+        self._flush()
+
+    def _flush(self):
+        self._trace.flush()
 
     def get_trace(self):
         return self._trace
@@ -50,63 +120,367 @@ class Tracer(abc.ABC):
         self.stop()
 
     def __call__(self, frame, event, arg):
-        if self._skip(frame, event, arg):
+        # Threads started while tracing inherit the profiler, including
+        # the ones of panopticon that record other things into the trace
+        if get_ident() in _untraced_threads or self._skip(frame, event, arg):
             return
 
         self._call(frame, event, arg)
 
+    def _profile_all_threads(self, frame, event, arg):
+        if not self._attached:
+            sys.setprofile(None)
+            return
+
+        self(frame, event, arg)
+
     @abc.abstractmethod
     def _call(self, frame, event, arg):
         ...
 
+    def _start_monitoring(self):
+        monitoring = sys.monitoring
+        monitoring.use_tool_id(_TOOL_ID, "panopticon")
+        self._monitoring = True
+
+        events = monitoring.events
+        callbacks = {
+            events.PY_START: self._on_py_start,
+            events.PY_RESUME: self._on_py_start,
+            events.PY_THROW: self._on_py_throw,
+            events.PY_RETURN: self._on_py_return,
+            events.PY_YIELD: self._on_py_yield,
+            events.PY_UNWIND: self._on_py_unwind,
+            events.CALL: self._on_call,
+            events.C_RETURN: self._on_c_return,
+            events.C_RAISE: self._on_c_raise,
+        }
+        mask = 0
+        for event, callback in callbacks.items():
+            monitoring.register_callback(_TOOL_ID, event, callback)
+            mask |= event
+        self._monitored_events = tuple(callbacks)
+
+        # Code disabled by a previous session may not be skipped this time
+        monitoring.restart_events()
+        monitoring.set_events(_TOOL_ID, mask)
+
+    def _stop_monitoring(self):
+        monitoring = sys.monitoring
+        monitoring.set_events(_TOOL_ID, 0)
+        # Freeing the tool keeps its callbacks, and with them this tracer
+        for event in self._monitored_events:
+            monitoring.register_callback(_TOOL_ID, event, None)
+        monitoring.free_tool_id(_TOOL_ID)
+        self._monitoring = False
+
+    # sys.monitoring callbacks, translated into setprofile events. They're
+    # called from the frame that's being monitored.
+
+    def _on_py_start(self, code, offset):
+        if get_ident() in _untraced_threads:
+            return None
+
+        frame = sys._getframe(1)
+        if self._skip(frame, "call", None):
+            return self._skipped
+        self._call(frame, "call", None)
+
+    def _on_py_throw(self, code, offset, exception):
+        if get_ident() not in _untraced_threads:
+            self(sys._getframe(1), "call", None)
+
+    def _on_py_return(self, code, offset, retval):
+        if get_ident() in _untraced_threads:
+            return None
+
+        frame = sys._getframe(1)
+        if self._skip(frame, "return", retval):
+            return self._skipped
+        self._call(frame, "return", retval)
+
+    def _on_py_yield(self, code, offset, retval):
+        if get_ident() in _untraced_threads:
+            return None
+
+        frame = sys._getframe(1)
+        if self._skip(frame, "yield", retval):
+            return self._skipped
+        self._call(frame, "yield", retval)
+
+    def _on_py_unwind(self, code, offset, exception):
+        if get_ident() not in _untraced_threads:
+            self(sys._getframe(1), "return", None)
+
+    def _on_call(self, code, offset, fn, arg0):
+        # Python functions report their own PY_START
+        if not isinstance(fn, _NATIVE_TYPES):
+            return None
+        if get_ident() in _untraced_threads:
+            return None
+
+        frame = sys._getframe(1)
+        if self._skip(frame, "c_call", fn):
+            return self._skipped
+        self._call(frame, "c_call", fn)
+
+    def _on_c_return(self, code, offset, fn, arg0):
+        if isinstance(fn, _NATIVE_TYPES) and (
+            get_ident() not in _untraced_threads
+        ):
+            self(sys._getframe(1), "c_return", fn)
+
+    def _on_c_raise(self, code, offset, fn, arg0):
+        if isinstance(fn, _NATIVE_TYPES) and (
+            get_ident() not in _untraced_threads
+        ):
+            self(sys._getframe(1), "c_exception", fn)
+
+
+_MONITORING = hasattr(sys, "monitoring")
+if _MONITORING:
+    _TOOL_ID = sys.monitoring.PROFILER_ID
+    _DISABLE = sys.monitoring.DISABLE
+
+# Tracers started with all_threads that attach() installs
+_attachable: List[Tracer] = []
+
+
+def attach():
+    """Traces the calling thread with the tracer last started with
+    all_threads, if it isn't already.
+
+    Only needed before Python 3.12, where tracing can't be installed on
+    threads that are already running: call it from their loops, e.g.
+    before every task a worker thread picks up.
+    """
+    if _attachable and sys.getprofile() is not _attachable[-1]._profile:
+        sys.setprofile(_attachable[-1]._profile)
+
+
+# co_qualname names the defining class, without looking at locals
+_QUALNAMES = sys.version_info >= (3, 11)
+
+# What setprofile reports as c_call
+_NATIVE_TYPES = (
+    types.BuiltinFunctionType,
+    types.MethodDescriptorType,
+    types.ClassMethodDescriptorType,
+    types.WrapperDescriptorType,
+    types.MethodWrapperType,
+)
+
 
 class FunctionTracer(Tracer):
-    _RETURN_KEY = "[return value]"
+    """Records a duration event for every function call.
+
+    With `deferred`, only a reference to the code object is recorded
+    while tracing, and names are worked out once per code object when
+    the trace is serialized (see _get_code_name).
+
+    With `min_duration` (in seconds), calls are held back until they
+    return and only written if they took at least that long. Calls that
+    are dropped are counted in the end event of their caller. Calls whose
+    start had to be written already, to keep events nested around a flow
+    event, are always ended.
+
+    With `complete`, every call is written as a single "X" event with
+    its duration once it returns, instead of separate begin and end
+    events. Calls still running when tracing stops are written as "B".
+
+    Arguments of the calls matching `capture_args` are formatted by
+    `capture`, an ArgumentCapture that keeps them short by default.
+
+    With `allocations`, an AllocationTracker, the memory allocated by
+    calls is measured with tracemalloc and added to their end events.
+
+    Names are cached per code object: on 3.11+ the class is taken from
+    co_qualname, before that from the type of `self`.
+    """
 
-    def __init__(self, trace=None, skip=None, capture_args=None):
-        super().__init__(trace, skip)
+    _RETURN_KEY = "[return value]"
+    _DROPPED_KEY = "[dropped calls]"
+    _NAME_CACHE_SIZE = 4096
+
+    def __init__(
+        self,
+        trace=None,
+        skip=None,
+        capture_args=None,
+        deferred=False,
+        min_duration: Optional[float] = None,
+        complete=False,
+        capture: Optional[ArgumentCapture] = None,
+        all_threads: bool = False,
+        allocations: Optional[AllocationTracker] = None,
+    ):
+        super().__init__(trace, skip, all_threads)
         self._state = threading.local()
         self._state.active = None
-        self._capture_args = capture_args
-        self._name_cache = {}
+        self._capture_args = capture_args and memoize(capture_args)
+        self._capture = capture or ArgumentCapture()
+        self._allocations = allocations
+        self._deferred = deferred
+        self._name_cache: Dict[Hashable, str] = {}
+        self._frame_names: Dict[types.FrameType, str] = {}
+        self._symbol_cache = {}
+
+        self._min_duration = (
+            None if min_duration is None else int(min_duration * 1e9)
+        )
+        self._complete = complete
+        self._pending = min_duration is not None or complete
+        self._pending_lock = threading.Lock()
+        # Threads are only kept track of while they hold calls back
+        self._pending_stacks: Dict[int, List[_PendingCall]] = {}
+
+    def start(self):
+        if self._allocations is not None:
+            self._allocations.start()
+        return super().start()
 
     def stop(self):
         super().stop()
+        if self._allocations is not None:
+            self._allocations.stop()
 
-        # Prevent leaking frames
+        # Don't keep code and classes alive after tracing
         self._name_cache.clear()
+        self._frame_names.clear()
+
+    def _flush(self):
+        # Unfinished calls are written out as they are
+        with self._pending_lock:
+            for stack in self._pending_stacks.values():
+                self._write_pending(stack)
+
+        super()._flush()
 
     def _call(self, frame, event, arg):
+        if self._allocations is None:
+            self._record_call(frame, event, arg)
+            return
+
+        # The memory the tracer uses for its events isn't the calls'
+        self._allocations.pause()
+        self._record_call(frame, event, arg)
+        self._allocations.resume(frame, event, arg)
+
+    def _record_call(self, frame, event, arg):
         code = frame.f_code
 
         if event == "call" or event == "c_call":
             ph = Phase.Duration.START
-        elif event == "return" or event == "c_return":
+        elif event == "return" or event == "yield" or event == "c_return":
             ph = Phase.Duration.END
+        elif event == "c_exception" and self._pending:
+            ph = Phase.Duration.END  # Keeps the pending stack balanced
         else:
-            ph = None
+            return
 
-        # Names on .*return events are superfluous but helpful
-        # for debugging and testing.
-        if event == "c_call" or event == "c_return":
-            name = str(arg)
-            cat = "c function"
-        elif event == "call" or event == "return":
+        args = self._capture_arguments(frame, event, arg)
+        if self._allocations is not None:
+            args = self._allocations.measure(frame, event, arg, args)
+
+        if self._deferred:
+            if event == "c_call" or event == "c_return":
+                # Bound methods would keep their receivers alive
+                key = arg if _is_module_function(arg) else str(arg)
+            else:
+                key = code
+
+            if not self._pending:
+                self._trace.add_code_event(key, ph, args, self._symbol)
+                return
+
+            name, cat = self._symbol(key)
+        elif event == "call" or event == "return" or event == "yield":
+            # Names on .*return events are superfluous but helpful
+            # for debugging and testing.
             name = self._name(frame, event, arg)
             cat = f"{code.co_filename}:{code.co_firstlineno}"
         else:
-            name = None
-            cat = None
-
-        if ph:
-            self._trace.add_event(
-                DurationTraceEvent(
-                    name=name,
-                    cat=cat,
-                    ph=ph,
-                    args=self._capture_arguments(frame, event, arg),
-                )
+            name = str(arg)
+            cat = "c function"
+
+        trace_event = DurationTraceEvent(name=name, cat=cat, ph=ph, args=args)
+        if not self._pending:
+            self._trace.add_event(trace_event)
+        elif ph == Phase.Duration.START:
+            self._pending_stack().append(_PendingCall(trace_event))
+        else:
+            self._end_pending(trace_event)
+
+    def _add_event(self, event):
+        """Writes events that aren't calls, along with their callers"""
+        if self._pending and not self._complete:
+            self._write_pending(getattr(self._state, "pending", ()))
+        self._trace.add_event(event)
+
+    def _pending_stack(self) -> List["_PendingCall"]:
+        try:
+            return self._state.pending
+        except AttributeError:
+            stack = self._state.pending = []
+            with self._pending_lock:
+                self._pending_stacks[get_ident()] = stack
+            return stack
+
+    def _end_pending(self, event):
+        stack = getattr(self._state, "pending", None)
+        if not stack:
+            # Started before tracing did
+            self._trace.add_event(event)
+            return
+
+        call = stack.pop()
+        if not stack:
+            del self._state.pending
+            with self._pending_lock:
+                self._pending_stacks.pop(get_ident(), None)
+
+        start = call.start
+        if (
+            self._min_duration is not None
+            and not call.written
+            and event.ts - start.ts < self._min_duration
+        ):
+            if stack:
+                stack[-1].dropped += call.dropped + 1
+            return
+
+        if call.dropped:
+            event.args = {
+                **(event.args or {}),
+                self._DROPPED_KEY: call.dropped,
+            }
+
+        if self._complete and not call.written:
+            if start.args and event.args:
+                args = {**start.args, **event.args}
+            else:
+                args = start.args or event.args
+
+            complete = CompleteTraceEvent(
+                name=start.name, cat=start.cat, args=args
             )
+            complete.ts, complete.tts = start.ts, start.tts
+            complete.pid, complete.tid = start.pid, start.tid
+            complete.dur = event.ts - start.ts
+            self._trace.add_event(complete)
+            return
+
+        self._write_pending(stack)
+        if not call.written:
+            self._trace.add_event(start)
+        self._trace.add_event(event)
+
+    def _write_pending(self, stack):
+        """Writes the start of every call on stack that's still held"""
+        for call in stack:
+            if not call.written:
+                call.written = True
+                self._trace.add_event(call.start)
 
     def _capture_arguments(
         self, frame, event, arg
@@ -115,41 +489,92 @@ class FunctionTracer(Tracer):
             return None
 
         if event == "call":
+            return self._capture.arguments(frame)
+
+        if event == "return" or event == "yield":
             return {
-                key: self._safe_repr(key, val)
-                for key, val in frame.f_locals.items()
+                self._RETURN_KEY: self._capture.format(self._RETURN_KEY, arg)
             }
 
-        if event == "return":
-            return {self._RETURN_KEY: self._safe_repr(self._RETURN_KEY, arg)}
-
         return None
 
-    @staticmethod
-    def _safe_repr(key, val) -> str:
-        try:
-            return repr(val)
-        except Exception:
-            logger.exception(f"Couldn't represent value for {key}")
-
-        try:
-            return str(val)
-            logger.exception(f"Couldn't stringify value for {key}")
-        except Exception:
-            return "<couldn't convert>"
+    _safe_repr = staticmethod(safe_repr)
 
     def _name(self, frame, event, arg):
-        name = self._name_cache.get(frame)
-        if not name:
-            name = self._get_frame_name(frame)
+        """Names frames, without looking at their locals where possible"""
+        code = frame.f_code
+        if _QUALNAMES:
+            try:
+                return self._name_cache[code]
+            except KeyError:
+                return self._cache_name(code, self._get_code_name(code))
+
+        # The receiver decides the class, and may be rebound by the time
+        # the frame returns: stick to the name it was called with. Frames
+        # are kept rather than their ids, which are reused once they're
+        # freed, should an exit be missed.
+        name = self._frame_names.get(frame)
+        if name is None:
+            key = (code, type(frame.f_locals.get("self")))
+            name = self._name_cache.get(key) or self._cache_name(
+                key, self._get_frame_name(frame)
+            )
 
-        if event == "c_return" or event == "return":
-            self._name_cache.pop(frame, None)
+        if self._is_frame_finished(frame, event, arg):
+            self._frame_names.pop(frame, None)
         else:
-            self._name_cache[frame] = name
+            self._frame_names[frame] = name
 
         return name
 
+    def _cache_name(self, key, name: str) -> str:
+        if len(self._name_cache) >= self._NAME_CACHE_SIZE:
+            del self._name_cache[next(iter(self._name_cache))]
+        self._name_cache[key] = name
+        return name
+
+    def _is_frame_finished(self, frame, event, arg):
+        return event == "return"
+
+    def _symbol(self, key):
+        """Memoized name and category for code passed to add_code_event"""
+        try:
+            return self._symbol_cache[key]
+        except KeyError:
+            if isinstance(key, types.CodeType):
+                symbol = (
+                    self._get_code_name(key),
+                    f"{key.co_filename}:{key.co_firstlineno}",
+                )
+            else:
+                symbol = (str(key), "c function")
+
+            self._symbol_cache[key] = symbol
+            return symbol
+
+    @classmethod
+    def _get_code_name(cls, code) -> str:
+        """Names code without looking at a frame.
+
+        The class is taken from co_qualname where it's available (3.11+),
+        which names the defining class instead of the receiver's type.
+        """
+        classname = cls._get_qualname_class(code)
+        classname = "." + classname if classname else ""
+        module = cls._get_filename_module(code.co_filename)
+        return f"{module}{classname}.{code.co_name}"
+
+    @staticmethod
+    def _get_qualname_class(code) -> Optional[str]:
+        qualname = getattr(code, "co_qualname", None)
+        if not isinstance(qualname, str):
+            return None
+
+        parts = qualname.split(".")
+        if len(parts) < 2 or parts[-2] == "<locals>":
+            return None
+        return parts[-2]
+
     @classmethod
     def _get_frame_name(cls, frame):
         code = frame.f_code
@@ -179,9 +604,10 @@ class FunctionTracer(Tracer):
     @classmethod
     def _get_module_name(cls, frame) -> str:
         """Some heuristics to get useful names for modules"""
-        code = frame.f_code
-        filename = code.co_filename
+        return cls._get_filename_module(frame.f_code.co_filename)
 
+    @staticmethod
+    def _get_filename_module(filename) -> str:
         module, _ = os.path.splitext(os.path.basename(filename))
 
         if module == "__init__" or module == "__main__":
@@ -192,6 +618,21 @@ class FunctionTracer(Tracer):
         return module
 
 
+class _PendingCall:
+    """A call whose start is held back until its duration is known"""
+
+    __slots__ = ("start", "dropped", "written")
+
+    def __init__(self, start: DurationTraceEvent):
+        self.start = start
+        self.dropped = 0
+        self.written = False
+
+
+def _is_module_function(fn) -> bool:
+    return isinstance(getattr(fn, "__self__", None), types.ModuleType)
+
+
 _CODE_FLAGS = {}
 for flag, name in dis.COMPILER_FLAG_NAMES.items():
     _CODE_FLAGS[name] = flag
@@ -199,7 +640,9 @@ for flag, name in dis.COMPILER_FLAG_NAMES.items():
 
 class AsyncioTracer(FunctionTracer):
 
-    RETURN_OPCODE = opcode.opmap["RETURN_VALUE"]  # 83
+    YIELD_OPCODE = opcode.opmap["YIELD_VALUE"]
+    # Awaiting leaves f_lasti just before YIELD_FROM, up to 3.10
+    YIELD_FROM_OPCODE = opcode.opmap.get("YIELD_FROM")
 
     CONTINUABLE_CODE_TYPES = [
         "GENERATOR",
@@ -212,20 +655,43 @@ class AsyncioTracer(FunctionTracer):
     for flag in CONTINUABLE_CODE_TYPES:
         CONTINUABLE_CODE_FLAGS |= _CODE_FLAGS[flag]
 
-    def __init__(self, trace=None, skip=None, capture_args=None):
-        super().__init__(trace, skip, capture_args)
+    def __init__(
+        self,
+        trace=None,
+        skip=None,
+        capture_args=None,
+        deferred=False,
+        min_duration: Optional[float] = None,
+        complete=False,
+        capture: Optional[ArgumentCapture] = None,
+        all_threads: bool = False,
+        allocations: Optional[AllocationTracker] = None,
+    ):
+        super().__init__(
+            trace,
+            skip,
+            capture_args,
+            deferred,
+            min_duration,
+            complete,
+            capture,
+            all_threads,
+            allocations,
+        )
         self._ids = set()
 
-    def _call(self, frame, event, arg):
+    def _record_call(self, frame, event, arg):
         code = frame.f_code
         frame_id = id(frame)
 
-        if event == "return" and self._is_continuable_code(code):
-            if self._is_frame_finished(frame, arg):
+        if (event == "return" or event == "yield") and (
+            self._is_continuable_code(code)
+        ):
+            if self._is_frame_finished(frame, event, arg):
                 self._ids.discard(frame_id)
             else:
                 self._ids.add(frame_id)
-                self._trace.add_event(
+                self._add_event(
                     FlowTraceEvent(
                         name=code.co_name,
                         cat=self._code_category(code),
@@ -235,11 +701,11 @@ class AsyncioTracer(FunctionTracer):
                     )
                 )
 
-        super()._call(frame, event, arg)
+        super()._record_call(frame, event, arg)
 
         # Emit the end point after starting the run
         if id(frame) in self._ids and event == "call":
-            self._trace.add_event(
+            self._add_event(
                 FlowTraceEvent(
                     name=code.co_name,
                     cat=self._code_category(code),
@@ -249,23 +715,24 @@ class AsyncioTracer(FunctionTracer):
                 )
             )
 
-    def _name(self, frame, event, arg):
-        name = self._name_cache.get(frame)
-        if not name:
-            name = self._get_frame_name(frame)
+    def _is_frame_finished(self, frame, event, arg):
+        if self._monitoring:
+            # Suspending is reported as PY_YIELD rather than PY_RETURN
+            return event == "return"
 
-        if self._is_frame_finished(frame, arg):
-            self._name_cache.pop(frame, None)
-        else:
-            self._name_cache[frame] = name
+        if event != "return":
+            return False
 
-        return name
-
-    @classmethod
-    def _is_frame_finished(cls, frame, arg):
-        code = frame.f_code
+        # Returns that don't suspend the frame end it, exceptions included
+        code = frame.f_code.co_code
         offset = frame.f_lasti
-        return code.co_code[offset] == cls.RETURN_OPCODE
+        if code[offset] == self.YIELD_OPCODE:
+            return False
+        return not (
+            self.YIELD_FROM_OPCODE is not None
+            and offset + 2 < len(code)
+            and code[offset + 2] == self.YIELD_FROM_OPCODE
+        )
 
     @classmethod
     def _is_continuable_code(cls, code):
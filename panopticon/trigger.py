@@ -0,0 +1,210 @@
+#!/bin/env python3
+
+"""
+Captures traces of slow calls only.
+
+Events are held in memory while a trigger call runs on a thread, and
+written to a trace file of their own if the call turns out to be slow,
+or dropped otherwise. Triggers are either functions decorated with
+trigger(), which only trace while they run, or calls matched by the
+predicate of a TriggerTracer.
+"""
+
+import functools
+import json
+import os
+import re
+import sys
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from panopticon.clock import default_clock
+from panopticon.predicate import Predicate, memoize
+from panopticon.trace import Trace, TraceEvent, event_dict
+from panopticon.tracer import FunctionTracer
+from panopticon.version import version
+
+
+class TriggeredTrace(Trace):
+    """Writes out the events of each slow trigger call to its own file.
+
+    A call is slow if it took at least `threshold` seconds, or, with
+    `percentile`, longer than that percentile of the last `window` calls
+    of the same trigger (once there were that many). Each capture keeps
+    at most `max_events` events.
+
+    Files are named by formatting `path` with the name of the trigger,
+    the pid and the number of the capture (`{name}`, `{pid}`, `{n}`), and
+    listed in `captures`. Events outside of trigger calls are ignored.
+    """
+
+    def __init__(
+        self,
+        path: str = "slow-{name}-{pid}-{n}.trace",
+        threshold: Optional[float] = None,
+        percentile: Optional[float] = None,
+        window: int = 1000,
+        max_events: int = 100000,
+    ):
+        super().__init__()
+        if threshold is None and percentile is None:
+            raise ValueError("Needs a threshold or a percentile")
+
+        self.captures: List[str] = []
+
+        self._path = path
+        self._threshold = None if threshold is None else threshold * 1e9
+        self._percentile = percentile
+        self._window = window
+        self._max_events = max_events
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._durations: Dict[str, Deque[int]] = {}
+        self._cutoffs: Dict[str, int] = {}
+        self._calls: Dict[str, int] = {}
+
+    def add_event(self, event: TraceEvent):
+        try:
+            events = self._local.events
+        except AttributeError:
+            return
+
+        if events is not None and len(events) < self._max_events:
+            events.append(event)
+
+    def begin(self, name: str):
+        """Starts capturing the calling thread, unless it already is"""
+        local = self._local
+        if getattr(local, "events", None) is not None:
+            local.depth += 1
+            return
+
+        local.events = []
+        local.depth = 1
+        local.name = name
+        local.start = default_clock.now()
+
+    def end(self) -> Optional[str]:
+        """Ends the capture begun by the matching begin(), and writes it
+        out if it was slow, returning the file name"""
+        local = self._local
+        depth = getattr(local, "depth", 0)
+        if not depth:
+            return None  # Tracing started during the trigger call
+
+        local.depth = depth - 1
+        if local.depth:
+            return None
+
+        duration = default_clock.now() - local.start
+        events, local.events = local.events, None
+        if not self._is_slow(local.name, duration):
+            return None
+
+        return self._write(local.name, duration, events)
+
+    def _is_slow(self, name: str, duration: int) -> bool:
+        slow = self._threshold is not None and duration >= self._threshold
+        if self._percentile is None:
+            return slow
+
+        with self._lock:
+            try:
+                durations = self._durations[name]
+            except KeyError:
+                durations = self._durations[name] = deque(maxlen=self._window)
+            durations.append(duration)
+
+            # Sorting the window every call would cost more than tracing,
+            # so the cutoff is only refreshed every tenth of a window
+            calls = self._calls[name] = self._calls.get(name, 0) + 1
+            cutoff = self._cutoffs.get(name)
+            if len(durations) == self._window and (
+                cutoff is None or calls % max(self._window // 10, 1) == 0
+            ):
+                ordered = sorted(durations)
+                index = int(len(ordered) * self._percentile / 100)
+                cutoff = ordered[min(index, len(ordered) - 1)]
+                self._cutoffs[name] = cutoff
+
+        return slow or (cutoff is not None and duration > cutoff)
+
+    def _write(self, name: str, duration: int, events) -> str:
+        with self._lock:
+            n = len(self.captures)
+            path = self._path.format(
+                name=re.sub(r"[^\w.-]", "_", name), pid=os.getpid(), n=n
+            )
+            self.captures.append(path)
+
+        with open(path, "w") as out:
+            json.dump(
+                {
+                    "traceEvents": [event_dict(x) for x in events],
+                    "displayTimeUnit": "ns",
+                    "otherData": {
+                        "version": f"Panopticon {version}",
+                        "trigger": name,
+                        "duration ms": duration / 1e6,
+                    },
+                },
+                out,
+            )
+        return path
+
+
+def trigger(trace: TriggeredTrace, skip: Optional[Predicate] = None):
+    """Makes calls of the decorated function triggers for trace.
+
+    The calling thread is only traced while the function runs, so
+    nothing is traced, and nothing costs anything, outside of it.
+    """
+
+    def decorator(fn):
+        tracer = FunctionTracer(trace, skip)
+        name = f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            previous = sys.getprofile()
+            if previous is None:
+                sys.setprofile(tracer)
+            trace.begin(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                trace.end()
+                if previous is None:
+                    sys.setprofile(None)
+
+        return wrapper
+
+    return decorator
+
+
+class TriggerTracer(FunctionTracer):
+    """Traces into a TriggeredTrace, treating calls of code matching
+    `trigger` as triggers.
+
+    Everything is traced all the time, but only trigger calls are kept.
+    Generators and coroutines can't be triggers, their calls end when
+    they first suspend.
+    """
+
+    def __init__(
+        self, trace: TriggeredTrace, trigger: Predicate, skip=None, **kwargs
+    ):
+        super().__init__(trace, skip, **kwargs)
+        self._trigger = memoize(trigger)
+
+    def _record_call(self, frame, event, arg):
+        if event == "call" and self._trigger(frame, event, arg):
+            self._trace.begin(self._name(frame, event, arg))
+            super()._record_call(frame, event, arg)
+        elif event == "return" and self._trigger(frame, event, arg):
+            super()._record_call(frame, event, arg)
+            self._trace.end()
+        else:
+            super()._record_call(frame, event, arg)
@@ -0,0 +1,93 @@
+#!/bin/env python3
+
+"""
+Compares the per-event cost of a skip predicate built from nested
+lambdas (how panopticon used to combine predicates) with the same
+predicate compiled by panopticon.predicate.compile_predicate.
+
+    PYTHONPATH=. python3 scripts/bench_predicate.py
+"""
+
+import inspect
+import sys
+import timeit
+
+from panopticon.predicate import (
+    FilePrefix,
+    Module,
+    compile_predicate,
+    extract_module,
+    memoize,
+    native,
+    not_,
+    or_,
+)
+
+ITERATIONS = 200000
+
+LIBRARIES = ["/usr/lib/python3", "/opt/venv/site-packages", sys.base_prefix]
+MODULES = ["panopticon", "asyncio", "concurrent", "logging"]
+
+
+def lambda_chain():
+    """The predicate as nested or_/and_/not_ lambdas around file()"""
+
+    def file(f):
+        return lambda frame, event, arg: f(frame.f_code.co_filename)
+
+    def or_(f1, f2):
+        return lambda *args, **kwargs: f1(*args, **kwargs) or f2(
+            *args, **kwargs
+        )
+
+    def not_(f):
+        return lambda *args, **kwargs: not f(*args, **kwargs)
+
+    predicate = lambda frame, event, arg: event in ("c_call", "c_return")
+    for prefix in LIBRARIES:
+        predicate = or_(predicate, file(lambda f, p=prefix: f.startswith(p)))
+    for module in MODULES:
+        predicate = or_(
+            predicate, file(lambda f, m=module: extract_module(f) == m)
+        )
+    return not_(predicate)
+
+
+def node_tree():
+    """The same predicate built from Nodes"""
+    predicate = native()
+    for prefix in LIBRARIES:
+        predicate = or_(predicate, FilePrefix(prefix))
+    for module in MODULES:
+        predicate = or_(predicate, Module(module))
+    return not_(predicate)
+
+
+def measure(predicate) -> float:
+    frame = inspect.currentframe()
+    seconds = timeit.timeit(
+        lambda: predicate(frame, "call", None), number=ITERATIONS
+    )
+    return seconds / ITERATIONS * 1e9
+
+
+def main():
+    chain = lambda_chain()
+    compiled = compile_predicate(node_tree())
+    frame = inspect.currentframe()
+    assert chain(frame, "call", None) == compiled(frame, "call", None)
+
+    results = {
+        "lambda chain": measure(chain),
+        "compiled": measure(compiled),
+        "compiled + memoized": measure(memoize(node_tree())),
+    }
+    baseline = results["lambda chain"]
+    for name, ns in results.items():
+        print(f"{ns:8.1f} ns/event  {baseline / ns:5.1f}x  {name}")
+
+    print(f"\n{compiled.source}")
+
+
+if __name__ == "__main__":
+    main()
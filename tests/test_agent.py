@@ -0,0 +1,94 @@
+#!/bin/env python3
+
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from panopticon import agent
+from panopticon.tracer import attach
+from tests.utils import parse_json_trace
+
+
+def spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def traced_function():
+    pass
+
+
+class TestAgent(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.socket = os.path.join(self.tempdir.name, "agent.sock")
+        self.agent = agent.install(self.socket)
+
+    def tearDown(self):
+        agent.uninstall()
+        self.tempdir.cleanup()
+
+    def request(self, command, **options):
+        return agent.request(self.socket, command, **options)
+
+    def test_start_and_stop(self):
+        path = os.path.join(self.tempdir.name, "trace.json")
+        self.assertEqual(self.request("status"), {"tracing": False})
+
+        response = self.request("start", path=path)
+        self.assertEqual(response, {"tracing": True, "path": path})
+        attach()  # Existing threads join on their own before 3.12
+        traced_function()
+        self.assertEqual(self.request("stop"), {"path": path})
+        traced_function()
+
+        (contents,) = self.request("fetch")["traces"]
+        names = [x["name"] for x in parse_json_trace(contents)]
+        self.assertEqual(names.count("test_agent.traced_function"), 2)
+
+    def test_sampling(self):
+        path = os.path.join(self.tempdir.name, "trace.json")
+        self.request("start", path=path, sample_hz=1000)
+        spin(0.05)
+        self.request("stop")
+
+        (contents,) = self.request("fetch")["traces"]
+        names = [x["name"] for x in parse_json_trace(contents)]
+        self.assertIn("test_agent.spin", names)
+
+    def test_errors(self):
+        self.assertEqual(
+            self.request("stop"), {"error": "RuntimeError: Not tracing"}
+        )
+        self.assertIn("error", self.request("explode"))
+        self.assertEqual(self.request("status"), {"tracing": False})
+
+    def test_start_options(self):
+        path = os.path.join(self.tempdir.name, "trace.json")
+        self.assertEqual(
+            self.request("start", path=path, skip=["x"]),
+            {
+                "error": "ValueError: Use skip_modules or skip_prefixes "
+                "instead of skip"
+            },
+        )
+        status = self.request("start", path=path, all_threads=False)
+        self.assertIs(status["all_threads"], False)
+        self.request("stop")
+
+    def test_socket_is_private(self):
+        self.assertEqual(os.stat(self.socket).st_mode & 0o777, 0o600)
+        self.assertEqual(os.listdir(self.tempdir.name), ["agent.sock"])
+
+    def test_umask_untouched(self):
+        agent.uninstall()
+        with patch("os.umask", side_effect=AssertionError):
+            agent.install(self.socket)
+        self.assertEqual(self.request("status"), {"tracing": False})
+
+    def test_uninstall_removes_socket(self):
+        agent.uninstall()
+        self.assertFalse(os.path.exists(self.socket))
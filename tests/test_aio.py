@@ -0,0 +1,221 @@
+#!/bin/env python3
+
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from panopticon import record_trace
+from panopticon.aio import LoopTracer, TaskTracer
+from tests.utils import parse_json_trace, record
+
+
+async def child():
+    await asyncio.sleep(0)
+    return 1
+
+
+async def parent():
+    task = asyncio.create_task(child(), name="the child")
+    return await task
+
+
+def blocking():
+    time.sleep(0.02)
+
+
+if sys.version_info >= (3, 8):
+
+    class TestTaskTracer(unittest.IsolatedAsyncioTestCase):
+        async def test_tasks_are_async_events(self):
+            with TaskTracer() as tt:
+                await asyncio.create_task(parent())
+
+            tasks = [
+                (x["name"], x["ph"], x["id"])
+                for x in record(tt.get_trace()).events()
+                if x["cat"] == "asyncio.task"
+            ]
+            self.assertEqual(
+                tasks,
+                [
+                    ("parent", "b", 1),
+                    ("child", "b", 2),
+                    ("child", "e", 2),
+                    ("parent", "e", 1),
+                ],
+            )
+
+        async def test_task_details(self):
+            with TaskTracer() as tt:
+                await asyncio.create_task(parent())
+
+            events = list(tt.get_trace().events())
+            start, end = [
+                x
+                for x in events
+                if x["cat"] == "asyncio.task" and x["name"] == "child"
+            ]
+            self.assertRegex(start["args"]["created at"], r"test_aio\.py:\d+$")
+            self.assertEqual(
+                end["args"], {"task": "the child", "state": "done"}
+            )
+
+        async def test_flows_link_tasks(self):
+            with TaskTracer() as tt:
+                await asyncio.create_task(parent())
+
+            flows = [
+                (x["name"], x["ph"], x["id"])
+                for x in tt.get_trace().events()
+                if x["ph"] in ("s", "f")
+            ]
+            self.assertEqual(
+                flows,
+                [
+                    ("spawn", "s", 2),  # parent creates child
+                    ("spawn", "f", 2),
+                    ("await", "s", 2),  # child returns to parent
+                    ("await", "f", 2),
+                    ("await", "s", 1),  # parent returns to the test
+                ],
+            )
+
+        async def test_steps(self):
+            with TaskTracer() as tt:
+                await asyncio.create_task(child())
+
+            steps = [
+                x["ph"]
+                for x in tt.get_trace().events()
+                if x["cat"] == "asyncio.step"
+            ]
+            self.assertEqual(steps, ["B", "E", "B", "E"])
+
+        async def test_cancelled(self):
+            with TaskTracer() as tt:
+                task = asyncio.create_task(asyncio.sleep(10))
+                await asyncio.sleep(0)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+
+            end = [x for x in tt.get_trace().events() if x["ph"] == "e"]
+            self.assertEqual(end[0]["args"]["state"], "cancelled")
+
+        async def test_stop_restores_factory(self):
+            loop = asyncio.get_running_loop()
+            factory = loop.get_task_factory()
+            with TaskTracer():
+                self.assertIsNotNone(loop.get_task_factory())
+            self.assertIs(loop.get_task_factory(), factory)
+            self.assertEqual(await asyncio.create_task(child()), 1)
+
+        async def test_looks_like_coroutine(self):
+            with TaskTracer():
+                task = asyncio.create_task(child())
+
+            coro = task.get_coro()
+            self.assertEqual(coro.__name__, "child")
+            self.assertEqual(coro.__qualname__, "child")
+            self.assertIs(coro.cr_code, child.__code__)
+            self.assertFalse(coro.cr_running)
+            self.assertIsNone(coro.cr_await)
+            self.assertIsNotNone(coro.cr_frame)
+            self.assertIn("child()", repr(task))
+
+            self.assertEqual(await task, 1)
+            self.assertIsNone(coro.cr_frame)
+
+    class TestLoopTracer(unittest.IsolatedAsyncioTestCase):
+        async def test_callbacks(self):
+            loop = asyncio.get_running_loop()
+            with LoopTracer(slow_callback=0.01) as lt:
+                loop.call_soon(blocking)
+                await asyncio.create_task(child())
+
+            events = list(record(lt.get_trace()).events())
+            callbacks = [x["name"] for x in events if x["ph"] == "X"]
+            self.assertIn("blocking", callbacks)
+            self.assertIn("child", callbacks)
+
+            slow = [x for x in events if x["ph"] == "i"]
+            self.assertEqual(len(slow), 1)
+            self.assertEqual(slow[0]["args"]["callback"], "blocking")
+            self.assertGreaterEqual(slow[0]["args"]["duration ms"], 20)
+
+        async def test_loop_counters(self):
+            with LoopTracer(lag_interval=0.001) as lt:
+                await asyncio.sleep(0.02)
+
+            counters = {}
+            for x in lt.get_trace().events():
+                if x["ph"] == "C":
+                    counters.setdefault(x["name"], []).append(x["args"])
+
+            loop = "asyncio.loop (MainThread)"
+            self.assertEqual(
+                set(counters),
+                {f"{loop} ready", f"{loop} select ms", f"{loop} lag ms"},
+            )
+            self.assertTrue(
+                all(list(x) == ["ready"] for x in counters[f"{loop} ready"])
+            )
+            self.assertEqual(
+                len(counters[f"{loop} ready"]),
+                len(counters[f"{loop} select ms"]),
+            )
+
+        async def test_ready_counts_io(self):
+            loop = asyncio.get_running_loop()
+            reader, writer = socket.socketpair()
+            received = asyncio.Event()
+            loop.add_reader(reader, received.set)
+            try:
+                with LoopTracer(lag_interval=1) as lt:
+                    threading.Timer(0.02, writer.send, (b"x",)).start()
+                    await asyncio.wait_for(received.wait(), 10)
+            finally:
+                loop.remove_reader(reader)
+                reader.close()
+                writer.close()
+
+            loop_name = "asyncio.loop (MainThread)"
+            ready = [
+                x["args"]["ready"]
+                for x in lt.get_trace().events()
+                if x["name"] == f"{loop_name} ready"
+            ]
+            waited = [
+                x["args"]["select ms"]
+                for x in lt.get_trace().events()
+                if x["name"] == f"{loop_name} select ms"
+            ]
+            woken = [n for n, ms in zip(ready, waited) if ms >= 10]
+            self.assertEqual(woken, [1])
+
+        async def test_stop_restores_loop(self):
+            run = asyncio.events.Handle._run
+            loop = asyncio.get_running_loop()
+            with LoopTracer():
+                self.assertIsNot(asyncio.events.Handle._run, run)
+                self.assertIn("select", loop._selector.__dict__)
+            self.assertIs(asyncio.events.Handle._run, run)
+            self.assertNotIn("select", loop._selector.__dict__)
+
+
+class TestRecordTrace(unittest.TestCase):
+    def test_instrument_loop(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "trace.json")
+            with record_trace(path, instrument_loop=True):
+                asyncio.run(child())
+
+            with open(path) as f:
+                events = parse_json_trace(f.read())
+
+        self.assertIn(("child", "X"), [(x["name"], x["ph"]) for x in events])
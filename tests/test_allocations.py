@@ -0,0 +1,140 @@
+#!/bin/env python3
+
+import tracemalloc
+import unittest
+
+from panopticon.allocations import AllocationTracker
+from panopticon.predicate import Custom
+from panopticon.tracer import FunctionTracer
+from tests.utils import record
+
+KEY = AllocationTracker.ALLOCATED_KEY
+
+
+def allocate(n):
+    return bytearray(n)
+
+
+def allocate_twice(n):
+    return allocate(n), allocate(n)
+
+
+def empty():
+    pass
+
+
+def call_empty(n):
+    for _ in range(n):
+        empty()
+
+
+def allocations(trace, suffix):
+    return [
+        x["args"][KEY]
+        for x in trace.events()
+        if x["name"].endswith(suffix) and x["ph"] == "E"
+    ]
+
+
+class TestAllocationTracker(unittest.TestCase):
+    def test_end_events(self):
+        allocations_tracker = AllocationTracker()
+        with FunctionTracer(allocations=allocations_tracker) as ft:
+            self.assertTrue(tracemalloc.is_tracing())
+            kept = allocate_twice(100000)
+        self.assertFalse(tracemalloc.is_tracing())
+
+        trace = record(ft.get_trace())
+        inner = allocations(trace, ".allocate")
+        self.assertEqual(len(inner), 2)
+        for allocated in inner:
+            self.assertGreaterEqual(allocated, 100000)
+            self.assertLess(allocated, 101000)
+
+        (outer,) = allocations(trace, ".allocate_twice")
+        self.assertGreaterEqual(outer, 200000)
+        self.assertEqual(len(kept), 2)
+
+    def test_excludes_tracer(self):
+        with FunctionTracer(allocations=AllocationTracker()) as ft:
+            call_empty(1000)
+
+        trace = record(ft.get_trace())
+        inner = allocations(trace, ".empty")
+        self.assertEqual(len(inner), 1000)
+        self.assertLess(sum(inner) / 1000, 100)
+
+        # Its 2000 events took several times that
+        (outer,) = allocations(trace, ".call_empty")
+        self.assertLess(outer, 100 * 1000)
+
+    def test_totals(self):
+        allocations_tracker = AllocationTracker()
+        with FunctionTracer(allocations=allocations_tracker):
+            for _ in range(3):
+                allocate(10000)
+
+        calls, allocated = allocations_tracker.totals()[
+            "test_allocations.allocate"
+        ]
+        self.assertEqual(calls, 3)
+        self.assertGreaterEqual(allocated, 30000)
+
+        report = allocations_tracker.report().splitlines()
+        self.assertIn("bytes/call", report[0])
+        self.assertTrue(report[1].endswith("test_allocations.allocate"))
+
+    def test_only(self):
+        is_allocate = Custom(
+            lambda frame, _2, _3: frame.f_code is allocate.__code__
+        )
+        with FunctionTracer(
+            allocations=AllocationTracker(only=is_allocate)
+        ) as ft:
+            allocate_twice(10)
+
+        trace = ft.get_trace()
+        self.assertEqual(len(allocations(trace, ".allocate")), 2)
+        self.assertEqual(
+            [
+                x["args"]
+                for x in trace.events()
+                if x["name"].endswith(".allocate_twice")
+            ],
+            [None, None],
+        )
+
+    def test_rate(self):
+        allocations_tracker = AllocationTracker(rate=0)
+        with FunctionTracer(allocations=allocations_tracker) as ft:
+            allocate(10)
+
+        self.assertEqual(allocations_tracker.totals(), {})
+        self.assertEqual({x["args"] for x in ft.get_trace().events()}, {None})
+
+    def test_keeps_tracemalloc_running(self):
+        tracemalloc.start()
+        try:
+            with FunctionTracer(allocations=AllocationTracker()):
+                allocate(10)
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+
+    def test_captured_arguments(self):
+        with FunctionTracer(
+            capture_args=lambda _1, _2, _3: True,
+            allocations=AllocationTracker(),
+            complete=True,
+        ) as ft:
+            allocate(10)
+
+        (call,) = [
+            x
+            for x in ft.get_trace().events()
+            if x["name"].endswith(".allocate")
+        ]
+        self.assertEqual(
+            set(call["args"]),
+            {"n", FunctionTracer._RETURN_KEY, KEY},
+        )
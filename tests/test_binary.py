@@ -0,0 +1,126 @@
+#!/bin/env python3
+
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from panopticon.binary import (
+    BinaryTrace,
+    BinaryTraceReader,
+    _read_varint,
+    _unzigzag,
+    _write_varint,
+    _zigzag,
+    convert,
+)
+from panopticon.trace import (
+    CompleteTraceEvent,
+    DurationTraceEvent,
+    FlowTraceEvent,
+    Phase,
+    StreamingTrace,
+    Trace,
+    event_dict,
+)
+from panopticon.tracer import AsyncioTracer
+from tests.utils import parse_json_trace
+
+
+class TestBinaryTrace(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "trace.bin")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_round_trip(self):
+        events = [
+            DurationTraceEvent(
+                name="a", cat="f.py:1", ph=Phase.Duration.START, args={"x": 1}
+            ),
+            FlowTraceEvent(name="a", cat="COROUTINE", id=1 << 40),
+            DurationTraceEvent(name="a", cat="f.py:1", ph=Phase.Duration.END),
+            CompleteTraceEvent(name="b", cat="f.py:2", dur=1500),
+        ]
+        with open(self.path, "wb") as out:
+            trace = BinaryTrace(out)
+            for event in events:
+                trace.add_event(event)
+            trace.close()
+
+        with BinaryTraceReader(self.path) as reader:
+            decoded = list(reader)
+
+        expected = json.loads(json.dumps([event_dict(x) for x in events]))
+        self.assertEqual(decoded, expected)
+
+    def test_ids_are_not_strings(self):
+        with open(self.path, "wb") as out:
+            trace = BinaryTrace(out)
+            for i in range(100):
+                trace.add_event(FlowTraceEvent(name="f", cat="c", id=i))
+            trace.close()
+
+        # name, cat and the binding point
+        self.assertEqual(len(trace._strings), 3)
+        with BinaryTraceReader(self.path) as reader:
+            self.assertEqual([x["id"] for x in reader], list(range(100)))
+
+    def test_smaller_than_json(self):
+        json_out = io.StringIO()
+        with open(self.path, "wb") as out:
+            binary_trace = BinaryTrace(out)
+            json_trace = StreamingTrace(json_out)
+            with AsyncioTracer(_Tee(binary_trace, json_trace)):
+                for x in range(100):
+                    sorted([x, 2, 1])
+            binary_trace.close()
+
+        self.assertLess(
+            os.path.getsize(self.path) * 5, len(json_out.getvalue())
+        )
+
+    def test_convert(self):
+        with open(self.path, "wb") as out:
+            with AsyncioTracer(BinaryTrace(out)):
+                sorted([3, 2, 1])
+
+        output = io.StringIO()
+        convert(self.path, output)
+        trace_json = parse_json_trace(output.getvalue())
+
+        names = [x["name"] for x in trace_json["traceEvents"]]
+        self.assertIn("<built-in function sorted>", names)
+
+    def test_rejects_other_files(self):
+        with open(self.path, "w") as out:
+            out.write("[]")
+
+        with self.assertRaises(ValueError):
+            BinaryTraceReader(self.path)
+
+    def test_varints(self):
+        for n in [0, 1, 127, 128, 300, 1 << 62]:
+            buffer = bytearray()
+            _write_varint(buffer, n)
+            self.assertEqual(_read_varint(buffer, 0), (n, len(buffer)))
+
+        for n in [0, 1, -1, 1000, -1000]:
+            self.assertEqual(_unzigzag(_zigzag(n)), n)
+
+
+class _Tee(Trace):
+    def __init__(self, *traces):
+        super().__init__()
+        self._traces = traces
+
+    def add_event(self, event):
+        for trace in self._traces:
+            trace.add_event(event)
+
+    def flush(self):
+        for trace in self._traces:
+            trace.flush()
@@ -0,0 +1,122 @@
+#!/bin/env python3
+
+import inspect
+import unittest
+
+from panopticon.capture import ArgumentCapture
+from panopticon.tracer import FunctionTracer
+from tests.utils import parse_json_trace, record
+
+
+def arguments(capture, *args, **kwargs):
+    def f(a, b=None, *rest, c=None, **options):
+        local = 1  # noqa: F841
+        return capture.arguments(inspect.currentframe())
+
+    return f(*args, **kwargs)
+
+
+class Expensive:
+    def __repr__(self):
+        raise AssertionError("Shouldn't be represented")
+
+
+class TestArgumentCapture(unittest.TestCase):
+    def test_only_parameters(self):
+        self.assertEqual(
+            arguments(ArgumentCapture(), 1, 2, 3, c="x", d=None),
+            {
+                "a": "1",
+                "b": "2",
+                "c": "'x'",
+                "rest": "(3,)",
+                "options": "{'d': None}",
+            },
+        )
+
+    def test_limits_values(self):
+        capture = ArgumentCapture(max_chars=20, max_items=3, max_depth=1)
+        self.assertEqual(
+            capture.format("x", list(range(100))), "[0, 1, 2, ...]"
+        )
+        self.assertEqual(capture.format("x", [[[1]]]), "[[...]]")
+        self.assertLessEqual(len(capture.format("x", "a" * 1000)), 20)
+        self.assertLessEqual(len(capture.format("x", 10**1000)), 20)
+
+    def test_limits_events(self):
+        capture = ArgumentCapture(max_bytes=10)
+        self.assertEqual(
+            arguments(capture, "abcdef", "ghijkl", c=1),
+            {"a": "'abcdef'", ArgumentCapture.TRUNCATED_KEY: "4"},
+        )
+
+    def test_limits_bytes(self):
+        capture = ArgumentCapture(max_bytes=10)
+        self.assertEqual(
+            arguments(capture, "\u00e9\u00e9\u00e9\u00e9"),
+            {ArgumentCapture.TRUNCATED_KEY: "5"},
+        )
+
+    def test_short_strings_limited(self):
+        capture = ArgumentCapture(max_chars=10)
+        self.assertLessEqual(len(capture.format("x", "\n" * 10)), 10)
+
+    def test_types_only(self):
+        capture = ArgumentCapture(types_only=True)
+        self.assertEqual(
+            arguments(capture, Expensive(), "x"),
+            {
+                "a": "Expensive",
+                "b": "str",
+                "c": "NoneType",
+                "rest": "tuple",
+                "options": "dict",
+            },
+        )
+
+    def test_instances_not_represented(self):
+        capture = ArgumentCapture()
+        self.assertRegex(
+            capture.format("x", Expensive()), r"^<Expensive at 0x[0-9a-f]+>$"
+        )
+        self.assertRegex(
+            capture.format("x", [1, Expensive()]),
+            r"^\[1, <Expensive at 0x[0-9a-f]+>\]$",
+        )
+
+    def test_failing_repr(self):
+        self.assertTrue(
+            ArgumentCapture(repr_types=[Expensive])
+            .format("x", Expensive())
+            .startswith("<Expensive instance at")
+        )
+
+    def test_repr_types(self):
+        class Point:
+            def __repr__(self):
+                return "Point(1, 2)"
+
+        self.assertEqual(
+            ArgumentCapture(repr_types=[Point]).format("x", Point()),
+            "Point(1, 2)",
+        )
+
+    def test_tracer(self):
+        def f(x):
+            return {i: str(i) for i in range(1000)}
+
+        with FunctionTracer(
+            capture_args=lambda _1, _2, _3: True,
+            capture=ArgumentCapture(max_items=2),
+        ) as ft:
+            f(list(range(1000)))
+
+        json_trace = parse_json_trace(str(record(ft.get_trace())))
+        start, end = [
+            x for x in json_trace["traceEvents"] if x["name"].endswith(".f")
+        ]
+        self.assertEqual(start["args"], {"x": "[0, 1, ...]"})
+        self.assertEqual(
+            end["args"],
+            {FunctionTracer._RETURN_KEY: "{0: '0', 1: '1', ...}"},
+        )
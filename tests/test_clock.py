@@ -0,0 +1,59 @@
+#!/bin/env python3
+
+import os
+import threading
+import time
+import unittest
+
+from panopticon.clock import Clock, _get_thread_id, measure_overhead
+
+
+class TestClock(unittest.TestCase):
+    def test_wall_time_anchor(self):
+        clock = Clock()
+        self.assertLess(abs(clock.now() - time.time_ns()), 10**7)
+
+    def test_monotonic(self):
+        clock = Clock()
+        stamps = [clock.now() for _ in range(100)]
+        self.assertEqual(stamps, sorted(stamps))
+
+    def test_identity_per_thread(self):
+        clock = Clock()
+        identities = []
+        thread = threading.Thread(
+            target=lambda: identities.append(clock.identity())
+        )
+        thread.start()
+        thread.join()
+
+        self.assertEqual(identities[0][0], os.getpid())
+        self.assertEqual(
+            identities[0][1], getattr(thread, "native_id", thread.ident)
+        )
+        self.assertEqual(clock.identity(), (os.getpid(), _get_thread_id()))
+
+    def test_thread_time_opt_in(self):
+        self.assertIsNone(Clock().stamp()[1])
+        self.assertIsInstance(Clock(thread_time=True).stamp()[1], int)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "Needs fork")
+    def test_identity_refreshed_after_fork(self):
+        clock = Clock()
+        clock.identity()
+
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(write, str(clock.identity()[0]).encode())
+            os._exit(0)
+
+        os.waitpid(pid, 0)
+        self.assertEqual(int(os.read(read, 32)), pid)
+        os.close(read)
+        os.close(write)
+
+    def test_measure_overhead(self):
+        overhead = measure_overhead(iterations=10)
+        self.assertEqual(len(overhead), 3)
+        self.assertTrue(all(x > 0 for x in overhead.values()))
@@ -0,0 +1,65 @@
+#!/bin/env python3
+
+import gc
+import os
+import tempfile
+import unittest
+
+from panopticon import record_trace
+from panopticon.clock import _get_thread_id
+from panopticon.collector import GCTracer
+from panopticon.trace import Trace
+from tests.utils import parse_json_trace, record
+
+
+class TestGCTracer(unittest.TestCase):
+    def test_collections(self):
+        with GCTracer(Trace()) as tracer:
+            cycle = []
+            cycle.append(cycle)
+            del cycle
+            gc.collect()
+            gc.collect(0)
+
+        events = list(record(tracer.get_trace()).events())
+        collections = [x for x in events if x["ph"] == "X"]
+        self.assertGreaterEqual(len(collections), 2)
+
+        full = [x for x in collections if x["name"] == "gc gen2"][0]
+        self.assertEqual(full["cat"], "gc")
+        self.assertEqual(full["tid"], _get_thread_id())
+        self.assertGreaterEqual(full["args"]["collected"], 1)
+        self.assertEqual(full["args"]["uncollectable"], 0)
+        self.assertGreater(full["dur"], 0)
+
+        summary = events[-1]
+        self.assertEqual(summary["name"], "gc summary")
+        self.assertEqual(summary["args"], tracer.summary())
+        self.assertEqual(summary["args"]["collections"], len(collections))
+        self.assertGreaterEqual(summary["args"]["gen2 collections"], 1)
+        self.assertAlmostEqual(
+            summary["args"]["total ms"],
+            sum(x["dur"] for x in collections) / 1e3,
+        )
+
+    def test_stops(self):
+        tracer = GCTracer(Trace())
+        with tracer:
+            pass
+        gc.collect()
+
+        self.assertNotIn(tracer._callback, gc.callbacks)
+        self.assertEqual(tracer.summary()["collections"], 0)
+
+    def test_record_trace(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "gc.trace")
+            with record_trace(path, trace_gc=True):
+                gc.collect()
+
+            with open(path) as f:
+                json_trace = parse_json_trace(record(f.read()))
+
+        self.assertIn(
+            "gc gen2", [x["name"] for x in json_trace if x["cat"] == "gc"]
+        )
@@ -0,0 +1,98 @@
+#!/bin/env python3
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import tracemalloc
+import unittest
+
+from panopticon import record_trace
+from panopticon.counters import CounterSampler
+from panopticon.trace import Trace
+from tests.utils import parse_json_trace, record
+
+
+def counters(trace, name):
+    return [
+        x["args"]
+        for x in trace.events()
+        if x["ph"] == "C" and x["name"] == name
+    ]
+
+
+class TestCounterSampler(unittest.TestCase):
+    def test_sample(self):
+        sampler = CounterSampler()
+        sampler.sample()
+        trace = sampler.get_trace()
+
+        self.assertEqual(
+            {x["name"] for x in trace.events()},
+            {"gc", "threads", "asyncio tasks"}
+            | ({"memory rss MB"} if sys.platform == "linux" else set()),
+        )
+        (collections,) = counters(trace, "gc")
+        self.assertEqual(list(collections), ["gen0", "gen1", "gen2"])
+        self.assertTrue(all(isinstance(x, int) for x in collections.values()))
+        self.assertEqual(
+            counters(trace, "threads"),
+            [{"threads": threading.active_count()}],
+        )
+
+    @unittest.skipUnless(sys.platform == "linux", "Needs /proc")
+    def test_memory(self):
+        sampler = CounterSampler()
+        sampler.sample()
+        tracemalloc.start()
+        try:
+            sampler.sample()
+        finally:
+            tracemalloc.stop()
+
+        trace = sampler.get_trace()
+        rss = counters(trace, "memory rss MB")
+        self.assertEqual(len(rss), 2)
+        self.assertEqual(list(rss[0]), ["rss"])
+        self.assertGreater(rss[0]["rss"], 1)
+
+        (traced,) = counters(trace, "memory tracemalloc MB")
+        self.assertEqual(list(traced), ["current", "peak"])
+
+    def test_asyncio_tasks(self):
+        sampler = CounterSampler()
+
+        async def main():
+            event = asyncio.Event()
+            tasks = [asyncio.create_task(event.wait()) for _ in range(3)]
+            await asyncio.sleep(0)
+            sampler.sample()
+            event.set()
+            await asyncio.gather(*tasks)
+            sampler.sample()
+
+        asyncio.run(main())
+        self.assertEqual(
+            counters(sampler.get_trace(), "asyncio tasks"),
+            [{"tasks": 4}, {"tasks": 1}],
+        )
+
+    def test_interval(self):
+        with CounterSampler(Trace(), interval=0.01) as sampler:
+            threading.Event().wait(0.1)
+
+        self.assertGreater(len(counters(sampler.get_trace(), "threads")), 3)
+
+    def test_record_trace(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "counters.trace")
+            with record_trace(path, counter_interval=0.01):
+                sum(range(10))
+
+            with open(path) as f:
+                json_trace = parse_json_trace(record(f.read()))
+
+        names = {x["name"] for x in json_trace if x["ph"] == "C"}
+        self.assertIn("gc", names)
+        self.assertIn("threads", names)
@@ -0,0 +1,64 @@
+#!/bin/env python3
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from tests.utils import parse_json_trace, record
+
+_SCRIPT = """
+import gc
+import time
+
+def work():
+    for _ in range(5):
+        gc.collect()
+        time.sleep(0.01)
+
+work()
+"""
+
+
+class TestMain(unittest.TestCase):
+    def test_instruments_untraced(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            script = os.path.join(tempdir, "script.py")
+            output = os.path.join(tempdir, "script.trace")
+            with open(script, "w") as f:
+                f.write(_SCRIPT)
+
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "panopticon",
+                    "--trace-gc",
+                    "--counter-interval",
+                    "0.001",
+                    "-o",
+                    output,
+                    script,
+                ],
+                cwd=Path(__file__).parent.parent,
+                check=True,
+            )
+
+            with open(output) as f:
+                json_trace = parse_json_trace(record(f.read()))
+
+        events = json_trace["traceEvents"]
+        tid = [x for x in events if x["name"] == "script.work"][0]["tid"]
+
+        # The sampler thread records counters (and any collection it
+        # happens to trigger), but never its own calls
+        self.assertEqual(
+            {x["cat"] for x in events if x["tid"] != tid} - {"gc"},
+            {"counters"},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
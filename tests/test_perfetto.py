@@ -0,0 +1,126 @@
+#!/bin/env python3
+
+import io
+import struct
+import unittest
+
+from panopticon.perfetto import PerfettoTrace
+from panopticon.trace import (
+    CompleteTraceEvent,
+    DurationTraceEvent,
+    FlowTraceEvent,
+    Phase,
+)
+
+
+class TestPerfettoTrace(unittest.TestCase):
+    def test_slices_on_thread_track(self):
+        output = io.BytesIO()
+        trace = PerfettoTrace(output)
+        start = DurationTraceEvent(
+            name="fn", cat="f.py:1", ph=Phase.Duration.START, args={"x": "1"}
+        )
+        trace.add_event(start)
+        trace.add_event(
+            DurationTraceEvent(name="fn", cat="f.py:1", ph=Phase.Duration.END)
+        )
+        trace.close()
+
+        packets = [_decode(x) for _, x in _fields(output.getvalue())]
+        descriptor, begin, end = packets
+
+        thread = _decode(_decode(descriptor[60][0])[4][0])
+        self.assertEqual(thread[1], [start.pid])
+        self.assertEqual(thread[2], [start.tid])
+
+        begin_event = _decode(begin[11][0])
+        self.assertEqual(begin_event[9], [1])  # TYPE_SLICE_BEGIN
+        interned = _decode(begin[12][0])
+        self.assertEqual(_decode(interned[2][0])[2], [b"fn"])
+        self.assertEqual(_decode(interned[1][0])[2], [b"f.py:1"])
+        annotation = _decode(begin_event[4][0])
+        self.assertEqual(annotation[6], [b"1"])
+
+        end_event = _decode(end[11][0])
+        self.assertEqual(end_event[9], [2])  # TYPE_SLICE_END
+        self.assertNotIn(10, end_event)  # No name needed
+        self.assertEqual(end[13], [2])  # Needs incremental state
+
+    def test_names_are_interned_once(self):
+        output = io.BytesIO()
+        trace = PerfettoTrace(output)
+        for _ in range(10):
+            trace.add_event(
+                DurationTraceEvent(
+                    name="fn", cat="f.py:1", ph=Phase.Duration.START
+                )
+            )
+        trace.close()
+
+        packets = [_decode(x) for _, x in _fields(output.getvalue())]
+        self.assertEqual(sum(1 for x in packets if 12 in x), 1)
+        self.assertLess(len(output.getvalue()) / 10, 40)
+
+    def test_complete_events(self):
+        output = io.BytesIO()
+        trace = PerfettoTrace(output)
+        event = CompleteTraceEvent(name="fn", cat="f.py:1", dur=1500)
+        trace.add_event(event)
+        trace.close()
+
+        _, begin, end = [_decode(x) for _, x in _fields(output.getvalue())]
+        self.assertEqual(begin[8], [event.ts])
+        self.assertEqual(_decode(begin[11][0])[9], [1])  # TYPE_SLICE_BEGIN
+        self.assertEqual(end[8], [event.ts + 1500])
+        self.assertEqual(_decode(end[11][0])[9], [2])  # TYPE_SLICE_END
+
+    def test_flows(self):
+        output = io.BytesIO()
+        trace = PerfettoTrace(output)
+        trace.add_event(FlowTraceEvent(name="a", cat="COROUTINE", id=1))
+        trace.add_event(
+            FlowTraceEvent(name="a", cat="COROUTINE", ph=Phase.Flow.END, id=1)
+        )
+        trace.close()
+
+        _, start, end = [_decode(x) for _, x in _fields(output.getvalue())]
+        self.assertEqual(_decode(start[11][0])[47], [1])
+        self.assertEqual(_decode(end[11][0])[48], [1])
+
+
+def _fields(data):
+    """Just enough of a protobuf decoder to check the encoding"""
+    pos = 0
+    while pos < len(data):
+        key, pos = _varint(data, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(data, pos)
+        elif wire == 1:
+            value = struct.unpack("<Q", data[pos : pos + 8])[0]
+            pos += 8
+        elif wire == 2:
+            length, pos = _varint(data, pos)
+            value = data[pos : pos + length]
+            pos += length
+        else:
+            raise ValueError(f"Unexpected wire type {wire}")
+        yield field, value
+
+
+def _decode(data):
+    result = {}
+    for field, value in _fields(data):
+        result.setdefault(field, []).append(value)
+    return result
+
+
+def _varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
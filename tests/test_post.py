@@ -125,6 +125,30 @@ class TestFlatten(unittest.TestCase):
             ],
         )
 
+    def test_flatten_complete_events(self):
+        starts = []
+        complete = []
+        for event in _sample_trace:
+            if event["ph"] == "B":
+                starts.append(event)
+                continue
+
+            start = starts.pop()
+            complete.append(
+                dict(start, ph="X", dur=event["ts"] - start["ts"])
+            )
+
+        flattened = record(_flatten_events(complete))
+        self.assertEqual(
+            [(x["name"], x["ph"]) for x in flattened],
+            [(x["name"], x["ph"]) for x in _sample_trace],
+        )
+        for event in flattened:
+            self.assertEqual(
+                event["ts"],
+                0 if event["ph"] == "B" else _CELL_WIDTH - _CELL_PADDING,
+            )
+
 
 _sample_trace = [
     {
@@ -0,0 +1,124 @@
+#!/bin/env python3
+
+import gc
+import inspect
+import unittest
+import weakref
+
+from panopticon.predicate import (
+    Custom,
+    FilePrefix,
+    Module,
+    Native,
+    and_,
+    cacheable,
+    compile_predicate,
+    file,
+    is_cacheable,
+    memoize,
+    module_equals,
+    native,
+    not_,
+    or_,
+)
+
+
+class TestPredicate(unittest.TestCase):
+    def test_memoized_per_code_and_event(self):
+        calls = []
+
+        @cacheable
+        def predicate(frame, event, arg):
+            calls.append(event)
+            return event == "call"
+
+        memoized = memoize(predicate)
+        frame = inspect.currentframe()
+        for _ in range(10):
+            self.assertTrue(memoized(frame, "call", None))
+            self.assertFalse(memoized(frame, "return", None))
+
+        self.assertEqual(calls, ["call", "return"])
+
+    def test_memoized_code_can_be_freed(self):
+        memoized = memoize(native())
+        namespace = {"inspect": inspect}
+        exec("def f():\n    return inspect.currentframe()", namespace)
+        frame = namespace["f"]()
+        self.assertFalse(memoized(frame, "call", None))
+
+        code = weakref.ref(frame.f_code)
+        del frame, namespace
+        gc.collect()
+        self.assertIsNone(code())
+
+    def test_uncacheable_not_memoized(self):
+        predicate = lambda frame, event, arg: frame.f_locals.get("x")
+        self.assertIs(memoize(predicate), predicate)
+
+    def test_builtin_predicates_are_cacheable(self):
+        self.assertTrue(is_cacheable(module_equals("panopticon")))
+        self.assertTrue(is_cacheable(file(lambda f: True)))
+        self.assertTrue(is_cacheable(native()))
+
+    def test_combinations(self):
+        frame_dependent = lambda frame, event, arg: True
+
+        self.assertTrue(is_cacheable(or_(native(), module_equals("x"))))
+        self.assertTrue(is_cacheable(not_(native())))
+        self.assertFalse(is_cacheable(and_(native(), frame_dependent)))
+        self.assertFalse(is_cacheable(not_(frame_dependent)))
+
+        frame = inspect.currentframe()
+        predicate = memoize(and_(module_equals("tests"), not_(native())))
+        self.assertTrue(predicate(frame, "call", None))
+        self.assertFalse(predicate(frame, "c_call", len))
+
+    def test_compiled_alternatives_are_merged(self):
+        predicate = compile_predicate(
+            or_(
+                or_(FilePrefix("/a"), Module("x")),
+                or_(FilePrefix("/b", "/c"), Module("y")),
+            )
+        )
+        self.assertEqual(predicate.source.count("startswith"), 1)
+        self.assertEqual(predicate.source.count("extract_module"), 1)
+
+        for filename, expected in [
+            ("/a/f.py", True),
+            ("/c/f.py", True),
+            ("/d/x/f.py", True),
+            ("/d/y/f.py", True),
+            ("/d/z/f.py", False),
+        ]:
+            frame = _Frame(filename)
+            self.assertEqual(bool(predicate(frame, "call", None)), expected)
+
+    def test_compiled_matches_nodes(self):
+        seen = []
+
+        def custom(frame, event, arg):
+            seen.append(event)
+            return arg == "yes"
+
+        predicate = (Native() & ~FilePrefix("/lib")) | Custom(custom)
+        self.assertFalse(is_cacheable(predicate))
+
+        compiled = compile_predicate(predicate)
+        self.assertTrue(compiled(_Frame("/src/f.py"), "c_call", None))
+        self.assertFalse(compiled(_Frame("/lib/f.py"), "c_call", None))
+        self.assertTrue(compiled(_Frame("/lib/f.py"), "call", "yes"))
+        self.assertEqual(seen, ["c_call", "call"])
+
+        # Nodes compile themselves when called directly
+        self.assertTrue(predicate(_Frame("/src/f.py"), "c_return", None))
+
+
+class _Code:
+    def __init__(self, filename):
+        self.co_filename = filename
+
+
+class _Frame:
+    def __init__(self, filename):
+        self.f_code = _Code(filename)
@@ -0,0 +1,138 @@
+#!/bin/env python3
+
+import json
+import os
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+from panopticon import record_trace
+from panopticon.ring import RingTrace
+from panopticon.trace import (
+    DurationTraceEvent,
+    FlowTraceEvent,
+    InstantTraceEvent,
+    Phase,
+)
+from panopticon.tracer import FunctionTracer
+
+
+class TestRingTrace(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "ring-{n}.trace")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_keeps_most_recent_events(self):
+        trace = RingTrace(self.path, capacity=4)
+        for i in range(10):
+            trace.add_event(InstantTraceEvent(name=f"e{i}", cat="c"))
+
+        self.assertEqual(
+            [x["name"] for x in trace.events()], ["e6", "e7", "e8", "e9"]
+        )
+
+    def test_orphaned_ends_dropped(self):
+        trace = RingTrace(self.path, capacity=3)
+        for name in ["a", "b"]:
+            trace.add_event(
+                DurationTraceEvent(name=name, cat="c", ph=Phase.Duration.START)
+            )
+        for name in ["b", "a"]:
+            trace.add_event(
+                DurationTraceEvent(name=name, cat="c", ph=Phase.Duration.END)
+            )
+
+        self.assertEqual(
+            [(x["name"], x["ph"]) for x in trace.events()],
+            [("b", "B"), ("b", "E")],
+        )
+
+    def test_extra_fields(self):
+        trace = RingTrace(self.path)
+        trace.add_event(FlowTraceEvent(name="f", cat="COROUTINE", id=7))
+
+        (event,) = trace.events()
+        self.assertEqual(event["id"], 7)
+        self.assertEqual(event["bp"], "e")
+
+    def test_window(self):
+        trace = RingTrace(self.path, window=0.05)
+        trace.add_event(InstantTraceEvent(name="old", cat="c"))
+        time.sleep(0.1)
+        trace.add_event(InstantTraceEvent(name="new", cat="c"))
+
+        self.assertEqual([x["name"] for x in trace.events()], ["new"])
+
+    def test_per_thread_rings(self):
+        trace = RingTrace(self.path, capacity=2)
+
+        def emit(name):
+            for _ in range(5):
+                trace.add_event(InstantTraceEvent(name=name, cat="c"))
+
+        thread = threading.Thread(target=emit, args=("thread",))
+        thread.start()
+        thread.join()
+        emit("main")
+
+        names = sorted(x["name"] for x in trace.events())
+        self.assertEqual(names, ["main", "main", "thread", "thread"])
+
+    def test_max_threads(self):
+        trace = RingTrace(self.path, capacity=1000, max_threads=4)
+        barrier = threading.Barrier(10)
+
+        def emit():
+            trace.add_event(InstantTraceEvent(name="e", cat="c"))
+            barrier.wait(10)
+
+        threads = [threading.Thread(target=emit) for _ in range(9)]
+        for thread in threads:
+            thread.start()
+        emit()
+        rings = len(trace._rings)
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(rings, 4)
+        self.assertEqual(trace.dropped, 6)
+        self.assertEqual(len(list(trace.events())), 4)
+        self.assertTrue(all(len(x.ts) == 1 for x in trace._rings.values()))
+
+    def test_deferred_names(self):
+        trace = RingTrace(self.path)
+        with FunctionTracer(trace, deferred=True):
+            sorted([2, 1])
+
+        names = [x["name"] for x in trace.events()]
+        self.assertIn("<built-in function sorted>", names)
+
+    @unittest.skipUnless(hasattr(signal, "SIGUSR2"), "Needs SIGUSR2")
+    def test_dump_on_signal(self):
+        trace = RingTrace(self.path).install()
+        try:
+            with FunctionTracer(trace):
+                os.kill(os.getpid(), signal.SIGUSR2)
+        finally:
+            trace.uninstall()
+
+        self.assertEqual(trace.dumps, 1)
+        with open(self.path.format(n=0)) as dump:
+            self.assertTrue(json.load(dump)["traceEvents"])
+
+    def test_record_trace_dumps_on_exception(self):
+        path = os.path.join(self.tempdir.name, "ring.trace")
+        with self.assertRaises(ZeroDivisionError):
+            with record_trace(path, mode="ring", capacity=10):
+                print("Hello")
+                1 / 0
+
+        with open(path) as dump:
+            events = json.load(dump)["traceEvents"]
+        self.assertLessEqual(len(events), 10)
+        self.assertTrue(events)
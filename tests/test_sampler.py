@@ -0,0 +1,79 @@
+#!/bin/env python3
+
+import io
+import os
+import tempfile
+import time
+import unittest
+
+from panopticon import record_trace
+from panopticon.clock import _get_thread_id
+from panopticon.sampler import Sampler
+from panopticon.trace import StreamingTrace
+from tests.utils import parse_json_trace, record
+
+
+class TestSampler(unittest.TestCase):
+    def test_consecutive_samples_are_merged(self):
+        sampler = Sampler()
+        outer(sampler, 3)
+        outer(sampler, 1)
+        sampler.sample()  # Returned from both
+
+        events = [
+            (x["name"], x["ph"])
+            for x in record(sampler.get_trace()).events()
+            if x["name"] in ("test_sampler.outer", "test_sampler.inner")
+        ]
+        self.assertEqual(
+            events,
+            [
+                ("test_sampler.outer", "B"),
+                ("test_sampler.inner", "B"),
+                ("test_sampler.inner", "E"),
+                ("test_sampler.outer", "E"),
+                ("test_sampler.outer", "B"),
+                ("test_sampler.inner", "B"),
+                ("test_sampler.inner", "E"),
+                ("test_sampler.outer", "E"),
+            ],
+        )
+
+    def test_events_belong_to_sampled_thread(self):
+        stream = io.StringIO()
+        with Sampler(record(StreamingTrace(stream)), hz=1000):
+            spin(0.05)
+
+        trace_json = parse_json_trace(stream.getvalue())
+        spins = [x for x in trace_json if x["name"] == "test_sampler.spin"]
+        self.assertEqual([x["ph"] for x in spins], ["B", "E"])
+        self.assertEqual(spins[0]["tid"], _get_thread_id())
+        self.assertNotIn(
+            "threading.Thread.join", [x["name"] for x in trace_json]
+        )
+
+    def test_record_trace(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "sampled.trace")
+            with record_trace(path, sample_hz=1000):
+                spin(0.05)
+
+            with open(path) as f:
+                trace_json = parse_json_trace(f.read())
+
+        self.assertIn("test_sampler.spin", [x["name"] for x in trace_json])
+
+
+def outer(sampler, samples):
+    inner(sampler, samples)
+
+
+def inner(sampler, samples):
+    for _ in range(samples):
+        sampler.sample()
+
+
+def spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        ...
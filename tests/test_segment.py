@@ -0,0 +1,99 @@
+#!/bin/env python3
+
+import json
+import os
+import tempfile
+import unittest
+
+from panopticon import record_trace
+from panopticon.segment import SegmentedTrace
+from panopticon.trace import DurationTraceEvent, InstantTraceEvent, Phase
+
+
+class TestSegmentedTrace(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "trace.json")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def load(self, path):
+        with open(path) as f:
+            return json.load(f)["traceEvents"]
+
+    def test_rolls_over_by_size(self):
+        trace = SegmentedTrace(self.path, max_bytes=300)
+        for i in range(20):
+            trace.add_event(InstantTraceEvent(name=f"e{i}", cat="c"))
+        trace.close()
+
+        self.assertGreater(len(trace.segments), 1)
+        self.assertEqual(
+            trace.segments[0],
+            os.path.join(self.tempdir.name, "trace.00000.json"),
+        )
+
+        names = []
+        for segment in trace.segments:
+            names.extend(x["name"] for x in self.load(segment))
+        self.assertEqual(names, [f"e{i}" for i in range(20)])
+
+    def test_rolls_over_by_time(self):
+        trace = SegmentedTrace(self.path, max_bytes=None, max_seconds=0)
+        for i in range(3):
+            trace.add_event(InstantTraceEvent(name=f"e{i}", cat="c"))
+        trace.close()
+
+        self.assertEqual(len(trace.segments), 4)
+        self.assertEqual(self.load(trace.segments[-1]), [])
+
+    def test_open_durations_carried_over(self):
+        trace = SegmentedTrace(self.path, max_bytes=1)
+        trace.add_event(
+            DurationTraceEvent(name="outer", cat="c", ph=Phase.Duration.START)
+        )
+        trace.add_event(InstantTraceEvent(name="i", cat="c"))
+        trace.add_event(
+            DurationTraceEvent(name="outer", cat="c", ph=Phase.Duration.END)
+        )
+        trace.close()
+
+        first, second, third, _ = [self.load(x) for x in trace.segments]
+        self.assertEqual(
+            [(x["name"], x["ph"]) for x in first],
+            [("outer", "B"), ("outer", "E")],
+        )
+        self.assertEqual(
+            [(x["name"], x["ph"]) for x in second],
+            [("outer", "B"), ("i", "i"), ("outer", "E")],
+        )
+        self.assertEqual(second[0]["ts"], first[0]["ts"])
+        self.assertEqual(
+            [(x["name"], x["ph"]) for x in third],
+            [("outer", "B"), ("outer", "E")],
+        )
+
+    def test_keeps_last_segments(self):
+        trace = SegmentedTrace(self.path, max_bytes=1, keep=2)
+        for i in range(5):
+            trace.add_event(InstantTraceEvent(name=f"e{i}", cat="c"))
+        trace.close()
+
+        self.assertEqual(
+            sorted(os.listdir(self.tempdir.name)),
+            ["trace.00004.json", "trace.00005.json"],
+        )
+
+    def test_record_trace(self):
+        def work():
+            pass
+
+        with record_trace(self.path, mode="segments", max_bytes=200) as trace:
+            for _ in range(5):
+                work()
+
+        names = []
+        for segment in trace.segments:
+            names.extend(x["name"] for x in self.load(segment))
+        self.assertEqual(names.count("test_segment.work"), 10)
@@ -0,0 +1,235 @@
+#!/bin/env python3
+
+import io
+import json
+import threading
+import time
+import unittest
+
+from panopticon.clock import configure
+from panopticon.trace import (
+    BufferedStreamingTrace,
+    DurationTraceEvent,
+    FlowTraceEvent,
+    InstantTraceEvent,
+    Overflow,
+    Phase,
+    StreamingTrace,
+    Trace,
+    event_dict,
+)
+from panopticon.tracer import FunctionTracer
+from tests.utils import parse_json_trace, record
+
+
+class TestTrace(unittest.TestCase):
+    def test_events_match_dataclasses(self):
+        trace = record(Trace())
+        expected = [
+            DurationTraceEvent(
+                name="a", cat="file.py:1", ph=Phase.Duration.START
+            ),
+            FlowTraceEvent(name="a", cat="COROUTINE", id=1337),
+            InstantTraceEvent(name="i", cat="file.py:2", args={"x": "1"}),
+            DurationTraceEvent(
+                name="a", cat="file.py:1", ph=Phase.Duration.END
+            ),
+        ]
+        for event in expected:
+            trace.add_event(event)
+
+        self.assertEqual(
+            json.loads(json.dumps(list(trace.events()))),
+            json.loads(json.dumps([event_dict(x) for x in expected])),
+        )
+
+    def test_strings_are_interned(self):
+        trace = Trace()
+        for _ in range(100):
+            trace.add_event(
+                DurationTraceEvent(
+                    name="repeated", cat="file.py:1", ph=Phase.Duration.START
+                )
+            )
+
+        self.assertEqual(len(trace._local.columns.intern), 3)
+
+    def test_ids_are_not_interned(self):
+        trace = Trace()
+        for i in range(100):
+            trace.add_event(FlowTraceEvent(name="f", cat="c", id=i))
+        trace.add_event(FlowTraceEvent(name="f", cat="c", id=-1))
+
+        # name, cat, ph and the binding point, plus the negative id
+        self.assertEqual(len(trace._local.columns.intern), 5)
+        self.assertEqual([x["id"] for x in trace.events()], [*range(100), -1])
+
+    def test_serialized_format(self):
+        trace = Trace()
+        trace.add_event(
+            DurationTraceEvent(name="a", cat="b", ph=Phase.Duration.START)
+        )
+
+        trace_json = json.loads(str(trace))
+        self.assertEqual(len(trace_json["traceEvents"]), 1)
+        self.assertEqual(trace_json["traceEvents"][0]["ph"], "B")
+        self.assertEqual(trace_json["displayTimeUnit"], "ns")
+
+    def test_times_in_microseconds(self):
+        trace = Trace()
+        event = DurationTraceEvent(name="a", cat="b", ph=Phase.Duration.START)
+        trace.add_event(event)
+
+        (serialized,) = trace.events()
+        self.assertEqual(serialized["ts"], event.ts / 1000)
+        self.assertNotIn("tts", serialized)
+
+    def test_thread_time_opt_in(self):
+        configure(thread_time=True)
+        try:
+            event = DurationTraceEvent(
+                name="a", cat="b", ph=Phase.Duration.START
+            )
+        finally:
+            configure(thread_time=False)
+
+        self.assertIsInstance(event.tts, int)
+        self.assertEqual(event_dict(event)["tts"], event.tts / 1000)
+
+    def test_threads_merged_by_timestamp(self):
+        trace = record(Trace())
+        run_threads(trace, threads=4, events=100)
+
+        timestamps = [x["ts"] for x in trace.events()]
+        self.assertEqual(len(timestamps), 400)
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual(len(trace._buffers), 4)
+
+    def test_subclasses_get_code_events(self):
+        class Collect(Trace):
+            def __init__(self):
+                super().__init__()
+                self.collected = []
+
+            def add_event(self, event):
+                self.collected.append(event)
+
+        trace = Collect()
+        with FunctionTracer(trace, deferred=True):
+            sorted([2, 1])
+
+        self.assertIn(
+            "<built-in function sorted>", [x.name for x in trace.collected]
+        )
+
+    def test_streams_have_no_events(self):
+        self.assertEqual(list(StreamingTrace(io.StringIO()).events()), [])
+
+
+class TestBufferedStreamingTrace(unittest.TestCase):
+    def test_events_written_on_flush(self):
+        output = io.StringIO()
+        trace = record(BufferedStreamingTrace(output, batch_size=3))
+        for i in range(10):
+            trace.add_event(
+                DurationTraceEvent(
+                    name=f"e{i}", cat="c", ph=Phase.Duration.START
+                )
+            )
+        trace.close()
+
+        json_trace = parse_json_trace(output.getvalue())
+        self.assertEqual(
+            [x["name"] for x in json_trace], [f"e{i}" for i in range(10)]
+        )
+        self.assertEqual(trace.dropped, 0)
+
+    def test_flush_interval(self):
+        output = io.StringIO()
+        trace = BufferedStreamingTrace(
+            output, batch_size=100, flush_interval=0.01
+        )
+        trace.add_event(
+            DurationTraceEvent(name="a", cat="c", ph=Phase.Duration.START)
+        )
+
+        for _ in range(100):
+            if '"a"' in output.getvalue():
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(len(parse_json_trace(output.getvalue())), 1)
+        trace.close()
+
+    def test_drop_when_full(self):
+        output = _BlockingStream()
+        trace = BufferedStreamingTrace(
+            output, batch_size=1, max_batches=1, overflow=Overflow.DROP
+        )
+        for _ in range(10):
+            trace.add_event(
+                DurationTraceEvent(name="a", cat="c", ph=Phase.Duration.START)
+            )
+        output.unblock.set()
+        trace.close()
+
+        written = len(parse_json_trace(output.getvalue()))
+        self.assertGreater(trace.dropped, 0)
+        self.assertEqual(written + trace.dropped, 10)
+
+    def test_spill_when_full(self):
+        output = io.StringIO()
+        trace = BufferedStreamingTrace(
+            output, batch_size=1, max_batches=1, overflow=Overflow.SPILL
+        )
+        for _ in range(100):
+            trace.add_event(
+                DurationTraceEvent(name="a", cat="c", ph=Phase.Duration.START)
+            )
+        trace.close()
+
+        self.assertEqual(len(parse_json_trace(output.getvalue())), 100)
+        self.assertEqual(trace.dropped, 0)
+
+    def test_threads_batch_separately(self):
+        output = io.StringIO()
+        trace = BufferedStreamingTrace(output, batch_size=10)
+        run_threads(trace, threads=4, events=95)
+        trace.close()
+
+        names = [x["name"] for x in parse_json_trace(output.getvalue())]
+        self.assertEqual(len(names), 380)
+        self.assertEqual(len(set(names)), 380)
+
+
+def run_threads(trace, threads, events):
+    """Adds events to trace from several threads at once"""
+
+    def add_events(n):
+        for i in range(events):
+            trace.add_event(
+                DurationTraceEvent(
+                    name=f"t{n}e{i}", cat="c", ph=Phase.Duration.START
+                )
+            )
+
+    workers = [
+        threading.Thread(target=add_events, args=(n,)) for n in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+class _BlockingStream(io.StringIO):
+    """Holds up the first write after the opening brace"""
+
+    def __init__(self):
+        super().__init__()
+        self.unblock = threading.Event()
+
+    def write(self, text):
+        if text != "[\n":
+            self.unblock.wait()
+        return super().write(text)
@@ -1,14 +1,21 @@
 #!/bin/env python3
 
 import asyncio
+import gc
 import inspect
 import io
+import queue
 import sys
+import threading
+import time
 import unittest
-from unittest.mock import Mock
+import weakref
+from unittest.mock import Mock, patch
 
+from panopticon.clock import _get_thread_id
+from panopticon.predicate import cacheable
 from panopticon.trace import StreamingTrace
-from panopticon.tracer import AsyncioTracer, FunctionTracer
+from panopticon.tracer import AsyncioTracer, FunctionTracer, attach
 from tests.utils import parse_json_trace, record
 
 
@@ -69,6 +76,323 @@ class TestTracer(unittest.TestCase):
                 trace_json[0][key], trace_json[-1][key],
             )
 
+    @unittest.skipUnless(sys.version_info >= (3, 11), "Needs co_qualname")
+    def test_deferred_names_match(self):
+        with FunctionTracer() as eager:
+            TabulaRasa().clear()
+        with FunctionTracer(deferred=True) as deferred:
+            TabulaRasa().clear()
+
+        self.assertEqual(len(deferred._symbol_cache), 0)
+
+        eager_events = [
+            x
+            for x in record(eager.get_trace()).events()
+            if x["name"].startswith("test_tracer")
+        ]
+        deferred_events = [
+            x
+            for x in record(deferred.get_trace()).events()
+            if x["name"].startswith("test_tracer")
+        ]
+        self.assertEqual(
+            [(x["name"], x["cat"], x["ph"]) for x in eager_events],
+            [(x["name"], x["cat"], x["ph"]) for x in deferred_events],
+        )
+
+        code = TabulaRasa.clear.__code__
+        self.assertEqual(
+            deferred_events[0]["name"], "test_tracer.TabulaRasa.clear"
+        )
+        self.assertEqual(
+            deferred_events[0]["cat"],
+            f"{code.co_filename}:{code.co_firstlineno}",
+        )
+
+    @unittest.skipUnless(sys.version_info >= (3, 11), "Needs co_qualname")
+    def test_names_cached_per_code(self):
+        with patch.object(
+            FunctionTracer, "_get_frame_name", side_effect=AssertionError
+        ):
+            with FunctionTracer() as ft:
+                for _ in range(10):
+                    TabulaRasa().clear()
+
+                self.assertIn(TabulaRasa.clear.__code__, ft._name_cache)
+
+        names = {
+            x["name"]
+            for x in record(ft.get_trace()).events()
+            if x["name"].startswith("test_tracer")
+        }
+        self.assertEqual(names, {"test_tracer.TabulaRasa.clear"})
+
+    def test_name_cache_is_bounded(self):
+        ft = FunctionTracer()
+        ft._NAME_CACHE_SIZE = 2
+        with ft:
+            some_function()
+            TabulaRasa().clear()
+            self.assertEqual(len(ft._name_cache), 2)
+
+    def test_deferred_streaming(self):
+        stream = io.StringIO()
+        trace = record(StreamingTrace(stream))
+
+        with FunctionTracer(trace, deferred=True) as ft:
+            some_function()
+
+        trace_json = parse_json_trace(stream.getvalue())
+        self.assertEqual(
+            [x["name"] for x in trace_json[:2]],
+            ["test_tracer.some_function", "test_tracer.inner_function"],
+        )
+        self.assertEqual(len(ft._symbol_cache), 2)
+
+    def test_min_duration(self):
+        with FunctionTracer(min_duration=0.005) as ft:
+            slow_function()
+
+        events = [
+            (x["name"], x["ph"], x["args"])
+            for x in record(ft.get_trace()).events()
+        ]
+        self.assertEqual(
+            events,
+            [
+                ("test_tracer.slow_function", "B", None),
+                ("<built-in function sleep>", "B", None),
+                ("<built-in function sleep>", "E", None),
+                (
+                    "test_tracer.slow_function",
+                    "E",
+                    {FunctionTracer._DROPPED_KEY: 2},
+                ),
+            ],
+        )
+
+    def test_complete(self):
+        with FunctionTracer(
+            capture_args=lambda _1, _2, _3: True, complete=True
+        ) as ft:
+            some_function()
+
+        events = [
+            x
+            for x in record(ft.get_trace()).events()
+            if x["name"].startswith("test_tracer")
+        ]
+        outer, inner = events  # Ordered by start time
+        self.assertEqual(
+            [(x["name"], x["ph"]) for x in events],
+            [
+                ("test_tracer.some_function", "X"),
+                ("test_tracer.inner_function", "X"),
+            ],
+        )
+        self.assertEqual(
+            inner["args"], {"x": "2", FunctionTracer._RETURN_KEY: "4"}
+        )
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(
+            outer["ts"] + outer["dur"], inner["ts"] + inner["dur"]
+        )
+
+    def test_min_duration_unfinished(self):
+        ft = FunctionTracer(min_duration=1, deferred=True).start()
+        stop_tracing(ft)
+
+        events = [
+            (x["name"], x["ph"]) for x in record(ft.get_trace()).events()
+        ]
+        self.assertEqual(events, [("test_tracer.stop_tracing", "B")])
+
+    def test_names_after_exceptions(self):
+        def gen_raises():
+            yield 1
+            raise ValueError
+
+        def other():
+            pass
+
+        with patch("panopticon.tracer._QUALNAMES", False):
+            with AsyncioTracer() as at:
+                for _ in range(10):
+                    with self.assertRaises(ValueError):
+                        list(gen_raises())
+                    other()
+
+        code = other.__code__
+        names = {
+            x["name"]
+            for x in at.get_trace().events()
+            if x["cat"] == f"{code.co_filename}:{code.co_firstlineno}"
+        }
+        self.assertEqual(names, {"test_tracer.other"})
+        self.assertEqual(len(at._frame_names), 0)
+
+    def test_pending_stacks_of_exited_threads(self):
+        with FunctionTracer(min_duration=1) as ft:
+            for _ in range(5):
+                thread = threading.Thread(target=some_function)
+                thread.start()
+                thread.join()
+
+        self.assertLessEqual(len(ft._pending_stacks), 2)
+
+    def test_min_duration_generator(self):
+        def numbers():
+            yield 1
+            yield 2
+
+        with AsyncioTracer(min_duration=1) as at:
+            list(numbers())
+
+        events = list(record(at.get_trace()).events())
+        starts = [x["name"] for x in events if x["ph"] == "B"]
+        ends = [x["name"] for x in events if x["ph"] == "E"]
+        self.assertIn("test_tracer.numbers", starts)
+        self.assertEqual(sorted(starts), sorted(ends))
+
+
+@unittest.skipUnless(hasattr(sys, "monitoring"), "Needs sys.monitoring")
+class TestMonitoringTracer(unittest.TestCase):
+    def test_skipped_code_is_disabled(self):
+        calls = []
+
+        @cacheable
+        def skip(frame, event, arg):
+            calls.append(frame.f_code.co_name)
+            return frame.f_code.co_name == "inner_function"
+
+        with FunctionTracer(skip=skip) as ft:
+            self.assertTrue(ft._monitoring)
+            for _ in range(100):
+                some_function()
+
+        self.assertEqual(calls.count("inner_function"), 2)  # Start, return
+        self.assertEqual(
+            [
+                x["name"]
+                for x in record(ft.get_trace()).events()
+                if x["name"].startswith("test_tracer")
+            ],
+            ["test_tracer.some_function"] * 200,
+        )
+
+    def test_uncacheable_skip_is_not_disabled(self):
+        calls = []
+
+        def skip(frame, event, arg):
+            calls.append(frame.f_code.co_name)
+            return frame.f_code.co_name == "inner_function"
+
+        with FunctionTracer(skip=skip):
+            for _ in range(100):
+                some_function()
+
+        self.assertEqual(calls.count("inner_function"), 200)
+
+    def test_falls_back_when_tool_is_taken(self):
+        tool = sys.monitoring.PROFILER_ID
+        sys.monitoring.use_tool_id(tool, "someone else")
+        try:
+            with FunctionTracer() as ft:
+                self.assertFalse(ft._monitoring)
+                self.assertIs(sys.getprofile(), ft)
+        finally:
+            sys.monitoring.free_tool_id(tool)
+
+    def test_stopped_tracer_is_released(self):
+        with FunctionTracer() as ft:
+            self.assertTrue(ft._monitoring)
+            some_function()
+
+        tracer = weakref.ref(ft)
+        del ft
+        gc.collect()
+        self.assertIsNone(tracer())
+
+    def test_generators_yield(self):
+        with AsyncioTracer() as at:
+            list(counter())
+
+        events = [
+            (x["name"], x["ph"])
+            for x in record(at.get_trace()).events()
+            if x["name"] in ("test_tracer.counter", "counter")
+        ]
+        self.assertEqual(
+            events,
+            [
+                ("test_tracer.counter", "B"),
+                ("counter", "s"),
+                ("test_tracer.counter", "E"),
+                ("test_tracer.counter", "B"),
+                ("counter", "f"),
+                ("counter", "s"),
+                ("test_tracer.counter", "E"),
+                ("test_tracer.counter", "B"),
+                ("counter", "f"),
+                ("test_tracer.counter", "E"),
+            ],
+        )
+        self.assertEqual(len(at._ids), 0)
+
+
+class TestAllThreads(unittest.TestCase):
+    TIMEOUT = 10
+
+    def setUp(self):
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.tasks.put(None)
+        self.thread.join(self.TIMEOUT)
+
+    def worker(self):
+        self.results.put(_get_thread_id())
+        for task in iter(self.tasks.get, None):
+            attach()
+            self.results.put(task())
+
+    def run_in_worker(self, task):
+        self.tasks.put(task)
+        return self.results.get(timeout=self.TIMEOUT)
+
+    def assert_traces_worker(self):
+        worker_id = self.results.get(timeout=self.TIMEOUT)
+        with FunctionTracer(all_threads=True) as ft:
+            self.run_in_worker(some_function)
+        self.assertIsNone(self.run_in_worker(sys.getprofile))
+        self.run_in_worker(TabulaRasa().clear)
+
+        tids = {
+            x["name"]: x["tid"]
+            for x in record(ft.get_trace()).events()
+            if x["name"].startswith("test_tracer.")
+        }
+        self.assertEqual(tids["test_tracer.some_function"], worker_id)
+        self.assertNotIn("test_tracer.TabulaRasa.clear", tids)
+
+    def test_existing_threads(self):
+        self.assert_traces_worker()
+
+    @unittest.skipUnless(
+        hasattr(threading, "setprofile_all_threads"), "Needs Python 3.12"
+    )
+    def test_setprofile_all_threads(self):
+        tool = sys.monitoring.PROFILER_ID
+        sys.monitoring.use_tool_id(tool, "someone else")
+        try:
+            with patch("tests.test_tracer.attach"):
+                self.assert_traces_worker()
+        finally:
+            sys.monitoring.free_tool_id(tool)
+
 
 if sys.version_info >= (3, 8):
 
@@ -107,6 +431,21 @@ class TabulaRasa:
         print("Exiting")
 
 
+def slow_function():
+    some_function()
+    time.sleep(0.01)
+
+
+def stop_tracing(tracer):
+    some_function()
+    tracer.stop()
+
+
+def counter():
+    yield 1
+    yield 2
+
+
 def some_function():
     inner_function(2)
 
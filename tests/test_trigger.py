@@ -0,0 +1,141 @@
+#!/bin/env python3
+
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from panopticon.predicate import Custom
+from panopticon.trigger import TriggeredTrace, TriggerTracer, trigger
+
+
+def inner(delay):
+    time.sleep(delay)
+
+
+def handle(delay):
+    inner(delay)
+
+
+class TestTriggeredTrace(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "{name}-{n}.json")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def load(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def test_threshold(self):
+        trace = TriggeredTrace(self.path, threshold=0.05)
+
+        @trigger(trace)
+        def request(delay):
+            handle(delay)
+
+        request(0)
+        self.assertEqual(trace.captures, [])
+        request(0.06)
+
+        self.assertEqual(len(trace.captures), 1)
+        self.assertIn("test_threshold.", trace.captures[0])
+        capture = self.load(trace.captures[0])
+        self.assertGreaterEqual(capture["otherData"]["duration ms"], 60)
+        names = [
+            x["name"].rpartition(".")[2]
+            for x in capture["traceEvents"]
+            if "sleep" not in x["name"]
+        ]
+        self.assertEqual(
+            names, ["request", "handle", "inner", "inner", "handle", "request"]
+        )
+
+    def test_not_traced_outside_of_triggers(self):
+        trace = TriggeredTrace(self.path, threshold=0)
+
+        @trigger(trace)
+        def request():
+            self.assertIsNotNone(sys.getprofile())
+
+        request()
+        self.assertIsNone(sys.getprofile())
+
+        self.assertEqual(len(trace.captures), 1)
+        self.assertEqual(
+            [
+                x["name"].rpartition(".")[2]
+                for x in self.load(trace.captures[0])["traceEvents"]
+            ],
+            [
+                "request",
+                "<built-in function getprofile>",
+                "<built-in function getprofile>",
+                "assertIsNotNone",
+                "assertIsNotNone",
+                "request",
+            ],
+        )
+
+    def test_percentile(self):
+        trace = TriggeredTrace(self.path, percentile=90, window=20)
+
+        # Nothing is slow until a whole window was seen
+        self.assertFalse(any(trace._is_slow("f", 10**9) for _ in range(19)))
+        for i in range(100):
+            trace._is_slow("f", 1000 + i % 10)
+
+        self.assertFalse(trace._is_slow("f", 1000))
+        self.assertTrue(trace._is_slow("f", 2000))
+        self.assertFalse(trace._is_slow("g", 2000))
+
+    def test_max_events(self):
+        trace = TriggeredTrace(self.path, threshold=0, max_events=2)
+
+        @trigger(trace)
+        def request():
+            for _ in range(10):
+                handle(0)
+
+        request()
+        self.assertEqual(len(self.load(trace.captures[0])["traceEvents"]), 2)
+
+    def test_tracer(self):
+        trace = TriggeredTrace(self.path, threshold=0.01)
+        is_handle = Custom(
+            lambda frame, _2, _3: frame.f_code is handle.__code__
+        )
+
+        with TriggerTracer(trace, is_handle):
+            inner(0.02)
+            handle(0)
+            handle(0.02)
+
+        self.assertEqual(len(trace.captures), 1)
+        self.assertIn("handle", trace.captures[0])
+        events = self.load(trace.captures[0])["traceEvents"]
+        self.assertTrue(events[0]["name"].endswith(".handle"))
+        self.assertTrue(events[-1]["name"].endswith(".handle"))
+
+    def test_tracing_starts_inside_trigger(self):
+        trace = TriggeredTrace(self.path, threshold=0)
+        is_request = Custom(
+            lambda frame, _2, _3: frame.f_code.co_name == "request"
+        )
+        tracers = []
+
+        def request():
+            if not tracers:
+                tracers.append(TriggerTracer(trace, is_request).start())
+            handle(0)
+
+        request()  # Returns from a call that wasn't seen to begin
+        request()
+        tracers[0].stop()
+
+        self.assertEqual(len(trace.captures), 1)
+        self.assertIn("request", trace.captures[0])